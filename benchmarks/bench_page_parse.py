@@ -0,0 +1,97 @@
+'''
+Compares parsing saved steam store pages with the per-field get_game_* functions (before)
+against the strained single pass extractor used by steamsales.parse_game_page (after).
+
+Usage: python benchmarks/bench_page_parse.py [directory of saved .html pages]
+'''
+import datetime
+import os
+import sys
+import time
+import tracemalloc
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(current_dir, '..', 'src'))
+
+from bs4 import BeautifulSoup
+import steamsales
+
+PAGES_DIR = os.path.join(current_dir, 'fixtures', 'pages')
+REPEATS = 20
+GAME_LINK = "https://store.steampowered.com/app/0/"
+
+def parse_before(html):
+    '''Parses a page the way steamsales did before the single pass extractor: the whole tree, then one search per field'''
+    soup = BeautifulSoup(html, 'html.parser')
+    game_url = steamsales.get_game_url(soup, GAME_LINK, True)
+    title = steamsales.get_game_title(soup, True)
+    description = steamsales.get_game_description(soup)
+    tags = [tag for tag in steamsales.get_game_tags(soup) if tag.strip()]
+    monthly_ratings, all_ratings = steamsales.get_game_ratings(soup, True)
+    discount_percent, original_price, discount_price = steamsales.get_game_price(soup)
+    is_on_sale = discount_price != None
+    end_date = steamsales.get_sale_end_date(soup) if is_on_sale else None
+    game_image = steamsales.get_game_image(soup)
+    game_developer = steamsales.get_game_developer(soup)
+    game_publisher = steamsales.get_game_publisher(soup)
+    scrape_date = datetime.date.today().strftime("%Y-%m-%d")
+
+    return steamsales.GameInfo(0, title, description, tags, monthly_ratings, all_ratings, original_price, is_on_sale, end_date, discount_percent, discount_price, game_url, game_image, game_developer, game_publisher, scrape_date)
+
+def parse_after(html):
+    '''Parses a page with the strained single pass extractor'''
+    return steamsales.parse_game_page(html, 0, GAME_LINK, True)
+
+def best_time(parse, html):
+    '''
+    Times a parser over a page
+
+    Args:
+        parse (function): The parser to time
+        html (String): The page to parse
+
+    Returns:
+        seconds (float): The fastest of REPEATS runs
+    '''
+    times = []
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        parse(html)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+def peak_memory(parse, html):
+    '''
+    Measures the peak memory allocated while parsing a page
+
+    Args:
+        parse (function): The parser to measure
+        html (String): The page to parse
+
+    Returns:
+        peak (int): Peak traced memory in bytes
+    '''
+    tracemalloc.start()
+    parse(html)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+def main(pages_dir):
+    pages = sorted(name for name in os.listdir(pages_dir) if name.endswith('.html'))
+
+    print(f"{'page':<24}{'size KB':>9}{'before ms':>11}{'after ms':>10}{'before KB':>11}{'after KB':>10}  identical")
+    for name in pages:
+        with open(os.path.join(pages_dir, name), encoding='utf-8') as f:
+            html = f.read()
+
+        identical = vars(parse_before(html)) == vars(parse_after(html))
+        before_ms = best_time(parse_before, html) * 1000
+        after_ms = best_time(parse_after, html) * 1000
+        before_kb = peak_memory(parse_before, html) / 1024
+        after_kb = peak_memory(parse_after, html) / 1024
+
+        print(f"{name:<24}{len(html) / 1024:>9.0f}{before_ms:>11.2f}{after_ms:>10.2f}{before_kb:>11.0f}{after_kb:>10.0f}  {identical}")
+
+if __name__ == '__main__':
+    main(sys.argv[1] if len(sys.argv) > 1 else PAGES_DIR)
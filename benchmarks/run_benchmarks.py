@@ -0,0 +1,256 @@
+'''
+Benchmarks the bot's hot paths over the recorded fixtures in benchmarks/fixtures:
+steam specials and game page parsing, Epic free games parsing, db_manager writes and
+stats against a seeded database, and embed construction.
+
+Each benchmark's best time is compared with benchmarks/baselines.json and the run
+fails when one is more than --threshold times slower than its baseline. Times are
+scaled by a fixed calibration workload so a slower or busier machine does not show
+up as a regression. Rerun with --update-baseline after an intentional change to a
+benchmarked path.
+
+Usage: python benchmarks/run_benchmarks.py [--update-baseline] [--threshold 1.5] [--only name]
+'''
+import argparse
+import datetime
+import json
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+src_dir = os.path.join(current_dir, '..', 'src')
+sys.path.insert(0, src_dir)
+
+from bs4 import BeautifulSoup
+import db_manager
+import embeds
+import epicgamesfree
+import migrate
+import steamsales
+
+FIXTURES_DIR = os.path.join(current_dir, 'fixtures')
+BASELINES_PATH = os.path.join(current_dir, 'baselines.json')
+DEFAULT_THRESHOLD = 1.5
+# Differences smaller than this are timer noise, not regressions
+MIN_REGRESSION_MS = 0.05
+MIN_SECONDS_PER_BENCHMARK = 0.3
+MIN_ITERATIONS = 5
+
+SEED_GAMES = 2000
+SEED_USERS = 2000
+SEED_RATINGS_PER_USER = 50
+SEED_TAGS = 200
+SEED_PRICES_PER_GAME = 50
+BENCH_USER = 1
+# A seeded game, for the calls that take a game id
+BENCH_GAME = 1
+
+def read_fixture(*path):
+    with open(os.path.join(FIXTURES_DIR, *path), encoding='utf-8') as f:
+        return f.read()
+
+def seed_database(path):
+    '''
+    Creates a database at path with the bot's schema and a realistic amount of data
+
+    Args:
+        path (string): Where to create the database
+
+    Returns:
+        None
+    '''
+    random.seed(2024)
+    db_manager.db_path = path
+    migrate.migrate_database()
+    db_manager.close_connections()
+
+    conn = sqlite3.connect(path)
+    conn.executemany("INSERT into game values (?,?,?,?,?)", ((game_id, f"Game {game_id}", "A game " * 20, "Developer", "Publisher") for game_id in range(1, SEED_GAMES + 1)))
+    conn.executemany("INSERT into game_rating (game_id,monthly_rating,all_rating,scrape_date) values (?,?,?,?)", ((game_id, 0.8, 0.9, "2026-01-01") for game_id in range(1, SEED_GAMES + 1)))
+    prices = []
+    for game_id in range(1, SEED_GAMES + 1):
+        for day in range(SEED_PRICES_PER_GAME):
+            on_sale = random.random() < 0.3
+            scraped_at = (datetime.datetime(2025, 1, 1) + datetime.timedelta(days=day * 7)).strftime("%Y-%m-%d %H:%M:%S")
+            prices.append((game_id, random.randint(500, 1499) if on_sale else 1999, "USD", int(on_sale), "2026-01-01" if on_sale else None, scraped_at))
+    conn.executemany("INSERT into price_history (game_id,price_cents,currency,is_on_sale,end_date,scraped_at) values (?,?,?,?,?,?)", prices)
+    conn.executemany("INSERT into tag (tag_name) values (?)", ((f"Tag {tag_id}",) for tag_id in range(1, SEED_TAGS + 1)))
+    conn.executemany("INSERT into game_tag (game_id, tag_id) values (?,?)", ((game_id, tag_id) for game_id in range(1, SEED_GAMES + 1) for tag_id in random.sample(range(1, SEED_TAGS + 1), 10)))
+    conn.executemany("INSERT into user values (?,?,?,?)", ((discord_id, "2026-01-01", "2026-01-01", "casual") for discord_id in range(1, SEED_USERS + 1)))
+
+    activity_types = ("playing", "completed", "dropped")
+    rows = []
+    for discord_id in range(1, SEED_USERS + 1):
+        for game_id in random.sample(range(1, SEED_GAMES + 1), SEED_RATINGS_PER_USER):
+            day = datetime.date(2024, 1, 1) + datetime.timedelta(days=random.randrange(700))
+            rows.append((discord_id, game_id, random.choice(activity_types), random.randint(1, 10), day.strftime("%Y-%m-%d")))
+    conn.executemany("INSERT into user_activity (discord_id, game_id, activity_type, rating, timestamp) values (?,?,?,?,?)", rows)
+
+    conn.commit()
+    conn.close()
+
+def measure(function):
+    '''
+    Times a function
+
+    Args:
+        function (function): The function to time, called with no arguments
+
+    Returns:
+        best (float): The fastest call in milliseconds, the least noisy estimate of its cost
+    '''
+    times = []
+    start = time.perf_counter()
+    while len(times) < MIN_ITERATIONS or time.perf_counter() - start < MIN_SECONDS_PER_BENCHMARK:
+        call_start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - call_start)
+    return min(times) * 1000
+
+def calibration_workload():
+    '''A fixed mix of string, dict and list work that stands in for how fast this machine runs python'''
+    counts = {}
+    for i in range(20000):
+        word = f"tag {i % 97}"
+        counts[word] = counts.get(word, 0) + 1
+    return sorted(counts.items(), key=lambda item: item[1])
+
+def is_regression(scaled, baseline, threshold):
+    '''Returns True if a scaled time is more than threshold times its baseline and by more than timer noise'''
+    return scaled / baseline > threshold and scaled - baseline > MIN_REGRESSION_MS
+
+def build_benchmarks(db_path):
+    '''
+    Builds every benchmark
+
+    Args:
+        db_path (string): The seeded database the db_manager benchmarks run against
+
+    Returns:
+        benchmarks (dict): Functions to time keyed by benchmark name
+    '''
+    benchmarks = {}
+
+    store_front = read_fixture('store_front.html')
+    benchmarks['steam.retrieve_top_5'] = lambda: steamsales.retrieve_top_5(store_front)
+
+    page = read_fixture('pages', 'app_1245620.html')
+    soup = BeautifulSoup(page, 'html.parser')
+    benchmarks['steam.parse_game_page'] = lambda: steamsales.parse_game_page(page, 1245620, "https://store.steampowered.com/app/1245620/", True)
+    benchmarks['steam.get_game_url'] = lambda: steamsales.get_game_url(soup, "https://store.steampowered.com/app/1245620/", True)
+    benchmarks['steam.get_game_title'] = lambda: steamsales.get_game_title(soup, True)
+    benchmarks['steam.get_game_description'] = lambda: steamsales.get_game_description(soup)
+    benchmarks['steam.get_game_tags'] = lambda: steamsales.get_game_tags(soup)
+    benchmarks['steam.get_game_ratings'] = lambda: steamsales.get_game_ratings(soup, True)
+    benchmarks['steam.get_game_price'] = lambda: steamsales.get_game_price(soup)
+    benchmarks['steam.get_sale_end_date'] = lambda: steamsales.get_sale_end_date(soup)
+    benchmarks['steam.get_game_image'] = lambda: steamsales.get_game_image(soup)
+    benchmarks['steam.get_game_developer'] = lambda: steamsales.get_game_developer(soup)
+    benchmarks['steam.get_game_publisher'] = lambda: steamsales.get_game_publisher(soup)
+
+    promotions = read_fixture('free_games_promotions.json')
+    benchmarks['epic.parse_free_games'] = lambda: epicgamesfree.parse_free_games(json.loads(promotions))
+    benchmarks['epic.decode_elements'] = lambda: epicgamesfree.parse_elements(epicgamesfree.decode_elements(promotions))
+
+    game = steamsales.parse_game_page(page, 1245620, "https://store.steampowered.com/app/1245620/", True)
+    specials = [steamsales.parse_game_page(page, game_id, "https://store.steampowered.com/app/1245620/", True) for game_id in range(5)]
+    free_games = epicgamesfree.parse_free_games(json.loads(promotions))
+    benchmarks['embeds.specials'] = lambda: [embeds.build_special_embed(special).to_dict() for special in specials]
+    benchmarks['embeds.freethisweek'] = lambda: [embeds.build_free_game_embed(free_game).to_dict() for free_game in free_games]
+    benchmarks['embeds.specials_cached'] = lambda: [embeds.special_renderer.render(special) for special in specials]
+    benchmarks['embeds.freethisweek_cached'] = lambda: [embeds.free_game_renderer.render(free_game) for free_game in free_games]
+
+    db_manager.db_path = db_path
+    new_game_ids = iter(range(SEED_GAMES + 1, SEED_GAMES + 1000000))
+
+    def add_game():
+        game.id = next(new_game_ids)
+        db_manager.add_game(game)
+
+    def update_game():
+        game.id = BENCH_GAME
+        db_manager.update_game(game)
+
+    benchmarks['db.add_game'] = add_game
+    benchmarks['db.update_game'] = update_game
+    benchmarks['db.get_rating_stats'] = lambda: db_manager.get_rating_stats(BENCH_USER)
+    benchmarks['db.get_rating_summary'] = lambda: db_manager.get_rating_summary(BENCH_USER)
+    benchmarks['db.get_price_vs_low'] = lambda: db_manager.get_price_vs_low(BENCH_GAME)
+    second_page = db_manager.get_ratings_page(BENCH_USER, 10)[1]
+    benchmarks['db.get_ratings_page'] = lambda: db_manager.get_ratings_page(BENCH_USER, 10, second_page)
+
+    return benchmarks
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the bot's parsing, database and embed paths")
+    parser.add_argument('--update-baseline', action='store_true', help="store this run's results as the new baselines")
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD, help="fail when a benchmark is this many times slower than its baseline")
+    parser.add_argument('--only', default=None, help="only run benchmarks whose name contains this text")
+    args = parser.parse_args()
+
+    baselines = {}
+    if os.path.exists(BASELINES_PATH):
+        with open(BASELINES_PATH) as f:
+            baselines = json.load(f)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        db_path = os.path.join(temp_dir, 'bench.db')
+        seed_database(db_path)
+        benchmarks = build_benchmarks(db_path)
+        # A hot query that stops using its index only shows up in the timings once the tables grow
+        scans = [name for name, (ok, plan) in migrate.check_query_plans().items() if not ok]
+
+        calibration = measure(calibration_workload)
+        # Baselines are stored in the units of the machine that recorded them
+        scale = baselines.get('_calibration', calibration) / calibration
+        results = {'_calibration': round(calibration, 4)}
+        regressions = []
+
+        print(f"{'benchmark':<28}{'best ms':>11}{'baseline ms':>13}{'ratio':>8}")
+        for name, function in benchmarks.items():
+            if args.only and args.only not in name:
+                continue
+
+            best = measure(function)
+            baseline = baselines.get(name)
+            if baseline and is_regression(best * scale, baseline, args.threshold):
+                # Measure again against a fresh calibration before blaming the code for a busy machine
+                scale = baselines.get('_calibration', calibration) / measure(calibration_workload)
+                best = min(best, measure(function))
+            results[name] = round(best, 4)
+
+            if baseline:
+                ratio = best * scale / baseline
+                regressed = is_regression(best * scale, baseline, args.threshold)
+                if regressed:
+                    regressions.append(name)
+                print(f"{name:<28}{best:>11.3f}{baseline:>13.3f}{ratio:>8.2f}{'  REGRESSION' if regressed else ''}")
+            else:
+                print(f"{name:<28}{best:>11.3f}{'-':>13}{'-':>8}")
+
+        db_manager.close_connections()
+
+    if args.update_baseline:
+        if args.only and '_calibration' in baselines:
+            # Keep the other baselines in the units they were recorded in
+            results = {name: round(best * scale, 4) for name, best in results.items() if name != '_calibration'}
+        baselines.update(results)
+        with open(BASELINES_PATH, 'w') as f:
+            json.dump(baselines, f, indent=4, sort_keys=True)
+            f.write('\n')
+        print(f"Stored baselines in {BASELINES_PATH}")
+        regressions = []
+    elif regressions:
+        print(f"{len(regressions)} benchmark(s) slower than {args.threshold}x their baseline: {', '.join(regressions)}")
+
+    if scans:
+        print(f"{len(scans)} hot query(s) scan a whole table instead of using an index: {', '.join(scans)}")
+    if regressions or scans:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
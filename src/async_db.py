@@ -0,0 +1,141 @@
+import asyncio
+import functools
+import queue
+import threading
+import time
+import db_manager
+import metrics
+
+class DatabaseThread:
+    '''Runs database calls one at a time on a dedicated thread so the event loop never waits on SQLite'''
+    def __init__(self):
+        self.requests = queue.Queue()
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        '''Starts the database thread if it is not running yet'''
+        with self.lock:
+            if self.thread == None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, name="database", daemon=True)
+                self.thread.start()
+
+    def stop(self):
+        '''Finishes the calls already queued, then stops the database thread'''
+        with self.lock:
+            thread = self.thread
+            self.thread = None
+        if thread != None:
+            self.requests.put(None)
+            thread.join()
+
+    def depth(self):
+        '''Returns how many calls are waiting for the database thread'''
+        return self.requests.qsize()
+
+    def _run(self):
+        while True:
+            request = self.requests.get()
+            if request == None:
+                return
+
+            loop, future, function, args, kwargs, queued_at = request
+            metrics.observe('db.queue_wait', time.perf_counter() - queued_at)
+            try:
+                result = function(*args, **kwargs)
+            except BaseException as e:
+                loop.call_soon_threadsafe(_set_exception, future, e)
+            else:
+                loop.call_soon_threadsafe(_set_result, future, result)
+
+    async def run(self, function, *args, **kwargs):
+        '''
+        Runs a function on the database thread
+
+        Args:
+            function (function): The function to run, e.g. db_manager.add_game
+            *args, **kwargs: Passed on to the function
+
+        Returns:
+            result (object): What the function returned. Exceptions it raised are raised here
+        '''
+        self.start()
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.requests.put((loop, future, function, args, kwargs, time.perf_counter()))
+        return await future
+
+def _set_result(future, result):
+    # The caller may have been cancelled while the call was running
+    if not future.done():
+        future.set_result(result)
+
+def _set_exception(future, exception):
+    if not future.done():
+        future.set_exception(exception)
+
+database_thread = DatabaseThread()
+metrics.register_gauges('db_queue', lambda: {'depth': database_thread.depth()})
+
+def run(function, *args, **kwargs):
+    '''Runs any database function on the database thread, e.g. "await async_db.run(migrate.migrate_database)"'''
+    return database_thread.run(function, *args, **kwargs)
+
+def stop():
+    '''Waits for the queued calls to finish and stops the database thread'''
+    database_thread.stop()
+
+def awaitable(function):
+    '''
+    Builds an awaitable version of a db_manager function that runs on the database thread
+
+    Args:
+        function (function): The db_manager function
+
+    Returns:
+        wrapper (function): An async function taking the same arguments
+    '''
+    @functools.wraps(function)
+    async def wrapper(*args, **kwargs):
+        return await database_thread.run(function, *args, **kwargs)
+    return wrapper
+
+def queued(function, keys):
+    '''
+    Builds an awaitable version of a db_manager write that goes through the write behind queue
+
+    Args:
+        function (function): The db_manager write function
+        keys (function): Called with the write's arguments, returns the keys the write changes
+
+    Returns:
+        wrapper (function): An async function taking the same arguments, which returns once the write is committed
+    '''
+    @functools.wraps(function)
+    async def wrapper(*args):
+        return await asyncio.wrap_future(db_manager.write_behind.submit(keys(*args), function, *args))
+    return wrapper
+
+tag_exists = awaitable(db_manager.tag_exists)
+rating_exists = awaitable(db_manager.rating_exists)
+game_exists = awaitable(db_manager.game_exists)
+add_game = awaitable(db_manager.add_game)
+update_game = awaitable(db_manager.update_game)
+add_rating = awaitable(db_manager.add_rating)
+update_rating = awaitable(db_manager.update_rating)
+get_rating_summary = awaitable(db_manager.get_rating_summary)
+get_ratings_page = awaitable(db_manager.get_ratings_page)
+get_rating_stats = awaitable(db_manager.get_rating_stats)
+user_exists = awaitable(db_manager.user_exists)
+rate_game = queued(db_manager.rate_game, lambda game, rating, activity_type, timestamp, discord_id: (('user', discord_id), ('game', game.id)))
+create_user = queued(db_manager.create_user, lambda discord_id, first_seen, last_online, playstyle: (('user', discord_id),))
+update_user = queued(db_manager.update_user, lambda discord_id, last_online, playstyle: (('user', discord_id),))
+save_games = queued(db_manager.save_games, lambda games: tuple(('game', game.id) for game in games))
+watch_game = queued(db_manager.watch_game, lambda discord_id, game, game_link, target_cents, price_cents: (('user', discord_id), ('game', game.id)))
+unwatch_game = queued(db_manager.unwatch_game, lambda discord_id, game_id: (('user', discord_id),))
+set_watches_notified = queued(db_manager.set_watches_notified, lambda updates: ())
+set_watches_last_price = queued(db_manager.set_watches_last_price, lambda updates: ())
+get_watched_games = awaitable(db_manager.get_watched_games)
+get_watches = awaitable(db_manager.get_watches)
+get_posted_promotions = awaitable(db_manager.get_posted_promotions)
+add_posted_promotions = awaitable(db_manager.add_posted_promotions)
@@ -1,14 +1,403 @@
 import sqlite3
 import os
 import re
+import datetime
+import queue
+import threading
+import time
+import atexit
+import concurrent.futures
+from contextlib import contextmanager
+from decouple import config
+import metrics
 
 current_dir = os.path.dirname(os.path.abspath(__file__))
 db_path = os.path.join(current_dir, 'games_and_interests.db')
+DB_READERS = config('DB_READERS', default=4, cast=int)
+DB_CACHE_SIZE_KB = config('DB_CACHE_SIZE_KB', default=16384, cast=int)
+DB_MMAP_SIZE = config('DB_MMAP_SIZE', default=268435456, cast=int)
+DB_STATEMENT_CACHE = config('DB_STATEMENT_CACHE', default=256, cast=int)
+DB_BUSY_TIMEOUT_MS = config('DB_BUSY_TIMEOUT_MS', default=5000, cast=int)
+WRITE_BATCH_SIZE = config('DB_WRITE_BATCH_SIZE', default=64, cast=int)
+WRITE_BATCH_DELAY_MS = config('DB_WRITE_BATCH_DELAY_MS', default=5, cast=float)
+
+def connect_db(read_only=False):
+    '''
+    Connect to database with the pragmas the bot runs with
+
+    Args:
+        read_only (boolean): True to open a connection that refuses writes
+
+    Returns:
+        conn (object): The sqlite3 connection. Transactions are started explicitly, see transaction()
+    '''
+    conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None, cached_statements=DB_STATEMENT_CACHE)
+    # WAL lets the readers keep reading while the writer commits
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute(f"PRAGMA cache_size = -{DB_CACHE_SIZE_KB}")
+    conn.execute(f"PRAGMA mmap_size = {DB_MMAP_SIZE}")
+    conn.execute(f"PRAGMA busy_timeout = {DB_BUSY_TIMEOUT_MS}")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    if read_only:
+        conn.execute("PRAGMA query_only = ON")
+    return conn
+
+class ConnectionManager:
+    '''Keeps one writer connection and a small pool of reader connections open for the life of the bot'''
+    def __init__(self, reader_count):
+        self.reader_count = reader_count
+        self.writer = None
+        self.writer_lock = threading.RLock()
+        self.idle_readers = queue.LifoQueue()
+        self.opened_readers = 0
+        self.pool_lock = threading.Lock()
+
+    @contextmanager
+    def transaction(self):
+        '''
+        Runs a block of writes as one transaction on the writer connection, committing when the block
+        finishes and rolling back if it raises. A transaction opened inside another joins the outer one.
+
+        Yields:
+            conn (object): The writer connection
+        '''
+        with self.writer_lock:
+            if self.writer == None:
+                self.writer = connect_db()
+            conn = self.writer
+
+            if conn.in_transaction:
+                yield conn
+                return
+
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.rollback()
+                # Tag ids cached during the transaction may belong to rows that were just rolled back
+                clear_tag_cache()
+                raise
+            conn.commit()
+
+    @contextmanager
+    def reader(self):
+        '''
+        Borrows a read only connection from the pool, opening one if the pool is not full yet
+
+        Yields:
+            conn (object): A reader connection
+        '''
+        try:
+            conn = self.idle_readers.get_nowait()
+        except queue.Empty:
+            with self.pool_lock:
+                can_open = self.opened_readers < self.reader_count
+                if can_open:
+                    self.opened_readers += 1
+            conn = connect_db(read_only=True) if can_open else self.idle_readers.get()
+
+        try:
+            yield conn
+        finally:
+            self.idle_readers.put(conn)
+
+    def close(self):
+        '''Closes the writer and every idle reader'''
+        with self.writer_lock:
+            if self.writer != None:
+                self.writer.close()
+                self.writer = None
+        while True:
+            try:
+                self.idle_readers.get_nowait().close()
+            except queue.Empty:
+                break
+        self.opened_readers = 0
+
+_connections = None
+_connections_lock = threading.Lock()
+
+def get_connections():
+    '''Returns the process wide ConnectionManager, creating it on first use'''
+    global _connections
+    with _connections_lock:
+        if _connections == None:
+            _connections = ConnectionManager(DB_READERS)
+        return _connections
+
+def close_connections():
+    '''Writes any queued writes, then closes every open connection. The next database call opens new ones, e.g. after db_path changes'''
+    global _connections
+    write_behind.stop()
+    with _connections_lock:
+        if _connections != None:
+            _connections.close()
+            _connections = None
+    clear_tag_cache()
+
+def transaction():
+    '''
+    Runs a block of writes as one transaction, e.g. "with db_manager.transaction() as conn:"
+
+    Returns:
+        context (object): A context manager that yields the writer connection
+    '''
+    return get_connections().transaction()
+
+def reader():
+    '''
+    Borrows a read only connection, e.g. "with db_manager.reader() as conn:"
+
+    Returns:
+        context (object): A context manager that yields a reader connection
+    '''
+    return get_connections().reader()
+
+class WriteBehindQueue:
+    '''
+    Collects writes from every caller and commits them together, one transaction per batch instead of one per write.
+    A batch is written once it has batch_size writes or its first write has waited delay seconds. Each write runs in
+    its own savepoint, so one failing write is rolled back and reported without failing the rest of its batch.
+    '''
+    def __init__(self, batch_size, delay):
+        self.batch_size = batch_size
+        self.delay = delay
+        self.writes = queue.Queue()
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.thread = None
+        self.batches = 0
+        self.batched_writes = 0
+
+    def submit(self, keys, function, *args):
+        '''
+        Queues a write
+
+        Args:
+            keys (tuple): What the write changes, e.g. (('user', discord_id),). Reads of a key wait for its queued writes
+            function (function): The db_manager write function, e.g. rate_game
+            *args: Passed on to the function
+
+        Returns:
+            future (object): A concurrent.futures.Future that resolves once the write is committed
+        '''
+        future = concurrent.futures.Future()
+        with self.lock:
+            for key in keys:
+                self.pending.setdefault(key, set()).add(future)
+            if self.thread == None:
+                self.thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+                self.thread.start()
+            self.writes.put((keys, function, args, future))
+        return future
+
+    def wait_for(self, key):
+        '''Blocks until every queued write of a key is committed, so a user always reads their own writes'''
+        with self.lock:
+            futures = list(self.pending.get(key, ()))
+        if futures:
+            concurrent.futures.wait(futures)
+
+    def depth(self):
+        return self.writes.qsize()
+
+    def stop(self):
+        '''Commits every queued write and stops the writer thread. Called on shutdown so no accepted write is lost'''
+        with self.lock:
+            thread = self.thread
+            self.thread = None
+            if thread != None:
+                self.writes.put(None)
+        if thread != None:
+            thread.join()
+
+    def _run(self):
+        while True:
+            first = self.writes.get()
+            if first == None:
+                return
+
+            batch = [first]
+            stopping = False
+            deadline = time.monotonic() + self.delay
+            while len(batch) < self.batch_size:
+                try:
+                    write = self.writes.get(timeout=max(0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if write == None:
+                    stopping = True
+                    break
+                batch.append(write)
+
+            self._write(batch)
+            if stopping:
+                return
+
+    @metrics.timed('db.write_batch')
+    def _write(self, batch):
+        results = []
+        try:
+            with transaction() as conn:
+                for keys, function, args, future in batch:
+                    conn.execute("SAVEPOINT write_behind")
+                    try:
+                        results.append((future, function(*args), None))
+                    except Exception as e:
+                        conn.execute("ROLLBACK TO write_behind")
+                        # The rolled back write may have cached tag ids
+                        clear_tag_cache()
+                        results.append((future, None, e))
+                    conn.execute("RELEASE write_behind")
+        except Exception as e:
+            results = [(future, None, e) for keys, function, args, future in batch]
+
+        self.batches += 1
+        self.batched_writes += len(batch)
+
+        with self.lock:
+            for keys, function, args, future in batch:
+                for key in keys:
+                    futures = self.pending.get(key)
+                    futures.discard(future)
+                    if not futures:
+                        del self.pending[key]
+
+        for future, result, error in results:
+            if error != None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    def stats(self):
+        '''Returns the queue depth and how many writes were committed in how many batches'''
+        return {
+            'depth': self.depth(),
+            'batches': self.batches,
+            'writes': self.batched_writes,
+        }
+
+write_behind = WriteBehindQueue(WRITE_BATCH_SIZE, WRITE_BATCH_DELAY_MS / 1000)
+metrics.register_gauges('db_write_behind', write_behind.stats)
+atexit.register(write_behind.stop)
+
+# Tag names mapped to their tag ids, only holding tags that have been committed
+tag_ids = {}
+
+# The queries run on every command. migrate.HOT_QUERIES checks these exact strings use an index
+USER_EXISTS_QUERY = "SELECT 1 FROM User WHERE discord_id = ?"
+GAME_EXISTS_QUERY = "SELECT 1 FROM game WHERE game_id = ?"
+TAG_EXISTS_QUERY = "SELECT 1 FROM tag WHERE tag_name = ?"
+RATING_EXISTS_QUERY = "SELECT 1 FROM user_activity WHERE discord_id = ? and game_id = ?"
+UPDATE_RATING_QUERY = "UPDATE user_activity SET activity_type = ?, rating = ?, timestamp = ? WHERE discord_id = ? AND game_id = ?"
+UPDATE_GAME_RATING_QUERY = "UPDATE game_rating SET monthly_rating = ?, all_rating = ?, scrape_date = ? WHERE game_id = ?"
+# Only adds a row when the price, currency, sale flag or sale end date changed since the latest row
+RECORD_PRICE_QUERY = """INSERT into price_history (game_id, price_cents, currency, is_on_sale, end_date, scraped_at)
+        SELECT :game_id, :price_cents, :currency, :is_on_sale, :end_date, :scraped_at
+        WHERE NOT EXISTS (
+            SELECT 1 FROM (SELECT price_cents, currency, is_on_sale, end_date FROM price_history WHERE game_id = :game_id ORDER BY scraped_at DESC, price_history_id DESC LIMIT 1) AS latest
+            WHERE latest.price_cents IS :price_cents AND latest.currency = :currency AND latest.is_on_sale = :is_on_sale AND latest.end_date IS :end_date
+        )"""
+CURRENT_PRICE_QUERY = "SELECT price_cents, currency, is_on_sale, end_date, scraped_at FROM price_history WHERE game_id = ? ORDER BY scraped_at DESC, price_history_id DESC LIMIT 1"
+LOWEST_PRICE_QUERY = "SELECT price_cents, scraped_at FROM price_history WHERE game_id = ? AND price_cents IS NOT NULL ORDER BY price_cents, scraped_at LIMIT 1"
+UNWATCH_GAME_QUERY = "DELETE FROM watch WHERE discord_id = ? AND game_id = ?"
+SET_WATCHES_NOTIFIED_QUERY = "UPDATE watch SET last_notified_cents = ? WHERE discord_id = ? AND game_id = ?"
+SET_WATCHES_LAST_PRICE_QUERY = "UPDATE watch SET last_price_cents = ? WHERE discord_id = ? AND game_id = ?"
+# Formatted with one ? per promotion id or tag name
+POSTED_PROMOTIONS_QUERY = "SELECT promotion_id FROM posted_promotion WHERE job_name = ? AND promotion_id IN ({placeholders})"
+TAG_IDS_QUERY = "SELECT tag_name, tag_id FROM tag WHERE tag_name IN ({placeholders})"
+GAME_TAG_LINKS_QUERY = "SELECT tag_id FROM game_tag WHERE game_id = ?"
+RATING_SUMMARY_QUERY = "SELECT AVG(rating), TOTAL(activity_type = 'completed'), COUNT(*) FROM user_activity WHERE discord_id = ?"
+RATINGS_PAGE_QUERY = ("SELECT title, activity_type, rating, timestamp, user_activity.game_id FROM user_activity INNER JOIN game ON user_activity.game_id = game.game_id WHERE discord_id = ?"
+    " ORDER BY timestamp DESC, user_activity.game_id DESC LIMIT ?")
+# The same page after a (timestamp, game_id) cursor
+RATINGS_PAGE_AFTER_QUERY = ("SELECT title, activity_type, rating, timestamp, user_activity.game_id FROM user_activity INNER JOIN game ON user_activity.game_id = game.game_id WHERE discord_id = ?"
+    " AND (timestamp, user_activity.game_id) < (?, ?) ORDER BY timestamp DESC, user_activity.game_id DESC LIMIT ?")
+
+def clear_tag_cache():
+    '''Forgets every cached tag id'''
+    tag_ids.clear()
+
+def link_game_tags(cursor, game_id, tags, new_game=False):
+    '''
+    Links a game to its tags, adding the tags that are not in the database yet. Tags already in tag_ids
+    need no query, the rest are added with one batched insert and looked up with one select.
+
+    Args:
+        cursor (object): A cursor inside the transaction that writes the game
+        game_id (int): The game's id
+        tags (array): The game's tag names
+        new_game (boolean): True if the game was just added, so it has no links to check for yet
+
+    Returns:
+        new_tag_ids (dict): Ids of tags that were not cached, to be cached once the transaction commits
+    '''
+    names = list(dict.fromkeys(tags))
+    missing = [name for name in names if name not in tag_ids]
+
+    new_tag_ids = {}
+    if missing:
+        cursor.executemany("INSERT OR IGNORE into tag (tag_name) values (?)", ((name,) for name in missing))
+        cursor.execute(TAG_IDS_QUERY.format(placeholders=",".join("?" * len(missing))), missing)
+        new_tag_ids = dict(cursor.fetchall())
 
-def connect_db():
-    '''Connect to database'''
-    return sqlite3.connect(db_path)
+    linked = set()
+    if not new_game:
+        cursor.execute(GAME_TAG_LINKS_QUERY, (game_id,))
+        linked = {row[0] for row in cursor.fetchall()}
 
+    links = [(game_id, tag_id) for tag_id in (tag_ids.get(name) or new_tag_ids[name] for name in names) if tag_id not in linked]
+    cursor.executemany("INSERT into game_tag (game_id, tag_id) values (?,?)", links)
+
+    return new_tag_ids
+
+def parse_price_cents(price):
+    '''
+    Converts a price into integer cents
+
+    Args:
+        price (string): The price as shown on the store without the currency symbol, e.g. "19.99" or "1,299.99". Numbers are also accepted
+
+    Returns:
+        cents (int): The price in cents, None if there is no price
+    '''
+    if price == None:
+        return None
+    if isinstance(price, (int, float)):
+        return round(price * 100)
+
+    match = re.search(r"\d[\d,]*(?:\.\d+)?", price)
+    if match == None:
+        return None
+    return round(float(match.group(0).replace(',', '')) * 100)
+
+def record_price(cursor, game, currency="USD"):
+    '''
+    Adds the game's current price to its price history, unless it is the same as the last price recorded
+
+    Args:
+        cursor (object): A cursor inside the transaction that writes the game
+        game (object): game object containing information about the game (made in steamsales.py)
+        currency (string): The currency of the prices
+
+    Returns:
+        None
+    '''
+    # The price paid is the discounted price while the game is on sale
+    price = game.original_price if game.discount_price == None else game.discount_price
+    row = {
+        'game_id': game.id,
+        'price_cents': parse_price_cents(price),
+        'currency': currency,
+        'is_on_sale': 1 if game.is_on_sale else 0,
+        'end_date': game.end_date,
+        'scraped_at': datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%d %H:%M:%S"),
+    }
+    cursor.execute(RECORD_PRICE_QUERY, row)
+
+@metrics.timed('db.tag_exists')
 def tag_exists(tag):
     '''
     Checks if a game tag is in the database
@@ -19,19 +408,14 @@ def tag_exists(tag):
     Returns:
         exists (boolean): True or false value indicating if a user is in the database
     '''
-    try:
-        conn = connect_db()
-        cursor = conn.cursor()
-        cursor.execute("SELECT 1 FROM tag WHERE tag_name = ?", (tag,))
-        exists = cursor.fetchone() is not None
-    except sqlite3.Error as e:
-        conn.rollback()
-        raise e
-    finally:
-        if conn:
-            conn.close()
+    if tag in tag_ids:
+        return True
+
+    with reader() as conn:
+        exists = conn.execute(TAG_EXISTS_QUERY, (tag,)).fetchone() is not None
     return exists
 
+@metrics.timed('db.rating_exists')
 def rating_exists(discord_id, game_id):
     '''
     Checks if a discord user had already inputed a rating for a game
@@ -43,19 +427,12 @@ def rating_exists(discord_id, game_id):
     Returns:
         exists (boolean): True or false value indicating if a users rating for a game is in the database
     '''
-    try:
-        conn = connect_db()
-        cursor = conn.cursor()
-        cursor.execute("SELECT 1 FROM user_activity WHERE discord_id = ? and game_id = ?", (discord_id, game_id,))
-        exists = cursor.fetchone() is not None
-    except sqlite3.Error as e:
-        conn.rollback()
-        raise e
-    finally:
-        if conn:
-            conn.close()
+    write_behind.wait_for(('user', discord_id))
+    with reader() as conn:
+        exists = conn.execute(RATING_EXISTS_QUERY, (discord_id, game_id,)).fetchone() is not None
     return exists
 
+@metrics.timed('db.game_exists')
 def game_exists(game_id):
     '''
     Checks if a game's ID is in the database
@@ -66,19 +443,12 @@ def game_exists(game_id):
     Returns:
         exists (boolean): True or false value indicating if a user is in the database
     '''
-    try:
-        conn = connect_db()
-        cursor = conn.cursor()
-        cursor.execute("SELECT 1 FROM game WHERE game_id = ?", (game_id,))
-        exists = cursor.fetchone() is not None
-    except sqlite3.Error as e:
-        conn.rollback()
-        raise e
-    finally:
-        if conn:
-            conn.close()
+    write_behind.wait_for(('game', game_id))
+    with reader() as conn:
+        exists = conn.execute(GAME_EXISTS_QUERY, (game_id,)).fetchone() is not None
     return exists
 
+@metrics.timed('db.add_game')
 def add_game(game):
     '''
     Adds a game to the database
@@ -89,55 +459,29 @@ def add_game(game):
     Returns:
         None
     '''
-    # Set price to the discounted price if the game is on sale and if not set it to the original price
-    if (game.discount_price == None):
-        price = game.original_price
-    else:
-        price = game.discount_price
-
-    # Format the is_on_sale boolean to fit the database format of 1 for true and 0 for false
-    if (game.is_on_sale == True):
-        sale = 1
-    else:
-        sale = 0
-
-    if (game.end_date == None):
-        end_date = "NULL"
-    else:
-        end_date = game.end_date
-
     # Grab just the number from the monthly ratings and format it to represent percentages in the form: 0.84
-    match = re.search(r"(\d+)%", game.monthly_ratings)
+    monthly_ratings = None
+    match = re.search(r"(\d+)%", game.monthly_ratings or "")
     if match:
         monthly_ratings = float(match.group(1))
         monthly_ratings = monthly_ratings / 100
     
     # Grab just the number from the overall ratings and format it to represent percentages in the form: 0.84
-    match = re.search(r"(\d+)%", game.all_ratings)
+    all_ratings = None
+    match = re.search(r"(\d+)%", game.all_ratings or "")
     if match:
         all_ratings = float(match.group(1))
         all_ratings = all_ratings / 100
     
-    try:
-        conn = connect_db()
+    with transaction() as conn:
         cursor = conn.cursor()
         cursor.execute("INSERT into game values (?,?,?,?,?)", (game.id, game.title, game.description, game.game_developer, game.game_publisher,))
         cursor.execute("INSERT into game_rating (game_id,monthly_rating,all_rating,scrape_date) values (?,?,?,?)", (game.id, monthly_ratings, all_ratings, game.scrape_date,))
-        cursor.execute("INSERT into game_price (game_id,price,currency,is_on_sale,end_date) values (?,?,?,?,?)", (game.id, price, "USD", sale, end_date,))
-        for tag in game.tags:
-            exists = tag_exists(tag)
-            if (exists == False):
-                cursor.execute("INSERT into tag (tag_name) values (?)", (tag,))
-                tag_id = cursor.lastrowid
-                cursor.execute("INSERT into game_tag (game_id, tag_id) values (?,?)", (game.id, tag_id,))
-        conn.commit()
-    except sqlite3.Error as e:
-        conn.rollback()
-        raise e
-    finally:
-        if conn:
-            conn.close()
+        record_price(cursor, game)
+        new_tag_ids = link_game_tags(cursor, game.id, game.tags, new_game=True)
+    tag_ids.update(new_tag_ids)
 
+@metrics.timed('db.update_game')
 def update_game(game):
     '''
     Updates a game in the database
@@ -148,54 +492,28 @@ def update_game(game):
     Returns:
         None
     '''
-    # Set price to the discounted price if the game is on sale and if not set it to the original price
-    if (game.discount_price == None):
-        price = game.original_price
-    else:
-        price = game.discount_price
-
-    # Format the is_on_sale boolean to fit the database format of 1 for true and 0 for false
-    if (game.is_on_sale == True):
-        sale = 1
-    else:
-        sale = 0
-
-    if (game.end_date == None):
-        end_date = "NULL"
-    else:
-        end_date = game.end_date
-
     # Grab just the number from the monthly ratings and format it to represent percentages in the form: 0.84
-    match = re.search(r"(\d+)%", game.monthly_ratings)
+    monthly_ratings = None
+    match = re.search(r"(\d+)%", game.monthly_ratings or "")
     if match:
         monthly_ratings = float(match.group(1))
         monthly_ratings = monthly_ratings / 100
     
     # Grab just the number from the overall ratings and format it to represent percentages in the form: 0.84
-    match = re.search(r"(\d+)%", game.all_ratings)
+    all_ratings = None
+    match = re.search(r"(\d+)%", game.all_ratings or "")
     if match:
         all_ratings = float(match.group(1))
         all_ratings = all_ratings / 100
     
-    try:
-        conn = connect_db()
+    with transaction() as conn:
         cursor = conn.cursor()
-        cursor.execute("UPDATE game_rating SET monthly_rating = ?, all_rating = ?, scrape_date = ? WHERE game_id = ?", (monthly_ratings, all_ratings, game.scrape_date, game.id,))
-        cursor.execute("UPDATE game_price SET price = ?, currency = ?, is_on_sale = ?, end_date = ? WHERE game_id = ?", (price, "USD", sale, end_date, game.id,))
-        for tag in game.tags:
-            exists = tag_exists(tag)
-            if (exists == False):
-                cursor.execute("INSERT into tag (tag_name) values (?)", (tag,))
-                tag_id = cursor.lastrowid
-                cursor.execute("INSERT into game_tag (game_id, tag_id) values (?,?)", (game.id, tag_id,))
-        conn.commit()
-    except sqlite3.Error as e:
-        conn.rollback()
-        raise e
-    finally:
-        if conn:
-            conn.close()
+        cursor.execute(UPDATE_GAME_RATING_QUERY, (monthly_ratings, all_ratings, game.scrape_date, game.id,))
+        record_price(cursor, game)
+        new_tag_ids = link_game_tags(cursor, game.id, game.tags)
+    tag_ids.update(new_tag_ids)
 
+@metrics.timed('db.add_rating')
 def add_rating(game, rating, activity_type, timestamp, discord_id):
     '''
     Adds a user rating to a game
@@ -210,18 +528,10 @@ def add_rating(game, rating, activity_type, timestamp, discord_id):
     Returns:
         None
     '''
-    try:
-        conn = connect_db()
-        cursor = conn.cursor()
-        cursor.execute("INSERT into user_activity (discord_id, game_id, activity_type, rating, timestamp) values (?,?,?,?,?)", (discord_id, game.id, activity_type, rating, timestamp,))
-        conn.commit()
-    except sqlite3.Error as e:
-        conn.rollback()
-        raise e
-    finally:
-        if conn:
-            conn.close()
+    with transaction() as conn:
+        conn.execute("INSERT into user_activity (discord_id, game_id, activity_type, rating, timestamp) values (?,?,?,?,?)", (discord_id, game.id, activity_type, rating, timestamp,))
 
+@metrics.timed('db.update_rating')
 def update_rating(game, rating, activity_type, timestamp, discord_id):
     '''
     Updates a user rating to a game
@@ -236,65 +546,351 @@ def update_rating(game, rating, activity_type, timestamp, discord_id):
     Returns:
         None
     '''
-    try:
-        conn = connect_db()
-        cursor = conn.cursor()
-        cursor.execute("UPDATE user_activity SET activity_type = ?, rating = ?, timestamp = ? WHERE discord_id = ? AND game_id = ?", (activity_type, rating, timestamp, discord_id, game.id,))
-        conn.commit()
-    except sqlite3.Error as e:
-        conn.rollback()
-        raise e
-    finally:
-        if conn:
-            conn.close()
+    with transaction() as conn:
+        conn.execute(UPDATE_RATING_QUERY, (activity_type, rating, timestamp, discord_id, game.id,))
+
+@metrics.timed('db.save_game')
+def save_game(game):
+    '''
+    Adds a game to the database or updates it if it is already there. The check runs on the writer connection
+    so it sees games added earlier in the same write behind batch.
+
+    Args:
+        game (object): game object containing information about the game (made in steamsales.py)
+
+    Returns:
+        None
+    '''
+    with transaction() as conn:
+        if conn.execute(GAME_EXISTS_QUERY, (game.id,)).fetchone() == None:
+            add_game(game)
+        else:
+            update_game(game)
+
+def save_games(games):
+    '''
+    Adds or updates several games in one transaction
+
+    Args:
+        games (array): game objects (made in steamsales.py)
+
+    Returns:
+        None
+    '''
+    with transaction() as conn:
+        for game in games:
+            save_game(game)
+
+@metrics.timed('db.rate_game')
+def rate_game(game, rating, activity_type, timestamp, discord_id):
+    '''
+    Adds or updates a game and a user's rating of it in one transaction
+
+    Args:
+        game (object): game object containing information about the game (made in steamsales.py)
+        rating (string): user rating on a scale from 1 to 10
+        activity_type (string): user indicated interaction with the game (playing, completed, dropped)
+        timestamp (string): datetime that the user provided a rating and activity_type of format: YYYY-MM-DD
+        discord_id (int): integer for the user's discord id
+
+    Returns:
+        None
+    '''
+    with transaction() as conn:
+        save_game(game)
+
+        if conn.execute(RATING_EXISTS_QUERY, (discord_id, game.id,)).fetchone() == None:
+            add_rating(game, rating, activity_type, timestamp, discord_id)
+        else:
+            update_rating(game, rating, activity_type, timestamp, discord_id)
+
+@metrics.timed('db.get_rating_summary')
+def get_rating_summary(discord_id):
+    '''
+    Gets a user's average rating, % of games completed and number of rated games in one pass over their activity
+
+    Args:
+        discord_id (int): integer for the user's discord id
+
+    Returns:
+        average_rating (float): The user's average rating, 0.0 if they have not rated any games
+        completed_percent (string): The percentage of the user's games they completed, e.g. "42.5%"
+        activity_count (int): How many games the user rated
+    '''
+    write_behind.wait_for(('user', discord_id))
+    with reader() as conn:
+        average_rating, completed_count, activity_count = conn.execute(RATING_SUMMARY_QUERY, (discord_id,)).fetchone()
+
+    if activity_count == 0:
+        return 0.0, "0.0%", 0
+
+    average_rating = round(float(average_rating), 2)
+    # Calculate the percentage of games the user completed out of total games they played
+    completed_percent = round(float((completed_count / activity_count) * 100), 1)
+    completed_percent = str(completed_percent) + '%'
+
+    return average_rating, completed_percent, activity_count
+
+@metrics.timed('db.get_ratings_page')
+def get_ratings_page(discord_id, limit, after=None):
+    '''
+    Gets one page of a user's games, most recent first. Pages are found with a (timestamp, game_id) cursor
+    instead of an offset so a late page costs the same as the first one.
 
+    Args:
+        discord_id (int): integer for the user's discord id
+        limit (int): The most games to return
+        after (tuple): The cursor returned with the previous page, None for the first page
+
+    Returns:
+        rows (array): (title, activity_type, rating, timestamp) for each game on the page
+        next_cursor (tuple): The cursor for the next page, None if this is the last page
+    '''
+    write_behind.wait_for(('user', discord_id))
+    query = RATINGS_PAGE_QUERY
+    params = [discord_id]
+    if after != None:
+        query = RATINGS_PAGE_AFTER_QUERY
+        params.extend(after)
+    # One extra row tells us whether there is a next page
+    params.append(limit + 1)
+
+    with reader() as conn:
+        rows = conn.execute(query, params).fetchall()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = (rows[-1][3], rows[-1][4])
+
+    return [row[:4] for row in rows], next_cursor
+
+@metrics.timed('db.get_rating_stats')
 def get_rating_stats(discord_id):
     '''
     Gets various user stats based on their ratings and activity status:
     - Average game rating
     - % of games completed
-    - Most common tags
+    - The user's games, most recent first
     
     Args:
         discord_id (int): integer for the user's discord id
 
     Returns:
-        None
+        average_rating (float): The user's average rating, 0.0 if they have not rated any games
+        completed_percent (string): The percentage of the user's games they completed, e.g. "42.5%"
+        title, activity_type, rating, timestamp (array): One entry per game the user rated
     '''
-    try:
-        conn = connect_db()
-        cursor = conn.cursor()
+    average_rating, completed_percent, activity_count = get_rating_summary(discord_id)
+    if activity_count == 0:
+        return average_rating, completed_percent, [], [], [], []
+
+    rows, next_cursor = get_ratings_page(discord_id, activity_count)
+
+    title, activity_type, rating, timestamp = [], [], [], []
+    for row in rows:
+        title.append(row[0])
+        activity_type.append(row[1])
+        rating.append(row[2])
+        timestamp.append(row[3])
 
-        # Get the user's average rating
-        cursor.execute("SELECT AVG(rating) FROM user_activity WHERE discord_id = ?", (discord_id,))
-        average_rating = round(float(cursor.fetchone()[0]), 2) # Get the float value from the tuple that is returned by the cursor
-
-        # Get the number of games the user completed
-        cursor.execute("SELECT count(activity_type) FROM user_activity WHERE discord_id = ? AND activity_type = ?", (discord_id, "completed",))
-        completed_count = float(cursor.fetchone()[0]) # Get the float value from the tuple that is returned by the cursor
-
-        # Calculate the percentage of games the user completed out of total games they played
-        cursor.execute("SELECT count(activity_type) FROM user_activity WHERE discord_id = ?", (discord_id,))
-        activity_count = float(cursor.fetchone()[0]) # Get the float value from the tuple that is returned by the cursor
-        completed_percent = round(float((completed_count / activity_count) * 100), 1)
-        completed_percent = str(completed_percent) + '%'
-
-        # Get the first page of results
-        cursor.execute("SELECT title, activity_type, rating, timestamp FROM user_activity INNER JOIN game ON user_activity.game_id = game.game_id")
-        title, activity_type, rating, timestamp = [], [], [], []
-        for row in cursor.fetchall():
-            title.append(row[0])
-            activity_type.append(row[1])
-            rating.append(row[2])
-            timestamp.append(row[3])
-    except sqlite3.Error as e:
-        raise e
-    finally:
-        if conn:
-            conn.close()
-    
     return average_rating, completed_percent, title, activity_type, rating, timestamp
 
+@metrics.timed('db.watch_game')
+def watch_game(discord_id, game, game_link, target_cents, price_cents):
+    '''
+    Saves a game and starts watching its price for a user. Watching a game again replaces the target price
+
+    Args:
+        discord_id (int): integer for the user's discord id
+        game (object): game object containing information about the game (made in steamsales.py)
+        game_link (string): The store link the game is refreshed from
+        target_cents (int): Only notify at or below this price in cents, None to notify on any price drop
+        price_cents (int): The game's price in cents right now, the next refresh looks for drops from it
+
+    Returns:
+        None
+    '''
+    created_at = datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+    with transaction() as conn:
+        save_game(game)
+        conn.execute("""INSERT into watch (discord_id, game_id, game_link, target_cents, last_price_cents, created_at) values (?,?,?,?,?,?)
+            ON CONFLICT (discord_id, game_id) DO UPDATE SET game_link = excluded.game_link, target_cents = excluded.target_cents, last_notified_cents = NULL,
+            last_price_cents = excluded.last_price_cents""", (discord_id, game.id, game_link, target_cents, price_cents, created_at,))
+
+@metrics.timed('db.unwatch_game')
+def unwatch_game(discord_id, game_id):
+    '''
+    Stops watching a game's price for a user
+
+    Args:
+        discord_id (int): integer for the user's discord id
+        game_id (int): The game's id
+
+    Returns:
+        removed (boolean): True if the user was watching the game
+    '''
+    with transaction() as conn:
+        removed = conn.execute(UNWATCH_GAME_QUERY, (discord_id, game_id,)).rowcount > 0
+    return removed
+
+@metrics.timed('db.get_watched_games')
+def get_watched_games():
+    '''
+    Gets every game someone is watching, once per game no matter how many users watch it
+
+    Args:
+        None
+
+    Returns:
+        watched (array): (game_id, game_link) for each watched game
+    '''
+    with reader() as conn:
+        return conn.execute("SELECT game_id, MAX(game_link) FROM watch GROUP BY game_id").fetchall()
+
+@metrics.timed('db.get_watches')
+def get_watches():
+    '''
+    Gets every watch
+
+    Args:
+        None
+
+    Returns:
+        watches (array): (discord_id, game_id, target_cents, last_notified_cents, last_price_cents) for each watch
+    '''
+    with reader() as conn:
+        return conn.execute("SELECT discord_id, game_id, target_cents, last_notified_cents, last_price_cents FROM watch").fetchall()
+
+@metrics.timed('db.set_watches_notified')
+def set_watches_notified(updates):
+    '''
+    Records the price each user was last notified about, so the same price is not sent twice
+
+    Args:
+        updates (array): (last_notified_cents, discord_id, game_id) for each watch, last_notified_cents None to notify again on the next drop
+
+    Returns:
+        None
+    '''
+    with transaction() as conn:
+        conn.executemany(SET_WATCHES_NOTIFIED_QUERY, updates)
+
+@metrics.timed('db.set_watches_last_price')
+def set_watches_last_price(updates):
+    '''
+    Records the price each watch saw at this refresh, so the next refresh finds drops from it
+
+    Args:
+        updates (array): (last_price_cents, discord_id, game_id) for each refreshed watch
+
+    Returns:
+        None
+    '''
+    with transaction() as conn:
+        conn.executemany(SET_WATCHES_LAST_PRICE_QUERY, updates)
+
+@metrics.timed('db.get_posted_promotions')
+def get_posted_promotions(job_name, promotion_ids):
+    '''
+    Finds which promotions a scheduled job already posted
+
+    Args:
+        job_name (string): The job's name
+        promotion_ids (array): The promotion ids to check
+
+    Returns:
+        posted (set): The promotion ids that were already posted
+    '''
+    if not promotion_ids:
+        return set()
+    with reader() as conn:
+        rows = conn.execute(POSTED_PROMOTIONS_QUERY.format(placeholders=",".join("?" * len(promotion_ids))), (job_name, *promotion_ids)).fetchall()
+    return {row[0] for row in rows}
+
+@metrics.timed('db.add_posted_promotions')
+def add_posted_promotions(job_name, promotion_ids, posted_at):
+    '''
+    Records that a scheduled job posted promotions
+
+    Args:
+        job_name (string): The job's name
+        promotion_ids (array): The promotion ids that were posted
+        posted_at (string): When they were posted YYYY-MM-DD HH:MM:SS
+
+    Returns:
+        None
+    '''
+    with transaction() as conn:
+        conn.executemany("INSERT OR IGNORE into posted_promotion (job_name, promotion_id, posted_at) values (?,?,?)", ((job_name, promotion_id, posted_at) for promotion_id in promotion_ids))
+
+@metrics.timed('db.get_current_price')
+def get_current_price(game_id):
+    '''
+    Gets the most recently recorded price of a game
+
+    Args:
+        game_id (int): The game's id
+
+    Returns:
+        price_cents (int): The price in cents, None if it had no price
+        currency (string): The currency of the price
+        is_on_sale (boolean): True if the price is a sale price
+        end_date (string): When the sale ends YYYY-MM-DD, None if there is no sale end date
+        scraped_at (string): When the price was first seen YYYY-MM-DD HH:MM:SS
+        None is returned instead if no price was ever recorded for the game
+    '''
+    write_behind.wait_for(('game', game_id))
+    with reader() as conn:
+        row = conn.execute(CURRENT_PRICE_QUERY, (game_id,)).fetchone()
+
+    if row == None:
+        return None
+    price_cents, currency, is_on_sale, end_date, scraped_at = row
+    return price_cents, currency, is_on_sale == 1, end_date, scraped_at
+
+@metrics.timed('db.get_lowest_price')
+def get_lowest_price(game_id):
+    '''
+    Gets the lowest price a game has ever been recorded at
+
+    Args:
+        game_id (int): The game's id
+
+    Returns:
+        price_cents (int): The lowest price in cents
+        scraped_at (string): When that price was first seen YYYY-MM-DD HH:MM:SS
+        None is returned instead if no price was ever recorded for the game
+    '''
+    write_behind.wait_for(('game', game_id))
+    with reader() as conn:
+        return conn.execute(LOWEST_PRICE_QUERY, (game_id,)).fetchone()
+
+@metrics.timed('db.get_price_vs_low')
+def get_price_vs_low(game_id):
+    '''
+    Compares a game's current price with the lowest price it has ever been recorded at
+
+    Args:
+        game_id (int): The game's id
+
+    Returns:
+        current_cents (int): The current price in cents
+        lowest_cents (int): The lowest price ever in cents
+        lowest_at (string): When the lowest price was first seen YYYY-MM-DD HH:MM:SS
+        is_lowest (boolean): True if the current price is the lowest ever
+        None is returned instead if the game has no recorded prices
+    '''
+    current = get_current_price(game_id)
+    lowest = get_lowest_price(game_id)
+    if current == None or current[0] == None or lowest == None:
+        return None
+
+    current_cents = current[0]
+    lowest_cents, lowest_at = lowest
+    return current_cents, lowest_cents, lowest_at, current_cents <= lowest_cents
+
+@metrics.timed('db.user_exists')
 def user_exists(discord_id):
     '''
     Checks if a user's Discord ID is in the database
@@ -305,20 +901,13 @@ def user_exists(discord_id):
     Returns:
         exists (boolean): True or false value indicating if a user is in the database
     '''
-    try:
-        conn = connect_db()
-        cursor = conn.cursor()
-        cursor.execute("SELECT 1 FROM User WHERE discord_id = ?", (discord_id,))
-        exists = cursor.fetchone() is not None
-    except sqlite3.Error as e:
-        conn.rollback()
-        raise e
-    finally:
-        if conn:
-            conn.close()
+    write_behind.wait_for(('user', discord_id))
+    with reader() as conn:
+        exists = conn.execute(USER_EXISTS_QUERY, (discord_id,)).fetchone() is not None
     
     return exists
 
+@metrics.timed('db.create_user')
 def create_user(discord_id, first_seen, last_online, playstyle):
     '''
     Inserts information for a new user into the database
@@ -332,18 +921,10 @@ def create_user(discord_id, first_seen, last_online, playstyle):
     Returns:
         None
     '''
-    try:
-        conn = connect_db()
-        cursor = conn.cursor()
-        cursor.execute("INSERT into user values (?,?,?,?)", (discord_id, first_seen, last_online, playstyle,))
-        conn.commit()
-    except sqlite3.Error as e:
-        conn.rollback()
-        raise e
-    finally:
-        if conn:
-            conn.close()
+    with transaction() as conn:
+        conn.execute("INSERT into user values (?,?,?,?)", (discord_id, first_seen, last_online, playstyle,))
 
+@metrics.timed('db.update_user')
 def update_user(discord_id, last_online, playstyle):
     '''
     Updates a user's information in the database
@@ -356,13 +937,5 @@ def update_user(discord_id, last_online, playstyle):
     Returns:
         None
     '''
-    try:
-        conn = connect_db()
-        conn.execute("UPDATE user SET last_online=?, playstyle=? where discord_id=?", (last_online, playstyle, discord_id,))
-        conn.commit()
-    except sqlite3.Error as e:
-        conn.rollback()
-        raise e
-    finally:
-        if conn:
-            conn.close()
\ No newline at end of file
+    with transaction() as conn:
+        conn.execute("UPDATE user SET last_online=?, playstyle=? where discord_id=?", (last_online, playstyle, discord_id,))
\ No newline at end of file
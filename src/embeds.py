@@ -0,0 +1,284 @@
+import discord
+import re
+from collections import OrderedDict
+from decouple import config
+import metrics
+
+THUMBS_UP = '👍'
+THUMBS_DOWN = '👎'
+STRAIGHT_FACE = '😑'
+TAG = '🏷️'
+MONEY = '💸'
+MAX_FIELDS = 25
+MAX_DESCRIPTION_CHARACTERS = 4096
+MAX_FIELD_VALUE_CHARACTERS = 1024
+# Discord's limits for the embeds of one message
+MAX_EMBEDS_PER_MESSAGE = 10
+MAX_EMBED_CHARACTERS = 6000
+EMBED_CACHE_SIZE = config('EMBED_CACHE_SIZE', default=256, cast=int)
+
+def add_rating_field(embed, label, ratings):
+    '''
+    Adds a ratings field with an emoji for how positive the ratings are
+
+    Args:
+        embed (object): The discord embed to add the field to
+        label (string): The name of the field, e.g. "Monthly Ratings"
+        ratings (string): The ratings summary from steam, e.g. "84% of the 1,234 user reviews..."
+
+    Returns:
+        None
+    '''
+    if ratings != None:
+        match = re.search(r"(\d+)\%", ratings)
+        rating_score = int(match.group(1))
+    else:
+        rating_score = -1
+
+    if (rating_score > 80):
+        embed.add_field(name=f"{label} {THUMBS_UP}", value=f"{ratings}", inline=False)
+    elif (rating_score > 50):
+        embed.add_field(name=f"{label} {STRAIGHT_FACE}", value=f"{ratings}", inline=False)
+    elif (rating_score >= 0 and rating_score <= 50):
+        embed.add_field(name=f"{label} {THUMBS_DOWN}", value=f"{ratings}", inline=False)
+
+def build_special_embed(game):
+    '''
+    Builds the embed for a steam special
+
+    Args:
+        game (object): game object containing information about the game (made in steamsales.py)
+
+    Returns:
+        embed (object): The discord embed for the game
+    '''
+    embed = discord.Embed(
+        title=game.title,
+        description=game.description,
+        color=discord.Color.blue()
+    )
+
+    if game.game_image:
+        embed.set_image(url=game.game_image)
+
+    embed.add_field(name="Developer", value=game.game_developer, inline=True)
+    embed.add_field(name="Publisher", value=game.game_publisher, inline=True)
+
+    embed.add_field(name="", value="", inline=True)
+
+    embed.add_field(name="Original Price", value=f"${game.original_price}", inline=True)
+    embed.add_field(name="Discount Percent", value=game.discount_percent, inline=True)
+    embed.add_field(name="Dicount Price", value=f"${game.discount_price}", inline=True)
+
+    add_rating_field(embed, "Monthly Ratings", game.monthly_ratings)
+    add_rating_field(embed, "Overall Ratings", game.all_ratings)
+
+    if game.tags:
+        tags_string = ", ".join(game.tags)
+        embed.add_field(name=f"Tags {TAG}", value=tags_string, inline=False)
+
+    embed.url = game.game_url
+
+    return embed
+
+def build_free_game_embed(game):
+    '''
+    Builds the embed for a free game on Epic Games
+
+    Args:
+        game (object): game object containing information about the game (made in epicgamesfree.py)
+
+    Returns:
+        embed (object): The discord embed for the game
+    '''
+    embed = discord.Embed(
+        title=game.title,
+        description=game.description,
+        color=discord.Color.blue()
+    )
+
+    if game.game_image:
+        embed.set_image(url=game.game_image)
+
+    embed.add_field(name="Original Price", value=game.original_price, inline=True)
+    if game.start_date:
+        embed.add_field(name="Start Date", value=game.start_date, inline=True)
+    if game.end_date:
+        embed.add_field(name="End Date", value=game.end_date, inline=True)
+
+    embed.url = game.game_url
+
+    return embed
+
+def content_key(game):
+    '''
+    Builds a hashable key from every field of a game object, so any change to what an embed shows gives a new key.
+    The fields themselves are the key rather than a digest of them: hashing the tuple is several times cheaper than
+    serializing the game, and equal hashes can never map to a different game's embed.
+
+    Args:
+        game (object): A steam or Epic game object
+
+    Returns:
+        key (tuple): The game's field values, with lists turned into tuples
+    '''
+    return tuple(tuple(value) if isinstance(value, list) else value for value in vars(game).values())
+
+class EmbedRenderer:
+    '''
+    Builds embed payloads for games and keeps the most recent ones keyed by (game id, game content), so posting the same
+    deals again, to another channel or user, reuses the payload instead of building the embed again.
+    The payloads are shared, so they must not be changed by callers.
+    '''
+    def __init__(self, build, size=EMBED_CACHE_SIZE):
+        self.build = build
+        self.size = size
+        self.payloads = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def render(self, game):
+        '''
+        Gets the embed payload for a game
+
+        Args:
+            game (object): A game object with an id
+
+        Returns:
+            payload (dict): The embed as a dictionary, see discord.Embed.to_dict
+        '''
+        key = (game.id, content_key(game))
+        payload = self.payloads.get(key)
+        if payload != None:
+            self.hits += 1
+            self.payloads.move_to_end(key)
+            return payload
+
+        self.misses += 1
+        payload = self.build(game).to_dict()
+        self.payloads[key] = payload
+        if len(self.payloads) > self.size:
+            self.payloads.popitem(last=False)
+
+        return payload
+
+    def render_embed(self, game):
+        '''Gets the embed for a game, built from its cached payload'''
+        return discord.Embed.from_dict(self.render(game))
+
+    def stats(self):
+        '''Returns the cache counters for the metrics gauges'''
+        return {'size': len(self.payloads), 'hits': self.hits, 'misses': self.misses}
+
+special_renderer = EmbedRenderer(build_special_embed)
+free_game_renderer = EmbedRenderer(build_free_game_embed)
+metrics.register_gauges('special_embed_cache', special_renderer.stats)
+metrics.register_gauges('free_game_embed_cache', free_game_renderer.stats)
+
+def format_cents(cents):
+    '''Formats a price in cents like the store does, e.g. $19.99'''
+    return f"${cents / 100:.2f}"
+
+def build_price_drop_embeds(drops):
+    '''
+    Builds the embeds telling a user about the price drops on the games they watch
+
+    Args:
+        drops (array): PriceDrop objects for one user (made in price_watch.py)
+
+    Returns:
+        embeds (array): The discord embeds, one field per game and at most 25 fields each
+    '''
+    embeds = []
+    for start in range(0, len(drops), MAX_FIELDS):
+        embed = discord.Embed(
+            title=f"Price Drops {MONEY}",
+            description="Games you are watching are cheaper on steam.",
+            color=discord.Color.green()
+        )
+
+        for drop in drops[start:start + MAX_FIELDS]:
+            value = format_cents(drop.price_cents)
+            if drop.previous_cents != None and drop.previous_cents > drop.price_cents:
+                value = f"~~{format_cents(drop.previous_cents)}~~ {value}"
+            if drop.target_cents != None:
+                value += f" (your target: {format_cents(drop.target_cents)})"
+            if drop.game.end_date:
+                value += f"\nSale ends {drop.game.end_date}"
+            embed.add_field(name=drop.game.title, value=f"{value}\n{drop.game.game_url}", inline=False)
+
+        embeds.append(embed)
+
+    return embeds
+
+def build_bot_stats_embeds(stage_summaries, gauge_values):
+    '''
+    Builds the -botstats embeds: the stage latency table, split into code blocks that fit an embed description,
+    followed by the gauges in as many embeds as Discord's field and character limits need
+
+    Args:
+        stage_summaries (dict): Summaries keyed by stage name, as returned by metrics.snapshot
+        gauge_values (dict): Dictionaries of gauge values keyed by gauge name, as returned by metrics.snapshot
+
+    Returns:
+        embeds (array): The discord embeds in the order they should be shown
+    '''
+    header = f"{'stage':<26}{'count':>7}{'errors':>7}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+    # Room left in a description for the code block fence and the header
+    room = MAX_DESCRIPTION_CHARACTERS - len("```\n" + header + "\n```")
+
+    tables = [[]]
+    length = 0
+    for stage, summary in stage_summaries.items():
+        p50, p95, p99 = (f"{summary[key] * 1000:.1f}" for key in ('p50', 'p95', 'p99'))
+        line = f"\n{stage:<26}{summary['count']:>7}{summary['errors']:>7}{p50:>9}{p95:>9}{p99:>9}"
+        if tables[-1] and length + len(line) > room:
+            tables.append([])
+            length = 0
+        tables[-1].append(line)
+        length += len(line)
+
+    embeds = []
+    for table in tables:
+        title = "Bot Stats" if not embeds else "Bot Stats (continued)"
+        embeds.append(discord.Embed(title=title, description="```\n" + header + "".join(table) + "\n```", color=discord.Color.blue()))
+
+    embed = None
+    for name, values in gauge_values.items():
+        value = "\n".join(f"{key}: {value}" for key, value in values.items()) or "none"
+        if len(value) > MAX_FIELD_VALUE_CHARACTERS:
+            value = value[:MAX_FIELD_VALUE_CHARACTERS - 3] + "..."
+        if embed == None or len(embed.fields) == MAX_FIELDS or len(embed) + len(name) + len(value) > MAX_EMBED_CHARACTERS:
+            embed = discord.Embed(title="Gauges", color=discord.Color.blue())
+            embeds.append(embed)
+        embed.add_field(name=name, value=value, inline=True)
+
+    return embeds
+
+def pack_embeds(embeds):
+    '''
+    Groups embeds into as few messages as Discord allows: at most 10 embeds and 6000 characters of embed text per message
+
+    Args:
+        embeds (array): discord embeds in the order they should be shown
+
+    Returns:
+        messages (array): An array of embeds for each message, in order
+    '''
+    messages = []
+    current = []
+    characters = 0
+    for embed in embeds:
+        # len() of an embed is the character count Discord checks against the limit
+        length = len(embed)
+        if current and (len(current) == MAX_EMBEDS_PER_MESSAGE or characters + length > MAX_EMBED_CHARACTERS):
+            messages.append(current)
+            current = []
+            characters = 0
+        current.append(embed)
+        characters += length
+
+    if current:
+        messages.append(current)
+
+    return messages
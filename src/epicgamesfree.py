@@ -1,6 +1,20 @@
-import requests
+import asyncio
+import datetime
+import json
+from decouple import config
+import http_client
+import metrics
+
+FREE_GAMES_URL = "https://store-site-backend-static-ipv4.ak.epicgames.com/freeGamesPromotions?locale=en-US&country=US&allowCountries=US"
+REQUEST_TIMEOUT = config('EPIC_REQUEST_TIMEOUT', default=15, cast=float)
+# How long free games are kept when none of them has an expiry date
+CACHE_TTL = config('EPIC_CACHE_TTL', default=3600, cast=float)
+# How soon to ask again when every free game has expired but Epic has not published the next ones yet
+POLL_SECONDS = config('FREE_GAMES_POLL_SECONDS', default=300, cast=float)
+ELEMENTS_PATH = ('"searchStore"', '"elements"')
 
 class GameInfo:
+    id = None
     title = None
     description = None
     start_date = None
@@ -8,8 +22,11 @@ class GameInfo:
     original_price = None
     game_url = None
     game_image = None
+    starts_at = None
+    expires_at = None
 
-    def __init__(self, title, description, start_date, end_date, original_price, game_url, game_image):
+    def __init__(self, title, description, start_date, end_date, original_price, game_url, game_image, expires_at=None, id=None, starts_at=None):
+        self.id = id
         self.title = title
         self.description = description
         self.start_date = start_date
@@ -17,12 +34,141 @@ class GameInfo:
         self.original_price = original_price
         self.game_url = game_url
         self.game_image = game_image
+        self.expires_at = expires_at
+        self.starts_at = starts_at
 
+    @property
+    def promotion_id(self):
+        '''Identifies this run of the promotion, so the same game being free again later counts as a new promotion'''
+        return f"{self.id}:{self.start_date}"
 
 
-def get_free_epic_games():
+
+class FreeGamesCache:
+    '''The last free games parsed from Epic, kept until the first of them expires'''
+    def __init__(self):
+        self.games = None
+        self.upcoming_starts = []
+        self.etag = None
+        self.last_modified = None
+        self.expires_at = None
+        self.hits = 0
+        self.fetches = 0
+        self.not_modified = 0
+        self.lock = asyncio.Lock()
+
+    def is_fresh(self, now):
+        return self.games != None and self.expires_at != None and now < self.expires_at
+
+    def update(self, games, upcoming_starts, etag, last_modified, now):
+        '''Stores newly parsed free games and when the upcoming ones start, fresh until the earliest expiry among them'''
+        self.games = games
+        self.upcoming_starts = upcoming_starts
+        self.etag = etag
+        self.last_modified = last_modified
+        self.expires_at = earliest_expiry(games, now)
+
+    def next_start(self, now):
+        '''Returns when the next announced free game promotion starts, None if Epic has not announced one'''
+        starts = [start for start in self.upcoming_starts if start > now]
+        return min(starts) if starts else None
+
+    def stats(self):
+        '''Returns the cache counters for the metrics gauges'''
+        return {
+            'hits': self.hits,
+            'fetches': self.fetches,
+            'not_modified': self.not_modified,
+            'seconds_until_expiry': None if self.expires_at == None else max(0, int((self.expires_at - datetime.datetime.now(datetime.timezone.utc)).total_seconds())),
+        }
+
+free_games_cache = FreeGamesCache()
+metrics.register_gauges('epic_cache', free_games_cache.stats)
+
+
+
+def parse_epic_date(value):
+    '''Turns a date from the Epic json, e.g. 2026-10-22T15:00:00.000Z, into a timezone aware datetime, None if there is none'''
+    if not value:
+        return None
+    return datetime.datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+
+
+def earliest_expiry(games, now):
+    '''
+    Finds when the first of the current free games stops being free. Games that already expired are ignored,
+    since Epic keeps listing them for a few minutes after the next promotion is due.
+
+    Args:
+        games (array): GameInfo objects
+        now (datetime): The current time in UTC
+
+    Returns:
+        expires_at (datetime): The earliest expiry still in the future. If there is none, now plus EPIC_CACHE_TTL
+            when a game is free without an end date, otherwise now plus FREE_GAMES_POLL_SECONDS
+    '''
+    expiries = [game.expires_at for game in games if game.expires_at != None and game.expires_at > now]
+    if expiries:
+        return min(expiries)
+    if any(game.expires_at == None for game in games):
+        return now + datetime.timedelta(seconds=CACHE_TTL)
+    return now + datetime.timedelta(seconds=POLL_SECONDS)
+
+
+
+@metrics.timed('epic.fetch')
+async def fetch_promotions(url, etag=None, last_modified=None):
+    '''
+    Downloads the free games promotions, as a conditional request when we have a copy. In record mode the response
+    is also saved to the disk cache and in replay mode it is only read from it.
+
+    Args:
+        url (string): The url of the promotions endpoint
+        etag (string): The ETag of the copy we have, sent as If-None-Match
+        last_modified (string): The Last-Modified of the copy we have, sent as If-Modified-Since
+
+    Returns:
+        text (string): The response body, None when our copy is still current
+        etag (string): The ETag of the response
+        last_modified (string): The Last-Modified of the response
+    '''
+    response = await http_client.fetch(url, etag, last_modified, timeout=REQUEST_TIMEOUT)
+    text = None if response.not_modified else response.text
+    return text, response.etag, response.last_modified
+
+
+
+@metrics.timed('epic.decode')
+def decode_elements(text):
+    '''
+    Decodes only the data.Catalog.searchStore.elements array of the promotions response instead of the whole document
+
+    Args:
+        text (string): The promotions response
+
+    Returns:
+        elements (array): The catalog elements
     '''
-    Retrieves information on free game deals on epic games
+    position = 0
+    for key in ELEMENTS_PATH:
+        position = text.find(key, position)
+        if position == -1:
+            # Not laid out the way we expect, so fall back to decoding everything
+            return json.loads(text)["data"]["Catalog"]["searchStore"]["elements"]
+        position += len(key)
+
+    start = text.find('[', position)
+    elements, end = json.JSONDecoder().raw_decode(text, start)
+
+    return elements
+
+
+
+async def get_free_epic_games_async():
+    '''
+    Retrieves information on free game deals on epic games. The result is kept until the first of the games expires,
+    after which Epic is asked again with a conditional request, so the promotions are only downloaded and parsed when they change.
 
     Args:
         None
@@ -30,27 +176,71 @@ def get_free_epic_games():
     Returns:
         free_games (array): Array of game objects that contain information on free games from Epic Games
     '''
+    async with free_games_cache.lock:
+        now = datetime.datetime.now(datetime.timezone.utc)
+        if free_games_cache.is_fresh(now):
+            free_games_cache.hits += 1
+            return [game for game in free_games_cache.games if game.expires_at == None or game.expires_at > now]
+
+        text, etag, last_modified = await fetch_promotions(FREE_GAMES_URL, free_games_cache.etag, free_games_cache.last_modified)
+        free_games_cache.fetches += 1
+        if text == None and free_games_cache.games != None:
+            free_games_cache.not_modified += 1
+            games = free_games_cache.games
+            upcoming_starts = free_games_cache.upcoming_starts
+        else:
+            elements = await asyncio.to_thread(decode_elements, text)
+            games = parse_elements(elements)
+            upcoming_starts = parse_upcoming_starts(elements)
+        free_games_cache.update(games, upcoming_starts, etag, last_modified, now)
+
+        return [game for game in games if game.expires_at == None or game.expires_at > now]
+
+
+
+def get_free_epic_games():
+    '''Blocking version of get_free_epic_games_async for use outside of the bot's event loop'''
+    return asyncio.run(http_client.run_and_close(get_free_epic_games_async()))
+
+
+
+def parse_free_games(free_game_json):
+    '''
+    Pulls the games with a 100% discount out of the freeGamesPromotions json
+
+    Args:
+        free_game_json (dict): The decoded freeGamesPromotions response
+
+    Returns:
+        free_games (array): Array of game objects that contain information on free games from Epic Games
+    '''
+    return parse_elements(free_game_json["data"]["Catalog"]["searchStore"]["elements"])
 
-    url = "https://store-site-backend-static-ipv4.ak.epicgames.com/freeGamesPromotions?locale=en-US&country=US&allowCountries=US"
-    response = requests.get(url)
 
-    free_game_json = response.json()
 
-    # Puts the json in a file
+@metrics.timed('epic.parse')
+def parse_elements(elements):
     '''
-    with open("free_game_json", "w") as f:
-        json.dump(free_game_json, f, indent="")
+    Pulls the games with a 100% discount out of the catalog elements of the freeGamesPromotions json
+
+    Args:
+        elements (array): The data.Catalog.searchStore.elements array
+
+    Returns:
+        free_games (array): Array of game objects that contain information on free games from Epic Games
     '''
-        
     free_games = []
 
     # For each element of the json, pull relevant information for each game that has a 100% discount
-    for element in free_game_json["data"]["Catalog"]["searchStore"]["elements"]:
+    for element in elements:
         if element["price"]["totalPrice"]["discountPrice"] == 0:
             title = element["title"]
             description = element["description"]
-            start_date, start_time = element["effectiveDate"].split('T')
-            end_date, end_time = element["expiryDate"].split('T')
+            # Games that stay free have no expiryDate
+            starts_at = parse_epic_date(element.get("effectiveDate"))
+            expires_at = parse_epic_date(element.get("expiryDate"))
+            start_date = starts_at.date().isoformat() if starts_at != None else None
+            end_date = expires_at.date().isoformat() if expires_at != None else None
             original_price = element["price"]["totalPrice"]["originalPrice"]
             original_price /= 100
 
@@ -64,15 +254,36 @@ def get_free_epic_games():
                 product_page = element["productSlug"]
                 game_url = "https://store.epicgames.com/en-US/p/" + product_page if product_page != None else None
 
+            game_image = None
             for image in element["keyImages"]:
                 if image["type"] == "OfferImageWide":
                     game_image = image["url"]
                 elif image["type"] == "VaultClosed" and title.find("Mystery Game") != -1:
                     game_image = image["url"]
-            game = GameInfo(title, description, start_date, end_date, original_price, game_url, game_image)
+            game = GameInfo(title, description, start_date, end_date, original_price, game_url, game_image, expires_at, element.get("id"), starts_at)
             free_games.append(game)
 
     return free_games
 
+def parse_upcoming_starts(elements):
+    '''
+    Finds when the announced free games become free. These are still full price, so parse_elements skips them
+
+    Args:
+        elements (array): The data.Catalog.searchStore.elements array
+
+    Returns:
+        starts (array): The sorted start datetimes of the upcoming 100% discount promotions
+    '''
+    starts = set()
+    for element in elements:
+        promotions = element.get("promotions") or {}
+        for upcoming in promotions.get("upcomingPromotionalOffers") or []:
+            for offer in upcoming.get("promotionalOffers") or []:
+                if offer.get("discountSetting", {}).get("discountPercentage") == 0 and offer.get("startDate"):
+                    starts.add(parse_epic_date(offer["startDate"]))
+
+    return sorted(starts)
+
 if __name__ == '__main__':
     get_free_epic_games()
\ No newline at end of file
@@ -1,3 +1,18 @@
 class UserDoesNotExist(Exception):
     '''Raised when a specified user does not exist.'''
-    pass
\ No newline at end of file
+    pass
+
+class ResponseNotRecorded(Exception):
+    '''Raised when a response is requested in replay mode but was never recorded.'''
+    pass
+
+class RetryableRequestError(Exception):
+    '''Raised when a store request failed in a way that is worth retrying, e.g. a 429 or a dropped connection.'''
+    def __init__(self, url, status=None, retry_after=None):
+        self.url = url
+        self.status = status
+        self.retry_after = retry_after
+        if status != None:
+            super().__init__(f"{url} responded with {status}")
+        else:
+            super().__init__(f"Could not connect to {url}")
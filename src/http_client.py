@@ -0,0 +1,121 @@
+import asyncio
+import aiohttp
+import errors
+import request_scheduler
+import response_cache
+
+# Used when a caller does not pass its own timeout
+DEFAULT_TIMEOUT = 15
+
+_session = None
+
+class PageResponse:
+    '''The parts of a store response the scrapers use'''
+    status = None
+    text = None
+    etag = None
+    last_modified = None
+
+    def __init__(self, status, text, etag, last_modified):
+        self.status = status
+        self.text = text
+        self.etag = etag
+        self.last_modified = last_modified
+
+    @property
+    def not_modified(self):
+        '''True when a conditional request found the page unchanged'''
+        return self.status == 304
+
+def get_session():
+    '''
+    Returns the aiohttp session every store request in the process shares, creating it on first use
+
+    Args:
+        None
+
+    Returns:
+        session (Object): The pooled aiohttp.ClientSession
+    '''
+    global _session
+
+    if _session is None or _session.closed:
+        # request_scheduler never lets more requests than this out at once, so neither does the pool
+        connector = aiohttp.TCPConnector(limit=request_scheduler.MAX_IN_FLIGHT, ttl_dns_cache=300)
+        _session = aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=DEFAULT_TIMEOUT))
+
+    return _session
+
+async def close_session():
+    '''Closes the shared aiohttp session if one is open'''
+    global _session
+
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+
+async def run_and_close(coroutine):
+    '''Runs a coroutine and closes the session once it finishes, for the blocking entry points'''
+    try:
+        return await coroutine
+    finally:
+        await close_session()
+
+async def fetch(url, etag=None, last_modified=None, timeout=None, read_body=None):
+    '''
+    Downloads a url through the request scheduler, optionally as a conditional request. In record mode the response
+    is also saved to the disk cache and a restarted bot revalidates the saved copy, and in replay mode the response
+    is only read from the disk cache.
+
+    Args:
+        url (String): The url to download
+        etag (String): The ETag of a copy we already have, sent as If-None-Match
+        last_modified (String): The Last-Modified of a copy we already have, sent as If-Modified-Since
+        timeout (float): Seconds each attempt may take, DEFAULT_TIMEOUT if None
+        read_body (function): An async function taking the aiohttp response and returning the bytes it read, for callers
+            that stop reading early. Those bodies are saved as truncated. The whole body is read if None
+
+    Returns:
+        response (object): A PageResponse, with no text when our copy was not modified
+    '''
+    if response_cache.is_replaying():
+        saved = await asyncio.to_thread(response_cache.load_for_replay, url)
+        if (etag and saved.etag == etag) or (last_modified and saved.last_modified == last_modified):
+            return PageResponse(304, None, etag, last_modified)
+        return PageResponse(saved.status, saved.text(), saved.etag, saved.last_modified)
+
+    saved = None
+    headers = {}
+    if etag:
+        headers['If-None-Match'] = etag
+    if last_modified:
+        headers['If-Modified-Since'] = last_modified
+    if not headers and response_cache.is_recording():
+        saved = await asyncio.to_thread(response_cache.load, url)
+        # Only a caller that reads part of the body can use a copy that was cut short
+        if saved != None and saved.truncated and read_body == None:
+            saved = None
+        headers = response_cache.conditional_headers(saved)
+
+    session = get_session()
+    request_timeout = aiohttp.ClientTimeout(total=timeout) if timeout != None else None
+
+    async def attempt():
+        try:
+            async with session.get(url, headers=headers, timeout=request_timeout) as response:
+                request_scheduler.check_response(url, response.status, response.headers)
+                if response.status == 304:
+                    if saved != None:
+                        # The copy on disk is still current so a restarted bot does not download it again
+                        return PageResponse(saved.status, saved.text(), saved.etag, saved.last_modified)
+                    return PageResponse(304, None, etag, last_modified)
+                response.raise_for_status()
+                body = await response.read() if read_body == None else await read_body(response)
+                if response_cache.is_recording():
+                    await asyncio.to_thread(response_cache.store, url, response.status, response.headers, body, read_body != None)
+                return PageResponse(response.status, body.decode(response.charset or 'utf-8', errors='replace'), response.headers.get('ETag'), response.headers.get('Last-Modified'))
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+            raise errors.RetryableRequestError(url) from e
+
+    # The scheduler spaces out requests to each host, bounds how many are in flight and retries throttled ones
+    return await request_scheduler.run(url, attempt)
@@ -0,0 +1,309 @@
+'''
+Adds games to the database in bulk instead of one -rategame at a time. Games are scraped concurrently
+under a rate limit and saved in batched transactions. Progress is checkpointed after every batch, so a
+run that is stopped picks up where it left off when started again with the same source.
+
+Usage:
+    python ingest.py --appids 292140 1245620
+    python ingest.py --appids-file appids.txt
+    python ingest.py --specials
+    python ingest.py --search "https://store.steampowered.com/search/?specials=1" --max-pages 10
+'''
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+from decouple import config
+import db_manager
+import http_client
+import metrics
+import migrate
+import request_scheduler
+import steamsales
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+CHECKPOINT_PATH = os.path.join(current_dir, 'ingest_checkpoint.json')
+INGEST_CONCURRENCY = config('INGEST_CONCURRENCY', default=request_scheduler.MAX_IN_FLIGHT, cast=int)
+INGEST_RATE = config('INGEST_RATE', default=2, cast=float)
+INGEST_BATCH_SIZE = config('INGEST_BATCH_SIZE', default=50, cast=int)
+# Every store request the scrapers make goes through these stages
+PAGE_STAGES = ('steam.fetch', 'steam.fetch_specials')
+
+class RateLimiter:
+    '''Spaces out the start of each scrape so at most rate scrapes start per second'''
+    def __init__(self, rate):
+        self.interval = 1 / rate if rate > 0 else 0
+        self.next_start = 0.0
+        self.lock = asyncio.Lock()
+
+    async def wait(self):
+        '''Waits until the next scrape may start'''
+        async with self.lock:
+            now = time.monotonic()
+            if self.next_start > now:
+                await asyncio.sleep(self.next_start - now)
+                now = self.next_start
+            self.next_start = now + self.interval
+
+class Checkpoint:
+    '''
+    The games a run is ingesting and which of them are saved, kept in a json file.
+    The list of games is stored too, so a resumed specials or search run works on the same listing.
+    '''
+    def __init__(self, path, source, requests, done=None):
+        self.path = path
+        self.source = source
+        self.requests = requests
+        self.done = set(done or ())
+
+    @classmethod
+    def load(cls, path, source):
+        '''
+        Reads the checkpoint of an earlier run of the same source
+
+        Args:
+            path (string): The checkpoint file
+            source (string): Describes what is being ingested, e.g. "appids:292140,1245620"
+
+        Returns:
+            checkpoint (object): The Checkpoint, None if there is none for this source
+        '''
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            data = json.load(f)
+        if data.get('source') != source:
+            return None
+        requests = [steamsales.GameRequest(id, item_link(id, is_game), is_game) for id, is_game in data['requests']]
+        return cls(path, source, requests, (tuple(key) for key in data['done']))
+
+    def save(self):
+        '''Writes the checkpoint, replacing the file in one step so a killed run never leaves half of one'''
+        data = {
+            'source': self.source,
+            'requests': [[request.id, request.is_game] for request in self.requests],
+            'done': sorted(self.done),
+        }
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, 'w') as f:
+            json.dump(data, f)
+        os.replace(temp_path, self.path)
+
+    def remaining(self):
+        '''Returns the requests for the games that are not saved yet'''
+        return [request for request in self.requests if steamsales.cache_key(request) not in self.done]
+
+class Progress:
+    '''Counts pages downloaded and rows written since the run started'''
+    def __init__(self, total):
+        self.total = total
+        self.saved = 0
+        self.failed = 0
+        self.started = time.perf_counter()
+        self.pages_at_start = count_pages()
+
+    def pages(self):
+        return count_pages() - self.pages_at_start
+
+    def report(self):
+        '''Returns a line with the progress and the pages/sec and rows/sec so far'''
+        elapsed = max(time.perf_counter() - self.started, 1e-9)
+        return (f"{self.saved + self.failed}/{self.total} games ({self.failed} failed), "
+                f"{self.pages()} pages at {self.pages() / elapsed:.1f} pages/sec, "
+                f"{self.saved} rows at {self.saved / elapsed:.1f} rows/sec")
+
+def count_pages():
+    '''Returns how many store requests this process has made'''
+    stage_summaries, gauge_values = metrics.snapshot()
+    return sum(stage_summaries[stage]['count'] for stage in PAGE_STAGES if stage in stage_summaries)
+
+def item_link(id, is_game):
+    '''Returns the store page of a game or package'''
+    return steamsales.SpecialItem(id, is_game).link
+
+def read_appids(path):
+    '''
+    Reads appids from a file, one per line. Blank lines and lines starting with # are skipped
+
+    Args:
+        path (string): The file
+
+    Returns:
+        appids (array): The appids as ints
+    '''
+    with open(path) as f:
+        return [int(line.strip()) for line in f if line.strip() and not line.strip().startswith('#')]
+
+async def list_source(args):
+    '''
+    Builds the requests for the games to ingest
+
+    Args:
+        args (object): The parsed command line arguments
+
+    Returns:
+        requests (array): GameRequest objects, each game once
+    '''
+    if args.specials:
+        items = await steamsales.fetch_specials(steamsales.STEAM_HOMEPAGE_URL, None)
+    elif args.search:
+        items = []
+        for page in range(args.max_pages):
+            page_items, total_count = await steamsales.fetch_search_results(args.search, page * steamsales.SEARCH_PAGE_SIZE)
+            items.extend(page_items)
+            if not page_items or (page + 1) * steamsales.SEARCH_PAGE_SIZE >= total_count:
+                break
+    else:
+        appids = read_appids(args.appids_file) if args.appids_file else args.appids
+        items = [steamsales.SpecialItem(appid, True) for appid in appids]
+
+    requests = {}
+    for item in items:
+        request = steamsales.GameRequest(item.id, item.link, item.is_game)
+        requests.setdefault(steamsales.cache_key(request), request)
+
+    return list(requests.values())
+
+def describe_source(args):
+    '''Returns the string that identifies a source in the checkpoint'''
+    if args.specials:
+        return "specials"
+    if args.search:
+        return f"search:{args.search}:{args.max_pages}"
+    if args.appids_file:
+        return f"appids_file:{os.path.abspath(args.appids_file)}"
+    return f"appids:{','.join(str(appid) for appid in args.appids)}"
+
+def save_batch(games):
+    '''
+    Saves a batch of games in one transaction. If the batch fails, its games are saved one at a time
+    so one bad game does not lose the rest
+
+    Args:
+        games (array): game objects (made in steamsales.py)
+
+    Returns:
+        saved (array): The games that were saved
+    '''
+    try:
+        db_manager.save_games(games)
+        return games
+    except Exception as e:
+        logging.warning(f"Could not save a batch of {len(games)} games, saving them one at a time: {e}")
+
+    saved = []
+    for game in games:
+        try:
+            db_manager.save_game(game)
+            saved.append(game)
+        except Exception as e:
+            logging.error(f"Could not save game {game.id}: {e}")
+    return saved
+
+async def ingest(requests, checkpoint, concurrency, rate, batch_size):
+    '''
+    Scrapes games concurrently and saves them in batches, checkpointing after every batch
+
+    Args:
+        requests (array): GameRequest objects for the games that are not saved yet
+        checkpoint (object): The run's Checkpoint
+        concurrency (int): How many games are scraped at once
+        rate (float): How many scrapes may start per second, 0 for no limit
+        batch_size (int): How many games are saved per transaction
+
+    Returns:
+        progress (object): The run's Progress
+    '''
+    pending = asyncio.Queue()
+    for request in requests:
+        pending.put_nowait(request)
+
+    limiter = RateLimiter(rate)
+    progress = Progress(len(requests))
+    batch = []
+    write_lock = asyncio.Lock()
+
+    async def flush():
+        async with write_lock:
+            items = batch[:]
+            batch.clear()
+            if not items:
+                return
+            saved = await asyncio.to_thread(save_batch, [game for request, game in items])
+            progress.saved += len(saved)
+            progress.failed += len(items) - len(saved)
+            saved_ids = {id(game) for game in saved}
+            checkpoint.done.update(steamsales.cache_key(request) for request, game in items if id(game) in saved_ids)
+            await asyncio.to_thread(checkpoint.save)
+            print(progress.report(), flush=True)
+
+    async def worker():
+        while True:
+            try:
+                request = pending.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            await limiter.wait()
+            try:
+                # Goes through the game cache, so a game the bot already has fresh or is already fetching is not scraped twice
+                game = await steamsales.get_game_cached(request)
+            except Exception as e:
+                logging.error(f"Could not scrape {request.game_link}: {e}")
+                progress.failed += 1
+                continue
+            batch.append((request, game))
+            if len(batch) >= batch_size:
+                await flush()
+
+    await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
+    await flush()
+
+    return progress
+
+async def run(args):
+    '''Lists the source, resumes its checkpoint if there is one and ingests the remaining games'''
+    source = describe_source(args)
+    checkpoint = None if args.restart else Checkpoint.load(args.checkpoint, source)
+    if checkpoint == None:
+        checkpoint = Checkpoint(args.checkpoint, source, await list_source(args))
+        checkpoint.save()
+    else:
+        print(f"Resuming from {args.checkpoint}, {len(checkpoint.done)} of {len(checkpoint.requests)} games are already saved")
+
+    try:
+        progress = await ingest(checkpoint.remaining(), checkpoint, args.concurrency, args.rate, args.batch_size)
+    finally:
+        await http_client.close_session()
+
+    print(f"Done: {progress.report()}")
+    if checkpoint.remaining():
+        print(f"{len(checkpoint.remaining())} games could not be added, run the same command again to retry them")
+    else:
+        os.remove(args.checkpoint)
+
+def main():
+    parser = argparse.ArgumentParser(description="Scrapes games from steam into the database in bulk")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--appids', type=int, nargs='+', help="the appids of the games to add")
+    source.add_argument('--appids-file', help="a file with one appid per line")
+    source.add_argument('--specials', action='store_true', help="every game in the specials on the store front page")
+    source.add_argument('--search', help="a store search link, e.g. https://store.steampowered.com/search/?specials=1")
+    parser.add_argument('--max-pages', type=int, default=10, help=f"how many pages of {steamsales.SEARCH_PAGE_SIZE} search results to read")
+    parser.add_argument('--concurrency', type=int, default=INGEST_CONCURRENCY, help="how many games are scraped at once")
+    parser.add_argument('--rate', type=float, default=INGEST_RATE, help="how many games may start scraping per second, 0 for no limit")
+    parser.add_argument('--batch-size', type=int, default=INGEST_BATCH_SIZE, help="how many games are saved per transaction")
+    parser.add_argument('--checkpoint', default=CHECKPOINT_PATH, help="where progress is saved so a stopped run can resume")
+    parser.add_argument('--restart', action='store_true', help="ignore the checkpoint and start over")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    try:
+        migrate.migrate_database()
+        asyncio.run(run(args))
+    finally:
+        db_manager.close_connections()
+
+if __name__ == '__main__':
+    main()
@@ -1,25 +1,15 @@
-import sqlite3
-import os
+import db_manager
+import migrate
 
 def create_database():
     '''
-    Creates database via sql script
+    Creates the database, or brings an existing one up to the newest schema, via the scripts in migrations/
     '''
-    current_dir = os.path.dirname(os.path.abspath(__file__))
-    db_path = os.path.join(current_dir, 'games_and_interests.db')
-    sql_script_path = os.path.join(current_dir, 'games_and_interests.sql')
-
     try:
-        conn = sqlite3.connect(db_path)
-        with open(sql_script_path) as f:
-            conn.executescript(f.read())
-    except sqlite3.DatabaseError as e:
-        conn.rollback
-        raise e
+        for migration in migrate.migrate_database():
+            print(f"Applied migration {migration.version:04d} {migration.name}")
     finally:
-        conn.commit()
-        if conn:
-            conn.close()
+        db_manager.close_connections()
 
 if __name__ == '__main__':
-    create_database()
\ No newline at end of file
+    create_database()
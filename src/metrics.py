@@ -0,0 +1,219 @@
+import asyncio
+import functools
+import os
+import threading
+import time
+from collections import deque
+from decouple import config
+
+WINDOW_SIZE = config('METRICS_WINDOW_SIZE', default=1000, cast=int)
+METRIC_PREFIX = 'mysticbot'
+
+class StageStats:
+    '''Latency samples for one stage. Percentiles come from a rolling window of recent samples, counts are totals'''
+    def __init__(self, window_size):
+        self.samples = deque(maxlen=window_size)
+        self.count = 0
+        self.errors = 0
+        self.total_seconds = 0.0
+
+    def observe(self, seconds, error):
+        self.samples.append(seconds)
+        self.count += 1
+        self.total_seconds += seconds
+        if error:
+            self.errors += 1
+
+    def percentile(self, percent):
+        '''
+        Finds a percentile of the recent samples
+
+        Args:
+            percent (float): The percentile, e.g. 95
+
+        Returns:
+            seconds (float): The latency at that percentile, None if there are no samples
+        '''
+        samples = sorted(self.samples)
+        if not samples:
+            return None
+        index = min(len(samples) - 1, int(round(percent / 100 * (len(samples) - 1))))
+        return samples[index]
+
+    def summary(self):
+        '''Returns the stage's counts and p50/p95/p99 latencies in seconds'''
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'sum': self.total_seconds,
+            'p50': self.percentile(50),
+            'p95': self.percentile(95),
+            'p99': self.percentile(99),
+        }
+
+stages = {}
+gauges = {}
+_lock = threading.Lock()
+
+def observe(stage, seconds, error=False):
+    '''
+    Records how long one run of a stage took. Safe to call from worker threads
+
+    Args:
+        stage (string): The stage name, e.g. "steam.fetch"
+        seconds (float): How long the stage took
+        error (boolean): True if the stage raised an exception
+
+    Returns:
+        None
+    '''
+    with _lock:
+        stats = stages.get(stage)
+        if stats == None:
+            stats = stages[stage] = StageStats(WINDOW_SIZE)
+        stats.observe(seconds, error)
+
+class Timer:
+    '''Times a stage as a context manager, async context manager or decorator for plain and async functions'''
+    def __init__(self, stage):
+        self.stage = stage
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        # A cancelled stage was not a failure of the stage itself
+        error = exc_type != None and not issubclass(exc_type, asyncio.CancelledError)
+        observe(self.stage, time.perf_counter() - self.start, error)
+        return False
+
+    async def __aenter__(self):
+        return self.__enter__()
+
+    async def __aexit__(self, exc_type, exc, traceback):
+        return self.__exit__(exc_type, exc, traceback)
+
+    def __call__(self, function):
+        stage = self.stage
+
+        if asyncio.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def async_wrapper(*args, **kwargs):
+                with Timer(stage):
+                    return await function(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with Timer(stage):
+                return function(*args, **kwargs)
+        return wrapper
+
+def timed(stage):
+    '''
+    Times a stage, e.g. "with metrics.timed('steam.parse'):" or "@metrics.timed('db.add_game')"
+
+    Args:
+        stage (string): The stage name
+
+    Returns:
+        timer (object): A Timer for the stage
+    '''
+    return Timer(stage)
+
+def register_gauges(name, function):
+    '''
+    Adds a group of values that are read when metrics are reported, e.g. cache counters
+
+    Args:
+        name (string): The name of the group, e.g. "steam_game_cache"
+        function (function): Returns a dictionary of numbers when called
+
+    Returns:
+        None
+    '''
+    gauges[name] = function
+
+def snapshot():
+    '''
+    Collects every stage's summary and every gauge group
+
+    Args:
+        None
+
+    Returns:
+        stage_summaries (dict): Summaries keyed by stage name
+        gauge_values (dict): Gauge dictionaries keyed by group name
+    '''
+    with _lock:
+        stage_summaries = {stage: stats.summary() for stage, stats in sorted(stages.items())}
+    gauge_values = {name: function() for name, function in sorted(gauges.items())}
+
+    return stage_summaries, gauge_values
+
+def render_prometheus():
+    '''
+    Renders every metric in the Prometheus text format
+
+    Args:
+        None
+
+    Returns:
+        text (string): The metrics page
+    '''
+    stage_summaries, gauge_values = snapshot()
+    lines = [
+        f"# HELP {METRIC_PREFIX}_stage_seconds Latency of each bot stage over the recent window",
+        f"# TYPE {METRIC_PREFIX}_stage_seconds summary",
+    ]
+    for stage, summary in stage_summaries.items():
+        for quantile, key in (('0.5', 'p50'), ('0.95', 'p95'), ('0.99', 'p99')):
+            if summary[key] != None:
+                lines.append(f'{METRIC_PREFIX}_stage_seconds{{stage="{stage}",quantile="{quantile}"}} {summary[key]:.6f}')
+        lines.append(f'{METRIC_PREFIX}_stage_seconds_sum{{stage="{stage}"}} {summary["sum"]:.6f}')
+        lines.append(f'{METRIC_PREFIX}_stage_seconds_count{{stage="{stage}"}} {summary["count"]}')
+
+    lines.append(f"# HELP {METRIC_PREFIX}_stage_errors_total Runs of each bot stage that raised an exception")
+    lines.append(f"# TYPE {METRIC_PREFIX}_stage_errors_total counter")
+    for stage, summary in stage_summaries.items():
+        lines.append(f'{METRIC_PREFIX}_stage_errors_total{{stage="{stage}"}} {summary["errors"]}')
+
+    for name, values in gauge_values.items():
+        for key, value in values.items():
+            if value != None:
+                lines.append(f"{METRIC_PREFIX}_{name}_{key} {value}")
+
+    return "\n".join(lines) + "\n"
+
+def write_prometheus_file(path):
+    '''Writes the metrics page to a file, replacing it in one step so scrapers never read half a file'''
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w') as f:
+        f.write(render_prometheus())
+    os.replace(temp_path, path)
+
+async def start_http_server(port, host='127.0.0.1'):
+    '''
+    Serves the metrics page at /metrics
+
+    Args:
+        port (int): The port to listen on
+        host (string): The address to listen on, local only by default
+
+    Returns:
+        runner (object): The aiohttp AppRunner, call cleanup() on it to stop the server
+    '''
+    from aiohttp import web
+
+    async def handle_metrics(request):
+        return web.Response(text=render_prometheus(), content_type='text/plain')
+
+    app = web.Application()
+    app.router.add_get('/metrics', handle_metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+
+    return runner
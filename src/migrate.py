@@ -0,0 +1,185 @@
+import datetime
+import os
+import re
+import sqlite3
+import sys
+import db_manager
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+MIGRATIONS_DIR = os.path.join(current_dir, 'migrations')
+MIGRATION_FILE = re.compile(r"^(\d+)_(\w+)\.sql$")
+
+# The queries db_manager runs on every command, with example parameters. The sql is db_manager's own so this checks what actually runs
+RECORD_PRICE_PARAMS = {'game_id': 1, 'price_cents': 999, 'currency': "USD", 'is_on_sale': 1, 'end_date': None, 'scraped_at': "2026-01-01 00:00:00"}
+HOT_QUERIES = {
+    'user_exists': (db_manager.USER_EXISTS_QUERY, (1,)),
+    'game_exists': (db_manager.GAME_EXISTS_QUERY, (1,)),
+    'tag_exists': (db_manager.TAG_EXISTS_QUERY, ("Action",)),
+    'rating_exists': (db_manager.RATING_EXISTS_QUERY, (1, 1)),
+    'update_rating': (db_manager.UPDATE_RATING_QUERY, ("completed", 10, "2026-01-01", 1, 1)),
+    'update_game.rating': (db_manager.UPDATE_GAME_RATING_QUERY, (0.9, 0.9, "2026-01-01", 1)),
+    'record_price': (db_manager.RECORD_PRICE_QUERY, RECORD_PRICE_PARAMS),
+    'get_current_price': (db_manager.CURRENT_PRICE_QUERY, (1,)),
+    'get_lowest_price': (db_manager.LOWEST_PRICE_QUERY, (1,)),
+    'unwatch_game': (db_manager.UNWATCH_GAME_QUERY, (1, 1)),
+    'set_watches_notified': (db_manager.SET_WATCHES_NOTIFIED_QUERY, (999, 1, 1)),
+    'set_watches_last_price': (db_manager.SET_WATCHES_LAST_PRICE_QUERY, (999, 1, 1)),
+    'get_posted_promotions': (db_manager.POSTED_PROMOTIONS_QUERY.format(placeholders="?,?"), ("free_games", "a", "b")),
+    'link_game_tags.tag_ids': (db_manager.TAG_IDS_QUERY.format(placeholders="?,?"), ("Action", "RPG")),
+    'link_game_tags.links': (db_manager.GAME_TAG_LINKS_QUERY, (1,)),
+    'get_rating_summary': (db_manager.RATING_SUMMARY_QUERY, (1,)),
+    'get_ratings_page': (db_manager.RATINGS_PAGE_QUERY, (1, 11)),
+    'get_ratings_page.after': (db_manager.RATINGS_PAGE_AFTER_QUERY, (1, "2026-01-01", 1, 11)),
+}
+
+class Migration:
+    '''A numbered sql script in the migrations directory'''
+    version = None
+    name = None
+    path = None
+
+    def __init__(self, version, name, path):
+        self.version = version
+        self.name = name
+        self.path = path
+
+    def read(self):
+        with open(self.path) as f:
+            return f.read()
+
+def list_migrations(directory=MIGRATIONS_DIR):
+    '''
+    Finds the migration scripts, named like 0002_indexes.sql
+
+    Args:
+        directory (string): The directory holding the scripts
+
+    Returns:
+        migrations (array): Migration objects ordered by version
+
+    Raises:
+        ValueError: If two scripts have the same version
+    '''
+    migrations = {}
+    for file_name in os.listdir(directory):
+        match = MIGRATION_FILE.match(file_name)
+        if match == None:
+            continue
+        version = int(match.group(1))
+        if version in migrations:
+            raise ValueError(f"Migrations {migrations[version].path} and {file_name} have the same version")
+        migrations[version] = Migration(version, match.group(2), os.path.join(directory, file_name))
+
+    return [migrations[version] for version in sorted(migrations)]
+
+def split_statements(script):
+    '''
+    Splits a sql script into statements. executescript would commit the open transaction first,
+    so each statement is run on its own inside the migration's transaction instead.
+
+    Args:
+        script (string): The sql script
+
+    Returns:
+        statements (array): The complete statements in the script
+    '''
+    statements = []
+    statement = ""
+    for line in script.splitlines(keepends=True):
+        statement += line
+        if sqlite3.complete_statement(statement):
+            statements.append(statement.strip())
+            statement = ""
+    return statements
+
+def get_applied_versions(conn):
+    '''Returns the versions of the migrations the database already has'''
+    conn.execute("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER PRIMARY KEY, name TEXT, applied_at TEXT)")
+    return {row[0] for row in conn.execute("SELECT version FROM schema_version").fetchall()}
+
+def migrate_database():
+    '''
+    Brings the database up to the newest schema. Each migration runs in its own transaction and is recorded
+    in the schema_version table, so this is safe to run on every startup and from several processes.
+
+    Args:
+        None
+
+    Returns:
+        applied (array): The Migration objects that were applied
+    '''
+    with db_manager.transaction() as conn:
+        applied_versions = get_applied_versions(conn)
+
+    applied = []
+    for migration in list_migrations():
+        if migration.version in applied_versions:
+            continue
+
+        with db_manager.transaction() as conn:
+            # Another process may have applied it since the versions were read
+            if migration.version in get_applied_versions(conn):
+                continue
+            for statement in split_statements(migration.read()):
+                conn.execute(statement)
+            applied_at = datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+            conn.execute("INSERT INTO schema_version (version, name, applied_at) VALUES (?,?,?)", (migration.version, migration.name, applied_at))
+        applied.append(migration)
+
+    if applied:
+        # Migrations may merge or renumber tags
+        db_manager.clear_tag_cache()
+
+    return applied
+
+def explain_query_plan(query, params=()):
+    '''
+    Asks SQLite how it will run a query
+
+    Args:
+        query (string): The query
+        params (tuple): Example parameters for the query
+
+    Returns:
+        plan (array): The detail line of each step of the plan
+    '''
+    with db_manager.reader() as conn:
+        return [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {query}", params).fetchall()]
+
+def uses_index(plan):
+    '''Returns True if no step of a query plan reads a whole table. Scanning a subquery's own result is fine'''
+    subqueries = {step.split()[1] for step in plan if step.startswith(("CO-ROUTINE ", "MATERIALIZE "))}
+    for step in plan:
+        if step.startswith("SCAN ") and not step.startswith("SCAN CONSTANT ROW") and step.split()[1] not in subqueries:
+            return False
+    return True
+
+def check_query_plans():
+    '''
+    Checks that every query in HOT_QUERIES is answered from an index instead of a table scan
+
+    Args:
+        None
+
+    Returns:
+        results (dict): (uses_index, plan) keyed by query name
+    '''
+    results = {}
+    for name, (query, params) in HOT_QUERIES.items():
+        plan = explain_query_plan(query, params)
+        results[name] = (uses_index(plan), plan)
+    return results
+
+if __name__ == '__main__':
+    for migration in migrate_database():
+        print(f"Applied migration {migration.version:04d} {migration.name}")
+
+    if '--check-plans' in sys.argv:
+        failed = False
+        for name, (ok, plan) in check_query_plans().items():
+            print(f"{'ok  ' if ok else 'SCAN'} {name}: {'; '.join(plan)}")
+            failed = failed or not ok
+        db_manager.close_connections()
+        sys.exit(1 if failed else 0)
+
+    db_manager.close_connections()
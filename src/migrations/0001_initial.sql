@@ -1,6 +1,5 @@
-BEGIN TRANSACTION;
-DROP TABLE IF EXISTS "game";
-CREATE TABLE "game" (
+-- The schema the bot shipped with. IF NOT EXISTS lets databases created by the old games_and_interests.sql adopt it
+CREATE TABLE IF NOT EXISTS "game" (
 	"game_id"	INTEGER,
 	"title"	TEXT,
 	"description"	TEXT,
@@ -8,8 +7,7 @@ CREATE TABLE "game" (
 	"publisher"	TEXT,
 	PRIMARY KEY("game_id")
 );
-DROP TABLE IF EXISTS "game_price";
-CREATE TABLE "game_price" (
+CREATE TABLE IF NOT EXISTS "game_price" (
 	"price_id"	INTEGER,
 	"game_id"	INTEGER,
 	"price"	NUMERIC,
@@ -19,8 +17,7 @@ CREATE TABLE "game_price" (
 	PRIMARY KEY("price_id" AUTOINCREMENT),
 	FOREIGN KEY("game_id") REFERENCES "game"("game_id") ON DELETE CASCADE ON UPDATE CASCADE
 );
-DROP TABLE IF EXISTS "game_rating";
-CREATE TABLE "game_rating" (
+CREATE TABLE IF NOT EXISTS "game_rating" (
 	"rating_id"	INTEGER,
 	"game_id"	INTEGER,
 	"monthly_rating"	REAL,
@@ -29,29 +26,25 @@ CREATE TABLE "game_rating" (
 	PRIMARY KEY("rating_id" AUTOINCREMENT),
 	FOREIGN KEY("game_id") REFERENCES "game"("game_id") ON DELETE CASCADE ON UPDATE CASCADE
 );
-DROP TABLE IF EXISTS "game_tag";
-CREATE TABLE "game_tag" (
+CREATE TABLE IF NOT EXISTS "game_tag" (
 	"game_id"	INTEGER,
 	"tag_id"	INTEGER,
 	FOREIGN KEY("game_id") REFERENCES "game"("game_id") ON DELETE CASCADE ON UPDATE CASCADE,
 	FOREIGN KEY("tag_id") REFERENCES "tag"("tag_id") ON DELETE CASCADE ON UPDATE CASCADE
 );
-DROP TABLE IF EXISTS "tag";
-CREATE TABLE "tag" (
+CREATE TABLE IF NOT EXISTS "tag" (
 	"tag_id"	INTEGER,
 	"tag_name"	TEXT,
 	PRIMARY KEY("tag_id" AUTOINCREMENT)
 );
-DROP TABLE IF EXISTS "user";
-CREATE TABLE "user" (
+CREATE TABLE IF NOT EXISTS "user" (
 	"discord_id"	INTEGER,
 	"first_seen"	TEXT,
 	"last_online"	TEXT,
 	"playstyle"	TEXT CHECK("playstyle" IN ("casual", "competitive", "mix")),
 	PRIMARY KEY("discord_id")
 );
-DROP TABLE IF EXISTS "user_activity";
-CREATE TABLE "user_activity" (
+CREATE TABLE IF NOT EXISTS "user_activity" (
 	"activity_id"	INTEGER,
 	"discord_id"	INTEGER,
 	"game_id"	INTEGER,
@@ -62,4 +55,3 @@ CREATE TABLE "user_activity" (
 	FOREIGN KEY("discord_id") REFERENCES "user"("discord_id") ON DELETE CASCADE ON UPDATE CASCADE,
 	FOREIGN KEY("game_id") REFERENCES "game"("game_id") ON DELETE CASCADE ON UPDATE CASCADE
 );
-COMMIT;
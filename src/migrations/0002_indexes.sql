@@ -0,0 +1,22 @@
+-- Indexes for the hot queries in db_manager
+
+-- Tag names become unique. Point links at the first tag with each name, then drop the duplicates
+UPDATE game_tag SET tag_id = (
+	SELECT MIN(first.tag_id) FROM tag AS duplicate INNER JOIN tag AS first ON first.tag_name = duplicate.tag_name WHERE duplicate.tag_id = game_tag.tag_id
+) WHERE tag_id NOT IN (SELECT MIN(tag_id) FROM tag GROUP BY tag_name);
+DELETE FROM tag WHERE tag_id NOT IN (SELECT MIN(tag_id) FROM tag GROUP BY tag_name);
+DELETE FROM game_tag WHERE rowid NOT IN (SELECT MIN(rowid) FROM game_tag GROUP BY game_id, tag_id);
+CREATE UNIQUE INDEX IF NOT EXISTS "tag_tag_name" ON "tag" ("tag_name");
+
+-- add_game/update_game tag links
+CREATE INDEX IF NOT EXISTS "game_tag_game_id" ON "game_tag" ("game_id", "tag_id");
+
+-- rating_exists and update_rating
+CREATE INDEX IF NOT EXISTS "user_activity_discord_id_game_id" ON "user_activity" ("discord_id", "game_id");
+
+-- get_rating_summary and get_ratings_page
+CREATE INDEX IF NOT EXISTS "user_activity_discord_id_timestamp" ON "user_activity" ("discord_id", "timestamp", "game_id");
+
+-- update_game
+CREATE INDEX IF NOT EXISTS "game_price_game_id" ON "game_price" ("game_id");
+CREATE INDEX IF NOT EXISTS "game_rating_game_id" ON "game_rating" ("game_id");
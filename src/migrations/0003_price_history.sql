@@ -0,0 +1,38 @@
+-- Every price a game has been seen at, in integer cents. A row is only added when the price, sale or end date changed
+CREATE TABLE IF NOT EXISTS "price_history" (
+	"price_history_id"	INTEGER,
+	"game_id"	INTEGER NOT NULL,
+	"price_cents"	INTEGER,
+	"currency"	TEXT NOT NULL,
+	"is_on_sale"	INTEGER NOT NULL CHECK("is_on_sale" IN (0, 1)),
+	"end_date"	TEXT,
+	"scraped_at"	TEXT NOT NULL,
+	PRIMARY KEY("price_history_id" AUTOINCREMENT),
+	FOREIGN KEY("game_id") REFERENCES "game"("game_id") ON DELETE CASCADE ON UPDATE CASCADE
+);
+
+-- Current price and change detection
+CREATE INDEX IF NOT EXISTS "price_history_game_id_scraped_at" ON "price_history" ("game_id", "scraped_at");
+
+-- Lowest price ever
+CREATE INDEX IF NOT EXISTS "price_history_game_id_price_cents" ON "price_history" ("game_id", "price_cents");
+
+-- Keep the one price each game had in game_price. Prices were stored as text like "19.99" or "1,299.99"
+-- and missing end dates as the string "NULL"
+INSERT INTO price_history (game_id, price_cents, currency, is_on_sale, end_date, scraped_at)
+SELECT
+	game_price.game_id,
+	CASE
+		WHEN typeof(price) IN ('integer', 'real') THEN CAST(ROUND(price * 100) AS INTEGER)
+		WHEN REPLACE(price, ',', '') GLOB '[0-9]*' THEN CAST(ROUND(CAST(REPLACE(price, ',', '') AS REAL) * 100) AS INTEGER)
+		ELSE NULL
+	END,
+	COALESCE(currency, 'USD'),
+	COALESCE(is_on_sale, 0),
+	NULLIF(end_date, 'NULL'),
+	COALESCE((SELECT MAX(scrape_date) FROM game_rating WHERE game_rating.game_id = game_price.game_id), date('now')) || ' 00:00:00'
+FROM game_price
+WHERE NOT EXISTS (SELECT 1 FROM price_history WHERE price_history.game_id = game_price.game_id)
+ORDER BY game_price.price_id;
+
+DROP TABLE IF EXISTS "game_price";
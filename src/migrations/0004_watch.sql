@@ -0,0 +1,19 @@
+-- Games users asked to be told about when their price drops, optionally below a target price
+CREATE TABLE IF NOT EXISTS "watch" (
+	"watch_id"	INTEGER,
+	"discord_id"	INTEGER NOT NULL,
+	"game_id"	INTEGER NOT NULL,
+	"game_link"	TEXT NOT NULL,
+	"target_cents"	INTEGER,
+	"last_notified_cents"	INTEGER,
+	"created_at"	TEXT NOT NULL,
+	PRIMARY KEY("watch_id" AUTOINCREMENT),
+	FOREIGN KEY("discord_id") REFERENCES "user"("discord_id") ON DELETE CASCADE ON UPDATE CASCADE,
+	FOREIGN KEY("game_id") REFERENCES "game"("game_id") ON DELETE CASCADE ON UPDATE CASCADE
+);
+
+-- One watch per user and game, also used by unwatch and notification updates
+CREATE UNIQUE INDEX IF NOT EXISTS "watch_discord_id_game_id" ON "watch" ("discord_id", "game_id");
+
+-- The refresh job reads each watched game once
+CREATE INDEX IF NOT EXISTS "watch_game_id" ON "watch" ("game_id");
@@ -0,0 +1,7 @@
+-- Promotions a scheduled job already posted, so a restarted bot neither posts them again nor skips a week
+CREATE TABLE IF NOT EXISTS "posted_promotion" (
+	"job_name"	TEXT NOT NULL,
+	"promotion_id"	TEXT NOT NULL,
+	"posted_at"	TEXT NOT NULL,
+	PRIMARY KEY("job_name", "promotion_id")
+);
@@ -0,0 +1,5 @@
+-- The price each watch saw at its last refresh. Price drops are found against this instead of the latest
+-- price_history row, which a scrape by another command may already have moved to the new price
+ALTER TABLE "watch" ADD COLUMN "last_price_cents" INTEGER;
+
+UPDATE "watch" SET "last_price_cents" = (SELECT price_cents FROM price_history WHERE price_history.game_id = watch.game_id ORDER BY scraped_at DESC, price_history_id DESC LIMIT 1);
@@ -2,26 +2,44 @@ import asyncio
 from discord.ext import commands, tasks
 import discord
 from decouple import config
-import re
 import datetime
 import steamsales
 import epicgamesfree
 import db_manager
+import async_db
+import http_client
+import migrate
 import logging
 import errors
+import embeds
+import metrics
+import price_watch
+import scheduler
+import send_queue
+import contextvars
+import time
+from collections import OrderedDict
 
 BOT_TOKEN = config('BOT_TOKEN', None)
 CHANNEL_ID = int(config('CHANNEL_ID', None))
 THUMBS_UP = '👍'
 THUMBS_DOWN = '👎'
-STRAIGHT_FACE = '😑'
-TAG = '🏷️'
 RIGHT_ARROW = '➡️'
 LEFT_ARROW = '⬅️'
 BLACK_SQUARE = '◾'
 PLAYSTYLE_OPTIONS = ('casual', 'competitive', 'mix')
 ACTIVITY_TYPES = ('playing', 'completed', 'dropped')
 GAMES_PER_PAGE = 10
+RATINGS_PAGE_CACHE_SIZE = 3
+SPECIALS_REFRESH_MINUTES = config('SPECIALS_REFRESH_MINUTES', default=30, cast=float)
+SPECIALS_MAX_STALENESS_MINUTES = config('SPECIALS_MAX_STALENESS_MINUTES', default=120, cast=float)
+METRICS_PORT = config('METRICS_PORT', default=0, cast=int)
+METRICS_FILE = config('METRICS_FILE', default="")
+METRICS_WRITE_SECONDS = config('METRICS_WRITE_SECONDS', default=60, cast=float)
+WATCH_REFRESH_MINUTES = config('WATCH_REFRESH_MINUTES', default=60, cast=float)
+# Epic publishes the next free games a little after the current ones expire
+FREE_GAMES_POST_DELAY_SECONDS = config('FREE_GAMES_POST_DELAY_SECONDS', default=120, cast=float)
+FREE_GAMES_JOB = 'free_games'
 
 bot = commands.Bot(command_prefix="-", intents=discord.Intents.all(), help_command=commands.DefaultHelpCommand(show_parameter_descriptions=False))
 
@@ -31,62 +49,153 @@ async def on_ready():
     logging.basicConfig(filename='mysticbot.log', level=logging.INFO)
     embed = discord.Embed(
         title="Mystic Bot",
-        description=f"List of Commands:\n -specials: Displays information on the top 5 games in the specials category on steam.\n -freethisweek: Displays information on the games that can be redeemed for free on Epic Games.\n -profile: Create a profile that tracks your games and ratings\n -rategame (steam game link) (rating out of 10) (activity_type: \"playing\", \"completed\", \"dropped\"): Add a game to the database with your user rating out of 10\n -ratings: display the stats and ratings from your profile\n -help: shows all bot commands.",
+        description=f"List of Commands:\n -specials: Displays information on the top 5 games in the specials category on steam.\n -freethisweek: Displays information on the games that can be redeemed for free on Epic Games.\n -profile: Create a profile that tracks your games and ratings\n -rategame (steam game link) (rating out of 10) (activity_type: \"playing\", \"completed\", \"dropped\"): Add a game to the database with your user rating out of 10\n -ratings: display the stats and ratings from your profile\n -watch (steam game link) (optional target price): Get a message when the game's price drops, or drops to your target price\n -unwatch (steam game link): Stop watching a game's price\n -specialsstatus: shows when the steam specials were last refreshed\n -help: shows all bot commands.",
         color=discord.Color.red()
     )
-    await channel.send(embed=embed)
-    if not free_games_weekly_post.is_running():
-        free_games_weekly_post.start()
+    await send(channel, embed=embed)
+    if not scheduler.scheduler.is_running():
+        scheduler.scheduler.start()
+    if not specials_prefetch.is_running():
+        specials_prefetch.start()
+    if not watch_refresh.is_running():
+        watch_refresh.start()
+    if METRICS_FILE and not metrics_file_writer.is_running():
+        metrics_file_writer.start()
 
 @bot.event
 async def on_command_error(ctx, error):
     if isinstance(error, commands.MissingRequiredArgument):
-        await ctx.send("You did not provide the nescessary arguments!\nUse -help for more information on a command and how to use it.")
+        await send(ctx, "You did not provide the nescessary arguments!\nUse -help for more information on a command and how to use it.")
+
+# The command being run, so send() can count the messages each command costs
+current_command = contextvars.ContextVar('current_command', default=None)
+# (runs, messages) keyed by command name
+command_messages = {}
+
+def command_message_stats():
+    '''Returns the average number of messages each command sends for the metrics gauges'''
+    return {f"{name}_messages_per_run": round(messages / runs, 2) for name, (runs, messages) in sorted(command_messages.items())}
+
+metrics.register_gauges('commands', command_message_stats)
+
+@bot.before_invoke
+async def start_command_timer(ctx):
+    ctx.started_at = time.perf_counter()
+    ctx.messages_sent = 0
+    current_command.set(ctx)
+
+@bot.after_invoke
+async def stop_command_timer(ctx):
+    name = ctx.command.qualified_name
+    metrics.observe(f"command.{name}", time.perf_counter() - ctx.started_at, ctx.command_failed)
+    runs, messages = command_messages.get(name, (0, 0))
+    command_messages[name] = (runs + 1, messages + ctx.messages_sent)
+
+async def send(destination, *args, **kwargs):
+    '''
+    Sends a message through the channel's send queue and records how long discord took to accept it
+
+    Args:
+        destination (object): The context, channel or user to send the message to
+        *args, **kwargs: Passed on to destination.send
+
+    Returns:
+        message (object): The sent discord message
+    '''
+    ctx = current_command.get()
+    if ctx != None:
+        ctx.messages_sent += 1
+    async with metrics.timed('discord.send'):
+        return await send_queue.send(destination, *args, **kwargs)
+
+async def send_embeds(destination, embed_list):
+    '''
+    Sends embeds packed into as few messages as discord allows
+
+    Args:
+        destination (object): The context, channel or user to send the embeds to
+        embed_list (array): The discord embeds, in order
+
+    Returns:
+        None
+    '''
+    for message_embeds in embeds.pack_embeds(embed_list):
+        await send(destination, embeds=message_embeds)
 
 @bot.command()
 async def ratings(ctx):
     '''Shows your game ratings if you have any.'''
     try:
         discord_id = int(ctx.author.id)
-        if db_manager.user_exists(discord_id) == False:
+        if await async_db.user_exists(discord_id) == False:
             raise errors.UserDoesNotExist(f"A user associated with id: {discord_id} does not exist. Please set up a profile using the -profile command.")
-        average_rating, completed_percent, titles, activity_types, ratings, timestamps = db_manager.get_rating_stats(discord_id)
+        average_rating, completed_percent, total_games = await async_db.get_rating_summary(discord_id)
+        if total_games == 0:
+            await send(ctx, "You have not rated any games yet. Use -rategame to add one.")
+            return
 
-        view = PaginatorView(average_rating, completed_percent, titles, activity_types, ratings, timestamps, ctx.author)
+        view = PaginatorView(discord_id, average_rating, completed_percent, total_games, ctx.author)
 
-        initial_embed = view.create_ratings_embed()
+        initial_embed = await view.create_ratings_embed()
 
-        message = await ctx.send(embed=initial_embed, view=view)
+        message = await send(ctx, embed=initial_embed, view=view)
 
         view.message = message
     except errors.UserDoesNotExist as e:
-        await ctx.send(e)
+        await send(ctx, e)
     except Exception as e:
-        await ctx.send("There was an error displaying your ratings")
+        await send(ctx, "There was an error displaying your ratings")
 
 class PaginatorView(discord.ui.View):
-    '''Manages the page view for the user's game ratings. Provides interactable buttons to go the the next and previous pages'''
-    def __init__(self, average_rating, completed_percent, titles, activity_types, ratings, timestamps, author):
+    '''Manages the page view for the user's game ratings. Provides interactable buttons to go the the next and previous pages.
+    Only the pages the user looks at are read from the database, and the last few are kept for going back and forth.'''
+    def __init__(self, discord_id, average_rating, completed_percent, total_games, author):
         super().__init__(timeout=60)
 
+        self.discord_id = discord_id
         self.average_rating = average_rating
         self.completed_percent = completed_percent
-        self.titles = titles
-        self.activity_types = activity_types
-        self.ratings = ratings
-        self.timestamps = timestamps
+        self.total_games = total_games
         self.author = author
-        self.start = 0
-        self.max_start = max(0, len(self.titles) - 1)
+        self.message = None
+        self.page = 0
+        self.last_page = max(0, (total_games - 1) // GAMES_PER_PAGE)
+        # The cursor each visited page starts after, so any of them can be read again
+        self.page_cursors = [None]
+        self.page_cache = OrderedDict()
 
     async def interaction_check(self, interaction):
         if interaction.user != self.author:
             return False
         return True
 
-    def create_ratings_embed(self):
-        numGames = self.start + GAMES_PER_PAGE
-        end_index = min(numGames, len(self.titles))
+    async def get_page(self, page):
+        '''
+        Gets the rows for a page from the page cache or the database
+
+        Args:
+            page (int): The page number, starting at 0. Pages are visited in order so its start cursor is known
+
+        Returns:
+            rows (array): (title, activity_type, rating, timestamp) for each game on the page
+        '''
+        if page in self.page_cache:
+            self.page_cache.move_to_end(page)
+            return self.page_cache[page]
+
+        rows, next_cursor = await async_db.get_ratings_page(self.discord_id, GAMES_PER_PAGE, self.page_cursors[page])
+        if next_cursor != None and page + 1 == len(self.page_cursors):
+            self.page_cursors.append(next_cursor)
+
+        self.page_cache[page] = rows
+        if len(self.page_cache) > RATINGS_PAGE_CACHE_SIZE:
+            self.page_cache.popitem(last=False)
+
+        return rows
+
+    async def create_ratings_embed(self):
+        rows = await self.get_page(self.page)
+        start = self.page * GAMES_PER_PAGE
 
         embed = discord.Embed(title="Game Ratings")
         embed.add_field(name='Average Rating', value=self.average_rating)
@@ -94,10 +203,10 @@ class PaginatorView(discord.ui.View):
         embed.add_field(name="", value=f"`GAME` **·** `STATUS` **·** `SCORE` **·** `DATE`", inline=False)
         embed.add_field(name="Games:", value="", inline=False)
 
-        for i in range(self.start, end_index):
-            embed.add_field(name=f"", value=f"{BLACK_SQUARE} `{self.titles[i]}` **·** `{self.activity_types[i]}` **·** `{self.ratings[i]}` **·** `{self.timestamps[i]}`", inline=False)
+        for title, activity_type, rating, timestamp in rows:
+            embed.add_field(name=f"", value=f"{BLACK_SQUARE} `{title}` **·** `{activity_type}` **·** `{rating}` **·** `{timestamp}`", inline=False)
 
-        embed.set_footer(text=f"{self.start + 1} to {end_index}")
+        embed.set_footer(text=f"{start + 1} to {start + len(rows)} of {self.total_games}")
 
         return embed
     
@@ -107,13 +216,9 @@ class PaginatorView(discord.ui.View):
 
         await interaction.response.defer()
 
-        new_start = self.start - GAMES_PER_PAGE
-        if new_start < 0:
-            new_start = 0
-
-        if self.start != new_start:
-            self.start = new_start
-            new_embed = self.create_ratings_embed()
+        if self.page > 0:
+            self.page -= 1
+            new_embed = await self.create_ratings_embed()
             await interaction.edit_original_response(embed=new_embed, view=self)
 
     @discord.ui.button(label="Next", style=discord.ButtonStyle.primary, emoji=RIGHT_ARROW)
@@ -122,13 +227,9 @@ class PaginatorView(discord.ui.View):
 
         await interaction.response.defer()
 
-        new_start = self.start + GAMES_PER_PAGE
-        if new_start > self.max_start:
-            new_start = self.max_start
-
-        if self.start != new_start:
-            self.start = new_start
-            new_embed = self.create_ratings_embed()
+        if self.page < self.last_page and self.page + 1 < len(self.page_cursors):
+            self.page += 1
+            new_embed = await self.create_ratings_embed()
             await interaction.edit_original_response(embed=new_embed, view=self)
 
     async def on_timeout(self):
@@ -147,38 +248,74 @@ async def rategame(ctx, game_link, rating, activity_type):
     '''
     try:
         discord_id = int(ctx.author.id)
-        if db_manager.user_exists(discord_id) == False:
+        if await async_db.user_exists(discord_id) == False:
             raise errors.UserDoesNotExist(f"A user associated with id: {discord_id} does not exist. Please set up a profile using the -profile command.")
-        game = steamsales.game_search(game_link)
-        game_exists = db_manager.game_exists(game.id)
-        rating_exists = db_manager.rating_exists(discord_id, game.id)
+        game = await steamsales.game_search_async(game_link)
         timestamp = datetime.date.today().strftime("%Y-%m-%d")
         if activity_type not in ACTIVITY_TYPES:
             raise ValueError("The input for activity_type is not valid. It must be: \"playing\", \"completed\", or \"dropped\"")
-        if game_exists == False:
-            db_manager.add_game(game)
-        else:
-            db_manager.update_game(game)
-        if rating_exists == False:
-            db_manager.add_rating(game, rating, activity_type, timestamp, discord_id)
-        else:
-            db_manager.update_rating(game, rating, activity_type, timestamp, discord_id)
+        await async_db.rate_game(game, rating, activity_type, timestamp, discord_id)
         if activity_type in ("completed", "dropped"):
-            await ctx.send(f"You gave {game.title}, a rating of {rating} out of 10! You have {activity_type} this game.")
+            await send(ctx, f"You gave {game.title}, a rating of {rating} out of 10! You have {activity_type} this game.")
+        else:
+            await send(ctx, f"You gave {game.title}, a rating of {rating} out of 10! You are {activity_type} this game.")
+    except errors.UserDoesNotExist as e:
+        await send(ctx, e)
+    except ValueError as e:
+        await send(ctx, e)
+    except Exception as e:
+        await send(ctx, f"Could not find game information for the link: {game_link}")
+
+@bot.command()
+async def watch(ctx, game_link, target_price=None):
+    '''
+    Sends you a message when a game's price drops, or once it drops to your target price
+    Format: -watch (steamlink) (optional target price)
+    Ex: -watch https://store.steampowered.com/app/292140/FINAL_FANTASY_XIII2/ 4.99
+    '''
+    try:
+        discord_id = int(ctx.author.id)
+        if await async_db.user_exists(discord_id) == False:
+            raise errors.UserDoesNotExist(f"A user associated with id: {discord_id} does not exist. Please set up a profile using the -profile command.")
+        target_cents = db_manager.parse_price_cents(target_price)
+        if target_price != None and target_cents == None:
+            raise ValueError("The target price is not valid. It must be a price like 4.99")
+        game = await steamsales.game_search_async(game_link)
+        price_cents = price_watch.current_price_cents(game)
+        await async_db.watch_game(discord_id, game, game_link, target_cents, price_cents)
+        price = "" if price_cents == None else f" It costs {embeds.format_cents(price_cents)} right now."
+        if target_cents != None:
+            await send(ctx, f"You are watching {game.title}, you will get a message once it costs {embeds.format_cents(target_cents)} or less.{price}")
         else:
-            await ctx.send(f"You gave {game.title}, a rating of {rating} out of 10! You are {activity_type} this game.")
+            await send(ctx, f"You are watching {game.title}, you will get a message when its price drops.{price}")
     except errors.UserDoesNotExist as e:
-        await ctx.send(e)
+        await send(ctx, e)
     except ValueError as e:
-        await ctx.send(e)
+        await send(ctx, e)
+    except Exception as e:
+        await send(ctx, f"Could not find game information for the link: {game_link}")
+
+@bot.command()
+async def unwatch(ctx, game_link):
+    '''
+    Stops watching a game's price
+    Format: -unwatch (steamlink)
+    '''
+    try:
+        game_id = steamsales.parse_game_link(game_link).id
     except Exception as e:
-        await ctx.send(f"Could not find game information for the link: {game_link}")
+        await send(ctx, f"Could not find a steam game in the link: {game_link}")
+        return
+    if await async_db.unwatch_game(int(ctx.author.id), game_id):
+        await send(ctx, "You are no longer watching that game.")
+    else:
+        await send(ctx, "You were not watching that game.")
 
 @bot.command()
 async def profile(ctx):
     '''Detects if you have a profile and helps you update or create a profile'''
     discord_id = int(ctx.author.id) # Get the users discord id
-    exists = db_manager.user_exists(discord_id)
+    exists = await async_db.user_exists(discord_id)
 
     if exists:
         content = "# You are in the system!\nWould you like to update your profile?"
@@ -187,11 +324,11 @@ async def profile(ctx):
 
     try:
         view = ProfileView(ctx.bot, ctx.author, exists, discord_id)
-        message = await ctx.send(content, view=view)
+        message = await send(ctx, content, view=view)
         view.message = message
     except Exception as e:
         logging.error(f"Error processing userinfo for {ctx.author}: {e}", exc_info=True)
-        await ctx.send("Oops, there was an error. Please try again.")
+        await send(ctx, "Oops, there was an error. Please try again.")
 
 class ProfileView(discord.ui.View):
     '''Manages the view for the user's profile. Provides interactable buttons to create their profile or update their profile.'''
@@ -241,10 +378,10 @@ class ProfileView(discord.ui.View):
         last_online = datetime.date.today().strftime("%Y-%m-%d")
 
         if self.exists:
-            db_manager.update_user(self.discord_id, last_online, playstyle)
+            await async_db.update_user(self.discord_id, last_online, playstyle)
         else:
             first_seen = datetime.date.today().strftime("%Y-%m-%d")
-            db_manager.create_user(self.discord_id, first_seen, last_online, playstyle)
+            await async_db.create_user(self.discord_id, first_seen, last_online, playstyle)
 
         await interaction.followup.send(f"Your profile is setup {self.author.mention}!")
 
@@ -271,95 +408,263 @@ class ProfileView(discord.ui.View):
 @bot.command()
 async def specials(ctx):
     '''Displays information on the top 5 games in the specials category on steam.'''
-    await ctx.send(f"# Gathering Information...")
+    if specials_snapshot.is_usable():
+        payloads = specials_snapshot.embeds
+    else:
+        await send(ctx, f"# Gathering Information...")
+        payloads = await refresh_specials_snapshot()
 
-    games = steamsales.steam_specials()
-    for game in games:
-        embed = discord.Embed(
-            title=game.title,
-            description=game.description,
-            color=discord.Color.blue()
-        )
+    await send_embeds(ctx, [discord.Embed.from_dict(payload) for payload in payloads])
 
-        if game.game_image:
-            embed.set_image(url=game.game_image)
+    return
 
-        embed.add_field(name="Developer", value=game.game_developer, inline=True)
-        embed.add_field(name="Publisher", value=game.game_publisher, inline=True)
+@bot.command()
+async def specialsstatus(ctx):
+    '''Shows when the steam specials were last refreshed in the background.'''
+    embed = discord.Embed(title="Steam Specials Prefetch", color=discord.Color.blue())
+    embed.add_field(name="Refresh Interval", value=f"{SPECIALS_REFRESH_MINUTES} minutes", inline=True)
+    embed.add_field(name="Staleness Limit", value=f"{SPECIALS_MAX_STALENESS_MINUTES} minutes", inline=True)
+
+    if specials_snapshot.refreshed_at:
+        embed.add_field(name="Last Refresh", value=discord.utils.format_dt(specials_snapshot.refreshed_at, style='R'), inline=False)
+        embed.add_field(name="Last Refresh Duration", value=f"{specials_snapshot.refresh_duration:.2f} seconds", inline=True)
+        embed.add_field(name="Games", value=len(specials_snapshot.embeds), inline=True)
+    else:
+        embed.add_field(name="Last Refresh", value="Never", inline=False)
 
-        embed.add_field(name="", value="", inline=True)
+    if specials_snapshot.last_error:
+        embed.add_field(name="Last Error", value=specials_snapshot.last_error, inline=False)
 
-        embed.add_field(name="Original Price", value=f"${game.original_price}", inline=True)
-        embed.add_field(name="Discount Percent", value=game.discount_percent, inline=True)
-        embed.add_field(name="Dicount Price", value=f"${game.discount_price}", inline=True)
+    await send(ctx, embed=embed)
 
-        if game.monthly_ratings != None:
-            match = re.search(r"(\d+)\%", game.monthly_ratings)
-            rating_score = int(match.group(1))
-        else:
-            rating_score = -1
-
-        if (rating_score > 80):
-            embed.add_field(name=f"Monthly Ratings {THUMBS_UP}", value=f"{game.monthly_ratings}", inline=False)
-        elif (rating_score > 50):
-            embed.add_field(name=f"Monthly Ratings {STRAIGHT_FACE}", value=f"{game.monthly_ratings}", inline=False)
-        elif (rating_score >= 0 and rating_score <= 50):
-            embed.add_field(name=f"Monthly Ratings {THUMBS_DOWN}", value=f"{game.monthly_ratings}", inline=False)
-            
+@bot.command()
+@commands.is_owner()
+async def botstats(ctx):
+    '''Shows how long each stage of the bot's commands has been taking. Only the bot owner can use this.'''
+    stage_summaries, gauge_values = metrics.snapshot()
+    await send_embeds(ctx, embeds.build_bot_stats_embeds(stage_summaries, gauge_values))
 
-        if game.all_ratings != None:
-            match = re.search(r"(\d+)\%", game.all_ratings)
-            rating_score = int(match.group(1))
-        else:
-            rating_score = -1
+@bot.command()
+async def freethisweek(ctx):
+    '''Displays information on the games that are free to redeem on Epic Games.'''
+    if not epicgamesfree.free_games_cache.is_fresh(datetime.datetime.now(datetime.timezone.utc)):
+        await send(ctx, f"# Gathering Information...")
 
-        if (rating_score > 80):
-            embed.add_field(name=f"Overall Ratings {THUMBS_UP}", value=f"{game.all_ratings}", inline=False)
-        elif (rating_score > 50):
-            embed.add_field(name=f"Overall Ratings {STRAIGHT_FACE}", value=f"{game.all_ratings}", inline=False)
-        elif (rating_score >= 0 and rating_score <= 50):
-            embed.add_field(name=f"Overall Ratings {THUMBS_DOWN}", value=f"{game.all_ratings}", inline=False)
+    games = await epicgamesfree.get_free_epic_games_async()
+    await send_embeds(ctx, [embeds.free_game_renderer.render_embed(game) for game in games])
 
-        if game.tags:
-            tags_string = ", ".join(game.tags)
-            embed.add_field(name=f"Tags {TAG}", value=tags_string, inline=False)
+    return
 
-        embed.url = game.game_url
+class SpecialsSnapshot:
+    '''The most recently scraped steam specials along with their rendered embeds'''
+    def __init__(self):
+        self.games = None
+        self.embeds = None
+        self.refreshed_at = None
+        self.refresh_duration = None
+        self.last_error = None
+
+    def update(self, games, payloads, duration):
+        '''Replaces the snapshot with freshly scraped games and their embed dictionaries'''
+        self.games = games
+        self.embeds = payloads
+        self.refreshed_at = datetime.datetime.now(datetime.timezone.utc)
+        self.refresh_duration = duration
+        self.last_error = None
+
+    def stats(self):
+        '''Returns the snapshot's size and age as a dictionary'''
+        age = None
+        if self.refreshed_at != None:
+            age = (datetime.datetime.now(datetime.timezone.utc) - self.refreshed_at).total_seconds()
+        return {
+            'games': len(self.embeds) if self.embeds != None else 0,
+            'age_seconds': age,
+            'refresh_seconds': self.refresh_duration,
+        }
+
+    def is_usable(self):
+        '''Returns True if there is a snapshot that is newer than the staleness limit'''
+        if self.refreshed_at == None:
+            return False
+        age = datetime.datetime.now(datetime.timezone.utc) - self.refreshed_at
+        return age < datetime.timedelta(minutes=SPECIALS_MAX_STALENESS_MINUTES)
 
-        await ctx.send(embed=embed)
+specials_snapshot = SpecialsSnapshot()
+metrics.register_gauges('specials_snapshot', specials_snapshot.stats)
 
-    return
+async def refresh_specials_snapshot():
+    '''
+    Scrapes the steam specials, renders their embeds and stores both in the snapshot
 
-@bot.command()
-async def freethisweek(ctx):
-    '''Displays information on the games that are free to redeem on Epic Games.'''
-    await ctx.send(f"# Gathering Information...")
+    Args:
+        None
 
-    games = epicgamesfree.get_free_epic_games()
-    for game in games:
-        embed = discord.Embed(
-            title=game.title,
-            description=game.description,
-            color=discord.Color.blue()
-        )
+    Returns:
+        payloads (array): The embed dictionaries for the specials
+    '''
+    start = time.perf_counter()
+    games = await steamsales.steam_specials_async()
+    payloads = [embeds.special_renderer.render(game) for game in games]
+    specials_snapshot.update(games, payloads, time.perf_counter() - start)
 
-        if game.game_image:
-            embed.set_image(url=game.game_image)
+    return payloads
 
-        embed.add_field(name="Original Price", value=game.original_price, inline=True)
-        embed.add_field(name="Start Date", value=game.start_date, inline=True)
-        embed.add_field(name="End Date", value=game.end_date, inline=True)
+@tasks.loop(minutes=SPECIALS_REFRESH_MINUTES)
+async def specials_prefetch():
+    try:
+        await refresh_specials_snapshot()
+        logging.info(f"Refreshed steam specials in {specials_snapshot.refresh_duration:.2f} seconds")
+    except Exception as e:
+        specials_snapshot.last_error = str(e)
+        logging.error(f"Could not refresh steam specials: {e}", exc_info=True)
 
-        embed.url = game.game_url
+async def refresh_watches():
+    '''
+    Scrapes every watched game once, records the new prices and messages each user one summary of the
+    price drops on the games they watch
 
-        await ctx.send(embed=embed)
+    Args:
+        None
 
-    return
+    Returns:
+        drops (array): The PriceDrop objects that were sent
+    '''
+    watched = await async_db.get_watched_games()
+    if not watched:
+        return []
+
+    requests = []
+    for game_id, game_link in watched:
+        try:
+            requests.append(steamsales.parse_game_link(game_link))
+        except Exception as e:
+            logging.error(f"Could not read the watched game link {game_link}: {e}")
+
+    games = {}
+    for request, result in zip(requests, await steamsales.get_games_cached(requests)):
+        if isinstance(result, Exception):
+            logging.error(f"Could not refresh the watched game {request.game_link}: {result}")
+        else:
+            games[request.id] = result
+    if not games:
+        return []
+
+    await async_db.save_games(list(games.values()))
+    watches = await async_db.get_watches()
+    drops, resets = price_watch.find_price_drops(watches, games)
+    if resets:
+        await async_db.set_watches_notified(resets)
+
+    sent = []
+    unsent = set()
+    for discord_id, user_drops in price_watch.group_by_user(drops).items():
+        try:
+            user = bot.get_user(discord_id) or await bot.fetch_user(discord_id)
+            await send_embeds(user, embeds.build_price_drop_embeds(user_drops))
+        except Exception as e:
+            logging.error(f"Could not send price drops to {discord_id}: {e}")
+            unsent.update((drop.discord_id, drop.game.id) for drop in user_drops)
+            continue
+        await async_db.set_watches_notified([(drop.price_cents, drop.discord_id, drop.game.id) for drop in user_drops])
+        sent.extend(user_drops)
+
+    # Watches whose drop could not be sent keep their old price so the next refresh finds the drop again
+    prices = {game_id: price_watch.current_price_cents(game) for game_id, game in games.items()}
+    await async_db.set_watches_last_price([(prices[game_id], discord_id, game_id) for discord_id, game_id, target_cents, last_notified_cents, last_price_cents in watches
+        if prices.get(game_id) != None and (discord_id, game_id) not in unsent])
+
+    return sent
+
+@tasks.loop(minutes=WATCH_REFRESH_MINUTES)
+async def watch_refresh():
+    try:
+        with metrics.timed('watch.refresh'):
+            drops = await refresh_watches()
+        logging.info(f"Refreshed watched games, sent {len(drops)} price drop(s)")
+    except Exception as e:
+        logging.error(f"Could not refresh watched games: {e}", exc_info=True)
+
+async def get_unposted_free_games(now):
+    '''
+    Gets the Epic games that are free right now and which of them have not been posted yet
+
+    Args:
+        now (datetime): The current time in UTC
+
+    Returns:
+        unposted (array): The free games that were not posted yet
+        games (array): Every free game Epic listed, including ones whose promotion has not started yet
+    '''
+    games = await epicgamesfree.get_free_epic_games_async()
+    current = [game for game in games if (game.starts_at == None or game.starts_at <= now) and (game.expires_at == None or game.expires_at > now)]
+    posted = await async_db.get_posted_promotions(FREE_GAMES_JOB, [game.promotion_id for game in current])
+
+    return [game for game in current if game.promotion_id not in posted], games
 
-@tasks.loop(hours=168, minutes=0)
-async def free_games_weekly_post():
-    if datetime.datetime.now(datetime.timezone.utc).weekday() == 4 and datetime.datetime.now(datetime.timezone.utc).hour >= 15: # Only posts on Thursdays after 10am (when the new free games are out)
-        channel = bot.get_channel(CHANNEL_ID)
-        await freethisweek(channel)
+async def next_free_games_post(now):
+    '''
+    Works out when to post the free games next: right away if some were not posted yet, otherwise once the current
+    promotion expires or the next one starts
+
+    Args:
+        now (datetime): The current time in UTC
 
-bot.run(BOT_TOKEN)
\ No newline at end of file
+    Returns:
+        deadline (datetime): When the free games job should run
+    '''
+    unposted, games = await get_unposted_free_games(now)
+    if unposted:
+        return now
+
+    changes = [game.expires_at for game in games if game.expires_at != None and game.expires_at > now]
+    # The next games are listed at full price until their promotion starts, so their start comes from the upcoming offers
+    next_start = epicgamesfree.free_games_cache.next_start(now)
+    if next_start != None:
+        changes.append(next_start)
+    if changes:
+        return min(changes) + datetime.timedelta(seconds=FREE_GAMES_POST_DELAY_SECONDS)
+    # Epic has not published the next promotion yet
+    return now + datetime.timedelta(seconds=scheduler.RETRY_SECONDS)
+
+async def post_free_games():
+    '''Posts the free games that were not posted yet to the bot channel and remembers them'''
+    now = scheduler.utc_now()
+    unposted, games = await get_unposted_free_games(now)
+    if not unposted:
+        return
+
+    await send_embeds(bot.get_channel(CHANNEL_ID), [embeds.free_game_renderer.render_embed(game) for game in unposted])
+    await async_db.add_posted_promotions(FREE_GAMES_JOB, [game.promotion_id for game in unposted], now.strftime("%Y-%m-%d %H:%M:%S"))
+    logging.info(f"Posted {len(unposted)} free game(s) from Epic")
+
+scheduler.scheduler.add(scheduler.Job(FREE_GAMES_JOB, next_free_games_post, post_free_games))
+
+@tasks.loop(seconds=METRICS_WRITE_SECONDS)
+async def metrics_file_writer():
+    try:
+        await asyncio.to_thread(metrics.write_prometheus_file, METRICS_FILE)
+    except Exception as e:
+        logging.error(f"Could not write metrics to {METRICS_FILE}: {e}", exc_info=True)
+
+async def main():
+    discord.utils.setup_logging()
+    applied = await async_db.run(migrate.migrate_database)
+    for migration in applied:
+        logging.info(f"Applied database migration {migration.version:04d} {migration.name}")
+    metrics_server = None
+    if METRICS_PORT:
+        metrics_server = await metrics.start_http_server(METRICS_PORT)
+    async with bot:
+        try:
+            await bot.start(BOT_TOKEN)
+        finally:
+            await scheduler.scheduler.stop()
+            await http_client.close_session()
+            await asyncio.to_thread(async_db.stop)
+            db_manager.close_connections()
+            if metrics_server != None:
+                await metrics_server.cleanup()
+
+if __name__ == "__main__":
+    asyncio.run(main())
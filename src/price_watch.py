@@ -0,0 +1,74 @@
+import db_manager
+
+class PriceDrop:
+    '''A watched game whose price dropped enough to tell the user about'''
+    discord_id = None
+    game = None
+    previous_cents = None
+    price_cents = None
+    target_cents = None
+
+    def __init__(self, discord_id, game, previous_cents, price_cents, target_cents):
+        self.discord_id = discord_id
+        self.game = game
+        self.previous_cents = previous_cents
+        self.price_cents = price_cents
+        self.target_cents = target_cents
+
+def current_price_cents(game):
+    '''Returns the price a game sells for right now in cents, the discounted price while it is on sale'''
+    price = game.original_price if game.discount_price == None else game.discount_price
+    return db_manager.parse_price_cents(price)
+
+def find_price_drops(watches, games):
+    '''
+    Compares freshly scraped games with the price each watch saw at the previous refresh.
+    A watch with a target notifies once the price is at or below the target, a watch without one notifies
+    when the price drops. A user is only notified again if the price drops further, or after the price went
+    back up and dropped again.
+
+    Args:
+        watches (array): (discord_id, game_id, target_cents, last_notified_cents, last_price_cents) for each watch
+        games (dict): The freshly scraped game objects keyed by game id. Games that could not be scraped are left out
+
+    Returns:
+        drops (array): PriceDrop objects for the notifications to send
+        resets (array): (None, discord_id, game_id) for watches whose price went back up, so their next drop notifies again
+    '''
+    drops = []
+    resets = []
+
+    for discord_id, game_id, target_cents, last_notified_cents, previous_cents in watches:
+        game = games.get(game_id)
+        if game == None:
+            continue
+        price_cents = current_price_cents(game)
+        if price_cents == None:
+            continue
+
+        if target_cents != None:
+            qualifies = price_cents <= target_cents
+        else:
+            qualifies = previous_cents != None and price_cents < previous_cents
+
+        if qualifies and (last_notified_cents == None or price_cents < last_notified_cents):
+            drops.append(PriceDrop(discord_id, game, previous_cents, price_cents, target_cents))
+        elif not qualifies and last_notified_cents != None and price_cents > last_notified_cents:
+            resets.append((None, discord_id, game_id))
+
+    return drops, resets
+
+def group_by_user(drops):
+    '''
+    Groups price drops so each user gets one notification
+
+    Args:
+        drops (array): PriceDrop objects
+
+    Returns:
+        drops_by_user (dict): Arrays of PriceDrop objects keyed by discord id
+    '''
+    drops_by_user = {}
+    for drop in drops:
+        drops_by_user.setdefault(drop.discord_id, []).append(drop)
+    return drops_by_user
@@ -0,0 +1,240 @@
+import asyncio
+import datetime
+import email.utils
+import random
+import threading
+import time
+import urllib.parse
+from collections import deque
+from decouple import config
+import errors
+import metrics
+
+HOST_RATE = config('REQUEST_HOST_RATE', default=5, cast=float)
+HOST_BURST = config('REQUEST_HOST_BURST', default=5, cast=float)
+MAX_IN_FLIGHT = config('REQUEST_MAX_IN_FLIGHT', default=8, cast=int)
+MAX_RETRIES = config('REQUEST_MAX_RETRIES', default=3, cast=int)
+BACKOFF_BASE = config('REQUEST_BACKOFF_BASE', default=0.5, cast=float)
+BACKOFF_MAX = config('REQUEST_BACKOFF_MAX', default=60, cast=float)
+# A throttled host's rate is halved, and every success wins back this share of its normal rate
+RATE_RECOVERY = 0.1
+MIN_RATE_SHARE = 0.1
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+class TokenBucket:
+    '''Lets rate requests a second through to a host, with bursts of up to burst requests'''
+    def __init__(self, rate, burst):
+        self.normal_rate = rate
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def reserve(self, now):
+        '''
+        Takes a token, going into debt when there is none so waiting requests keep their order
+
+        Args:
+            now (float): time.monotonic()
+
+        Returns:
+            delay (float): How many seconds to wait before sending the request
+        '''
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        delay = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        return max(delay, self.blocked_until - now)
+
+    def throttled(self, now, retry_after):
+        '''Slows the host down after it pushed back, and pauses it for retry_after seconds if it asked'''
+        self.rate = max(self.normal_rate * MIN_RATE_SHARE, self.rate / 2)
+        if retry_after != None:
+            self.blocked_until = max(self.blocked_until, now + retry_after)
+
+    def succeeded(self):
+        self.rate = min(self.normal_rate, self.rate + self.normal_rate * RATE_RECOVERY)
+
+class InFlightLimit:
+    '''Caps how many requests are being sent at once. Works like a semaphore that hands slots out in the order they were asked for'''
+    def __init__(self, limit):
+        self.limit = limit
+        self.in_flight = 0
+        self.waiters = deque()
+
+    async def acquire(self):
+        if self.in_flight < self.limit and not self.waiters:
+            self.in_flight += 1
+            return
+
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was already handed to this request
+                self.release()
+            elif waiter in self.waiters:
+                self.waiters.remove(waiter)
+            raise
+
+    def release(self):
+        '''Hands the slot to the longest waiting request, or frees it if nothing is waiting'''
+        while self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.in_flight -= 1
+
+def parse_retry_after(value):
+    '''
+    Reads a Retry-After header
+
+    Args:
+        value (string): The header, either seconds or an http date
+
+    Returns:
+        seconds (float): How long the server asked us to wait, None if there was no usable header
+    '''
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, (retry_at - datetime.datetime.now(datetime.timezone.utc)).total_seconds())
+
+class RequestScheduler:
+    '''
+    Every outbound store request goes through here. Each host gets a token bucket, every request shares the
+    in flight cap, and responses that ask us to slow down are retried with exponential backoff and jitter,
+    waiting at least as long as their Retry-After header.
+    '''
+    def __init__(self, rate=HOST_RATE, burst=HOST_BURST, max_in_flight=MAX_IN_FLIGHT, max_retries=MAX_RETRIES):
+        self.rate = rate
+        self.burst = burst
+        self.max_retries = max_retries
+        self.in_flight = InFlightLimit(max_in_flight)
+        self.buckets = {}
+        self.lock = threading.Lock()
+        self.sent = 0
+        self.throttled = 0
+        self.retried = 0
+        self.failed = 0
+
+    def reserve(self, url):
+        '''Returns how long a request to url has to wait for its host's token bucket'''
+        host = urllib.parse.urlsplit(url).netloc
+        with self.lock:
+            bucket = self.buckets.get(host)
+            if bucket == None:
+                bucket = self.buckets[host] = TokenBucket(self.rate, self.burst)
+            self.sent += 1
+            return bucket.reserve(time.monotonic())
+
+    def backoff(self, url, error, retry):
+        '''
+        Records a failed attempt and works out how long to wait before the next one
+
+        Args:
+            url (string): The url of the request
+            error (object): The RetryableRequestError the attempt raised
+            retry (int): How many retries came before this one
+
+        Returns:
+            delay (float): Seconds to wait before retrying
+        '''
+        host = urllib.parse.urlsplit(url).netloc
+        # Full jitter keeps the requests that were throttled together from retrying together
+        delay = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** retry))
+        with self.lock:
+            if error.status in (429, 503):
+                self.throttled += 1
+                self.buckets[host].throttled(time.monotonic(), error.retry_after)
+        if error.retry_after != None:
+            delay = max(delay, min(BACKOFF_MAX, error.retry_after))
+        return delay
+
+    def succeeded(self, url):
+        host = urllib.parse.urlsplit(url).netloc
+        with self.lock:
+            self.buckets[host].succeeded()
+
+    async def run(self, url, attempt):
+        '''
+        Sends a request once its host and the in flight cap allow it, retrying it while it fails with a RetryableRequestError
+
+        Args:
+            url (string): The url of the request, its host picks the token bucket
+            attempt (function): An async function that sends the request and returns the result,
+                raising errors.RetryableRequestError when the request should be tried again
+
+        Returns:
+            result (object): What attempt returned
+
+        Raises:
+            RetryableRequestError: If the last retry failed too
+        '''
+        retry = 0
+        while True:
+            with metrics.timed('request.wait'):
+                await asyncio.sleep(self.reserve(url))
+                await self.in_flight.acquire()
+            try:
+                result = await attempt()
+            except errors.RetryableRequestError as e:
+                error = e
+            else:
+                self.succeeded(url)
+                return result
+            finally:
+                self.in_flight.release()
+
+            delay = self.backoff(url, error, retry)
+            if retry == self.max_retries:
+                with self.lock:
+                    self.failed += 1
+                raise error
+            retry += 1
+            with self.lock:
+                self.retried += 1
+            await asyncio.sleep(delay)
+
+    def stats(self):
+        '''Returns the request counters for the metrics gauges'''
+        return {
+            'sent': self.sent,
+            'throttled': self.throttled,
+            'retried': self.retried,
+            'failed': self.failed,
+            'in_flight': self.in_flight.in_flight,
+        }
+
+scheduler = RequestScheduler()
+metrics.register_gauges('requests', scheduler.stats)
+
+def check_response(url, status, headers):
+    '''
+    Raises a RetryableRequestError for a response that should be retried
+
+    Args:
+        url (string): The url of the request
+        status (int): The response's status code
+        headers (dict): The response's headers
+
+    Returns:
+        None
+    '''
+    if status in RETRY_STATUSES:
+        raise errors.RetryableRequestError(url, status, parse_retry_after(headers.get('Retry-After')))
+
+def run(url, attempt):
+    '''Sends a request through the shared scheduler, see RequestScheduler.run'''
+    return scheduler.run(url, attempt)
@@ -0,0 +1,163 @@
+import gzip
+import hashlib
+import json
+import os
+import time
+from decouple import config
+import errors
+
+LIVE = 'live'
+RECORD = 'record'
+REPLAY = 'replay'
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+MODE = config('HTTP_CACHE_MODE', default=LIVE)
+CACHE_DIR = config('HTTP_CACHE_DIR', default=os.path.join(current_dir, 'http_cache'))
+
+class CachedResponse:
+    '''A store response saved on disk'''
+    url = None
+    status = None
+    headers = None
+    body = None
+    truncated = None
+    stored_at = None
+
+    def __init__(self, url, status, headers, body, truncated, stored_at):
+        self.url = url
+        self.status = status
+        self.headers = headers
+        self.body = body
+        self.truncated = truncated
+        self.stored_at = stored_at
+
+    @property
+    def etag(self):
+        return self.headers.get('etag')
+
+    @property
+    def last_modified(self):
+        return self.headers.get('last-modified')
+
+    def text(self):
+        '''Decodes the body the same way the live response would have been'''
+        return self.body.decode('utf-8', errors='replace')
+
+def is_recording():
+    return MODE == RECORD
+
+def is_replaying():
+    return MODE == REPLAY
+
+def url_key(url):
+    '''
+    Builds the key a response is indexed under
+
+    Args:
+        url (string): The url of the request
+
+    Returns:
+        key (string): The sha256 of the request
+    '''
+    return hashlib.sha256(f"GET {url}".encode('utf-8')).hexdigest()
+
+def index_path(url):
+    key = url_key(url)
+    return os.path.join(CACHE_DIR, 'index', key[:2], key + '.json')
+
+def blob_path(digest):
+    return os.path.join(CACHE_DIR, 'blobs', digest[:2], digest + '.gz')
+
+def write_atomically(path, data):
+    '''Writes a file through a temporary file so a crash never leaves a partial file behind'''
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, 'wb') as f:
+        f.write(data)
+    os.replace(temp_path, path)
+
+def store(url, status, headers, body, truncated=False):
+    '''
+    Saves a response on disk. Bodies are gzipped and stored under the sha256 of their content,
+    so identical bodies served from different urls are only kept once.
+
+    Args:
+        url (string): The url of the request
+        status (int): The http status of the response
+        headers (dict): The response headers
+        body (bytes): The response body
+        truncated (boolean): True if only the start of the body was read
+
+    Returns:
+        None
+    '''
+    digest = hashlib.sha256(body).hexdigest()
+    path = blob_path(digest)
+    if not os.path.exists(path):
+        write_atomically(path, gzip.compress(body))
+
+    entry = {
+        'url': url,
+        'status': status,
+        'headers': {name.lower(): value for name, value in headers.items()},
+        'body': digest,
+        'truncated': truncated,
+        'stored_at': time.time(),
+    }
+    write_atomically(index_path(url), json.dumps(entry).encode('utf-8'))
+
+def load(url):
+    '''
+    Reads a saved response from disk
+
+    Args:
+        url (string): The url of the request
+
+    Returns:
+        response (object): The CachedResponse, None if nothing was saved for the url
+    '''
+    try:
+        with open(index_path(url), 'rb') as f:
+            entry = json.loads(f.read())
+        with open(blob_path(entry['body']), 'rb') as f:
+            body = gzip.decompress(f.read())
+    except FileNotFoundError:
+        return None
+
+    return CachedResponse(entry['url'], entry['status'], entry['headers'], body, entry['truncated'], entry['stored_at'])
+
+def load_for_replay(url):
+    '''
+    Reads a saved response from disk in replay mode
+
+    Args:
+        url (string): The url of the request
+
+    Returns:
+        response (object): The CachedResponse
+
+    Raises:
+        ResponseNotRecorded: If nothing was saved for the url
+    '''
+    response = load(url)
+    if response == None:
+        raise errors.ResponseNotRecorded(f"No recorded response for {url} in {CACHE_DIR}")
+    return response
+
+def conditional_headers(cached):
+    '''
+    Builds the headers that ask the store to only send a page if it changed since it was saved
+
+    Args:
+        cached (object): The CachedResponse, or None
+
+    Returns:
+        headers (dict): If-None-Match and If-Modified-Since headers for the saved validators
+    '''
+    headers = {}
+    if cached != None:
+        if cached.etag:
+            headers['If-None-Match'] = cached.etag
+        if cached.last_modified:
+            headers['If-Modified-Since'] = cached.last_modified
+    return headers
@@ -0,0 +1,109 @@
+import asyncio
+import datetime
+import logging
+from decouple import config
+import metrics
+
+# Long sleeps are cut into pieces so a changed system clock or a suspended machine only delays a job this long
+MAX_SLEEP_SECONDS = config('SCHEDULER_MAX_SLEEP_SECONDS', default=300, cast=float)
+RETRY_SECONDS = config('SCHEDULER_RETRY_SECONDS', default=600, cast=float)
+
+def utc_now():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+class Job:
+    '''
+    A task that runs at deadlines it works out itself, e.g. when the current Epic promotion expires
+
+    Args:
+        name (string): The job's name, used in logs and metrics
+        next_deadline (function): An async function taking the current UTC datetime and returning the UTC datetime of the next run
+        run (function): An async function called once the deadline passes
+    '''
+    def __init__(self, name, next_deadline, run):
+        self.name = name
+        self.next_deadline = next_deadline
+        self.run = run
+        self.deadline = None
+        self.last_run = None
+        self.runs = 0
+        self.errors = 0
+
+class Scheduler:
+    '''Runs each job in its own task, sleeping until the job's next deadline instead of polling on a fixed interval'''
+    def __init__(self):
+        self.jobs = {}
+        self.tasks = {}
+
+    def add(self, job):
+        '''Adds a job, starting it right away if the scheduler is already running'''
+        self.jobs[job.name] = job
+        if self.tasks:
+            self._start_job(job)
+
+    def start(self):
+        '''Starts every job that is not running yet'''
+        for job in self.jobs.values():
+            if job.name not in self.tasks or self.tasks[job.name].done():
+                self._start_job(job)
+
+    def _start_job(self, job):
+        self.tasks[job.name] = asyncio.create_task(self._run_job(job), name=f"job {job.name}")
+
+    async def stop(self):
+        '''Cancels every job and waits for them to finish'''
+        tasks = list(self.tasks.values())
+        self.tasks = {}
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def is_running(self):
+        return any(not task.done() for task in self.tasks.values())
+
+    async def _run_job(self, job):
+        while True:
+            try:
+                job.deadline = await job.next_deadline(utc_now())
+                logging.info(f"Job {job.name} is due at {job.deadline.isoformat()}")
+                await sleep_until(job.deadline)
+                with metrics.timed(f'job.{job.name}'):
+                    await job.run()
+                job.last_run = utc_now()
+                job.runs += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                job.errors += 1
+                job.deadline = utc_now() + datetime.timedelta(seconds=RETRY_SECONDS)
+                logging.error(f"Job {job.name} failed, retrying at {job.deadline.isoformat()}: {e}", exc_info=True)
+                await sleep_until(job.deadline)
+
+    def stats(self):
+        '''Returns how long until each job's next run for the metrics gauges'''
+        now = utc_now()
+        values = {}
+        for job in self.jobs.values():
+            values[f'{job.name}_seconds_until_run'] = None if job.deadline == None else max(0, int((job.deadline - now).total_seconds()))
+            values[f'{job.name}_runs'] = job.runs
+            values[f'{job.name}_errors'] = job.errors
+        return values
+
+async def sleep_until(deadline):
+    '''
+    Sleeps until a UTC datetime, checking the clock again at least every MAX_SLEEP_SECONDS
+
+    Args:
+        deadline (datetime): A timezone aware datetime
+
+    Returns:
+        None
+    '''
+    while True:
+        remaining = (deadline - utc_now()).total_seconds()
+        if remaining <= 0:
+            return
+        await asyncio.sleep(min(remaining, MAX_SLEEP_SECONDS))
+
+scheduler = Scheduler()
+metrics.register_gauges('jobs', scheduler.stats)
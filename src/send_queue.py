@@ -0,0 +1,78 @@
+import asyncio
+import time
+from decouple import config
+import metrics
+import request_scheduler
+
+# Discord lets a bot send about 5 messages every 5 seconds to one channel
+CHANNEL_RATE = config('DISCORD_CHANNEL_RATE', default=1, cast=float)
+CHANNEL_BURST = config('DISCORD_CHANNEL_BURST', default=5, cast=float)
+
+class ChannelQueue:
+    '''The messages waiting to go to one channel, sent in order and paced by the channel's rate limit bucket'''
+    def __init__(self, rate, burst):
+        self.lock = asyncio.Lock()
+        self.bucket = request_scheduler.TokenBucket(rate, burst)
+        self.waiting = 0
+
+class SendQueue:
+    '''
+    Sends every message through a queue per channel. Overlapping commands in one channel take turns instead of
+    racing each other into Discord's rate limit, and a burst is spread out before Discord has to reject it.
+    '''
+    def __init__(self, rate=CHANNEL_RATE, burst=CHANNEL_BURST):
+        self.rate = rate
+        self.burst = burst
+        self.channels = {}
+        self.messages = 0
+        self.delayed = 0
+
+    def get_channel(self, destination):
+        '''Returns the queue for where a destination sends to: a context's channel, a channel or a user's DMs'''
+        target = getattr(destination, 'channel', destination)
+        key = (type(target).__name__, getattr(target, 'id', id(target)))
+        queue = self.channels.get(key)
+        if queue == None:
+            queue = self.channels[key] = ChannelQueue(self.rate, self.burst)
+        return queue
+
+    async def send(self, destination, *args, **kwargs):
+        '''
+        Sends a message once it is its channel's turn
+
+        Args:
+            destination (object): The context, channel or user to send the message to
+            *args, **kwargs: Passed on to destination.send
+
+        Returns:
+            message (object): The sent discord message
+        '''
+        queue = self.get_channel(destination)
+        queue.waiting += 1
+        try:
+            async with queue.lock:
+                delay = queue.bucket.reserve(time.monotonic())
+                if delay > 0:
+                    self.delayed += 1
+                    with metrics.timed('discord.send_wait'):
+                        await asyncio.sleep(delay)
+                self.messages += 1
+                return await destination.send(*args, **kwargs)
+        finally:
+            queue.waiting -= 1
+
+    def stats(self):
+        '''Returns the send counters for the metrics gauges'''
+        return {
+            'messages': self.messages,
+            'delayed': self.delayed,
+            'waiting': sum(queue.waiting for queue in self.channels.values()),
+            'channels': len(self.channels),
+        }
+
+send_queue = SendQueue()
+metrics.register_gauges('discord_send_queue', send_queue.stats)
+
+def send(destination, *args, **kwargs):
+    '''Sends a message through the shared send queue, see SendQueue.send'''
+    return send_queue.send(destination, *args, **kwargs)
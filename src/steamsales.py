@@ -1,11 +1,29 @@
 #steamsales.py
 
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
 import re
 from decouple import config
-import threading
-import requests
+import asyncio
 import datetime
+import logging
+import html as html_lib
+import json
+import codecs
+import time
+import urllib.parse
+from collections import OrderedDict
+import http_client
+import metrics
+
+STEAM_STORE_URL = config('STEAM_STORE_URL', default="https://store.steampowered.com")
+STEAM_HOMEPAGE_URL = f"{STEAM_STORE_URL}/?snr=1_4_4__global-responsive-menu"
+STEAM_BACKEND = config('STEAM_BACKEND', default="html")
+SPECIALS_CHUNK_SIZE = config('STEAM_SPECIALS_CHUNK_SIZE', default=16384, cast=int)
+APPDETAILS_BATCH_SIZE = config('STEAM_APPDETAILS_BATCH_SIZE', default=50, cast=int)
+CACHE_TTL = config('STEAM_CACHE_TTL', default=900, cast=float)
+CACHE_SIZE = config('STEAM_CACHE_SIZE', default=256, cast=int)
+REQUEST_TIMEOUT = config('STEAM_REQUEST_TIMEOUT', default=15, cast=float)
+SEARCH_PAGE_SIZE = config('STEAM_SEARCH_PAGE_SIZE', default=50, cast=int)
 
 class GameInfo:
     id = None
@@ -61,88 +79,291 @@ class GameInfo:
         print(f"Date scraped: {self.scrape_date}")
 
 
-def flatten_list(list):
+class GameRequest:
+    '''Identifies a game or package that a backend should build a GameInfo for'''
+    id = None
+    game_link = None
+    is_game = None
+    game_url = None
+
+    def __init__(self, id, game_link, is_game, game_url=None):
+        self.id = id
+        self.game_link = game_link
+        self.is_game = is_game
+        self.game_url = game_url
+
+
+@metrics.timed('steam.fetch')
+async def fetch_page(url, etag=None, last_modified=None):
+    '''
+    Downloads a page from the steam store without blocking the event loop, optionally as a conditional request.
+    In record mode responses are also saved to the disk cache, and in replay mode they are only read from it.
+
+    Args:
+        url (String): The url of the page to download
+        etag (String): The ETag of a copy we already have, sent as If-None-Match
+        last_modified (String): The Last-Modified of a copy we already have, sent as If-Modified-Since
+
+    Returns:
+        response (object): A http_client.PageResponse, with no text when the page was not modified
+    '''
+    return await http_client.fetch(url, etag, last_modified, timeout=REQUEST_TIMEOUT)
+
+
+
+async def fetch_json(url):
+    '''
+    Downloads and decodes a json document from the steam store without blocking the event loop
+
+    Args:
+        url (String): The url of the json endpoint
+
+    Returns:
+        data (Object): The decoded json
     '''
-    Flattens the list so that it is not pair based
+    response = await fetch_page(url)
+    return json.loads(response.text)
+
+
+class SpecialItem:
+    '''A game or package listed in the specials category of the steam store'''
+    id = None
+    is_game = None
+
+    def __init__(self, id, is_game):
+        self.id = id
+        self.is_game = is_game
+
+    @property
+    def link(self):
+        '''The store page for the game or package'''
+        if self.is_game:
+            return f"{STEAM_STORE_URL}/app/{self.id}/"
+        return f"{STEAM_STORE_URL}/sub/{self.id}/"
+
+
+
+class SpecialsScanner:
+    '''
+    Finds the "specials" json array in the store front page as it is downloaded. Text is fed in chunks and the scanner
+    only keeps what it needs: a short tail while looking for the array, then the array itself until its closing bracket.
+    '''
+    MARKER = re.compile(r'"specials"\s*:\s*\[')
+    MARKER_TAIL = 64
+
+    def __init__(self):
+        self.buffer = ""
+        self.in_array = False
+        self.position = 0
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+
+    def feed(self, text):
+        '''
+        Scans the next piece of the page
+
+        Args:
+            text (String): The next chunk of decoded page text
+
+        Returns:
+            specials (Array): The decoded specials array once it is complete, otherwise None
+        '''
+        self.buffer += text
+
+        if not self.in_array:
+            match = self.MARKER.search(self.buffer)
+            if match == None:
+                # Keep enough of the end to catch a marker split across chunks
+                self.buffer = self.buffer[-self.MARKER_TAIL:]
+                return None
+            self.buffer = self.buffer[match.end() - 1:]
+            self.in_array = True
+            self.position = 0
+
+        # Track brackets outside of json strings until the array closes
+        buffer = self.buffer
+        for i in range(self.position, len(buffer)):
+            char = buffer[i]
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == '\\':
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"':
+                self.in_string = True
+            elif char == '[' or char == '{':
+                self.depth += 1
+            elif char == ']' or char == '}':
+                self.depth -= 1
+                if self.depth == 0:
+                    return json.loads(buffer[:i + 1])
+
+        self.position = len(buffer)
+        return None
+
+
+
+def retrieve_specials(specials, count=5):
+    '''
+    Turns entries of the specials array into SpecialItem objects
 
     Args:
-        list (Array): The array to flatten
+        specials (Array): The decoded specials array from the store front page
+        count (int): How many specials to return
 
     Returns:
-        flatlist (Array): The array 
+        items (Array): SpecialItem objects for the first count games or packages
     '''
-    flatlist = []
-    for item1, item2 in list:
-        if item1:
-            flatlist.append(item1)
-        if item2:
-            flatlist.append(item2)
+    items = []
+    for entry in specials:
+        if entry.get('appid'):
+            items.append(SpecialItem(int(entry['appid']), True))
+        elif entry.get('packageid'):
+            items.append(SpecialItem(int(entry['packageid']), False))
+        if len(items) == count:
+            break
 
-    return flatlist
+    return items
 
 
 
-def retrieve_top_5(javascript):
+def retrieve_top_5(javascript, count=5):
     '''
     Finds the top 5 games in the specials category on steam
 
     Args:
-        javascript (String): A string of the javascript section that contains the specials
+        javascript (String): A string of the page or javascript section that contains the specials
+        count (int): How many specials to return, None for all of them
 
     Returns:
-        top5_games (Array of Strings): The array of the game ids for the top 5 games on steam
+        top5_games (Array): SpecialItem objects for the top 5 games on steam
     '''
-    top5_games = []
+    specials = SpecialsScanner().feed(javascript)
+    if specials == None:
+        raise ValueError("Could not find the specials on the steam store page")
 
-    specials_match = re.search(r'"specials":(\[.*?\])', javascript)
-    specials_string = specials_match.group(1)
-    all_ids = re.findall(r'"appid":(\d+)|"packageid":(\d+)', specials_string)
-    top5_games = all_ids[:5]
+    return retrieve_specials(specials, count)
 
-    return top5_games
 
 
+@metrics.timed('steam.fetch_specials')
+async def fetch_specials(url, count=5):
+    '''
+    Streams the store front page and stops downloading as soon as the specials array is complete.
+    In record mode the part of the page that was read is saved to the disk cache, and in replay mode it is scanned from there.
 
-def get_game_link(soup, gameid):
+    Args:
+        url (String): The url of the store front page
+        count (int): How many specials to return, None for all of them
+
+    Returns:
+        top5_games (Array): SpecialItem objects for the top 5 games on steam
     '''
-    Finds information based on the gameid or packageid
+    found = []
+
+    async def read_until_specials(response):
+        scanner = SpecialsScanner()
+        decoder = codecs.getincrementaldecoder(response.charset or 'utf-8')(errors='replace')
+        chunks = []
+
+        async for chunk in response.content.iter_chunked(SPECIALS_CHUNK_SIZE):
+            chunks.append(chunk)
+            specials = scanner.feed(decoder.decode(chunk))
+            if specials != None:
+                found.append(specials)
+                return b"".join(chunks)
+
+        raise ValueError("Could not find the specials on the steam store page")
+
+    response = await http_client.fetch(url, timeout=REQUEST_TIMEOUT, read_body=read_until_specials)
+    if found:
+        return retrieve_specials(found[-1], count)
+    # A replayed or still current copy from the disk cache is scanned in full
+    return retrieve_top_5(response.text, count)
+
+
+
+SEARCH_ROW = re.compile(r'<a\s[^>]*data-ds-itemkey[^>]*>')
+SEARCH_ROW_ID = re.compile(r'\sdata-ds-(appid|packageid|bundleid)="(\d+)')
+
+def search_results_url(search_url, start, count=SEARCH_PAGE_SIZE):
+    '''
+    Builds the url of one page of results for a steam store search, the json endpoint the search page scrolls with
 
     Args:
-        soup (Object): A BeautifulSoup object containing the html for the game
-        gameid (String): A string of integers for the game or package that we want information on
+        search_url (String): A store search link, e.g. https://store.steampowered.com/search/?specials=1
+        start (int): The index of the first result on the page
+        count (int): How many results to get
 
     Returns:
-        gamelink (String): returns a string containing a link to the game or package page
-        is_game (Boolean): returns a boolean indicating if it is a game or package
+        url (String): The search results url
     '''
-    is_game = True
+    parts = urllib.parse.urlsplit(search_url)
+    query = dict(urllib.parse.parse_qsl(parts.query))
+    query.update({'start': start, 'count': count, 'infinite': 1})
+    return urllib.parse.urlunsplit((parts.scheme, parts.netloc, '/search/results/', urllib.parse.urlencode(query), ''))
 
-    potential_game = soup.find(href=re.compile(gameid))
-    if potential_game:
-        game_link = potential_game['href']
 
-    return game_link, is_game
 
+def parse_search_results(results_html):
+    '''
+    Finds the games and packages in a page of steam search results. Bundles are skipped
 
+    Args:
+        results_html (String): The results_html of a search results page
 
-def get_game_url(game_link, is_game):
+    Returns:
+        items (Array): SpecialItem objects for the games and packages on the page
     '''
-    Finds and returns the url for the game along with the html as a BeautifulSoup object
+    items = []
+    for row in SEARCH_ROW.findall(results_html):
+        ids = dict(SEARCH_ROW_ID.findall(row))
+        # Package rows also list the apps they contain, so the package id wins
+        if 'bundleid' in ids:
+            continue
+        elif 'packageid' in ids:
+            items.append(SpecialItem(int(ids['packageid']), False))
+        elif 'appid' in ids:
+            items.append(SpecialItem(int(ids['appid']), True))
+
+    return items
+
+
+
+@metrics.timed('steam.search')
+async def fetch_search_results(search_url, start=0, count=SEARCH_PAGE_SIZE):
+    '''
+    Gets one page of results for a steam store search
 
     Args:
-        game_link (String): A link to the html of a webpage
+        search_url (String): A store search link, e.g. https://store.steampowered.com/search/?specials=1
+        start (int): The index of the first result on the page
+        count (int): How many results to get
+
+    Returns:
+        items (Array): SpecialItem objects for the games and packages on the page
+        total_count (int): How many results the search has in total
+    '''
+    response = await fetch_json(search_results_url(search_url, start, count))
+    return parse_search_results(response.get('results_html') or ""), int(response.get('total_count') or 0)
+
+
+
+def get_game_url(soup, game_link, is_game):
+    '''
+    Finds and returns the url for the game
+
+    Args:
+        soup (Object): A BeautifulSoup object containing the html for the game
+        game_link (String): The link that was used to download the game's page
         is_game (Boolean): A boolean indicating if it is a game or package
 
     Returns:
         url_content (String): Returns a string that has the url for the game
-        soup (Object): Returns a BeautfifulSoup object for the game's html
     '''
-    url = game_link
-    response = requests.get(url) # open the url and get the HTTPResponse
-
-    html = response.text
-    soup = BeautifulSoup(html, 'html.parser')
-    
     if is_game:
         meta_tag = soup.find('meta', property='og:url')
         if meta_tag:
@@ -150,7 +371,7 @@ def get_game_url(game_link, is_game):
     else:
         url_content = game_link.split('?')[0]
 
-    return url_content, soup
+    return url_content
 
 
 
@@ -376,135 +597,882 @@ def get_sale_end_date(soup):
     '''
     end_date_container = soup.find('p', class_='game_purchase_discount_countdown')
     if end_date_container:
-        end_date = end_date_container.text.strip()
-        match = re.search(r"Offer ends (\S+) (\d+)",end_date)
-        if match:
-            end_date = f"{datetime.datetime.now().year}-{str(datetime.datetime.strptime(match.group(1), "%B").month).zfill(2)}-{str(match.group(2).zfill(2))}"
-        else:
-            end_date = None
+        end_date = parse_sale_end_date(end_date_container.text)
     else:
         end_date = None
 
     return end_date
 
 
-def get_game_info(soup, game, specials):
+
+def parse_sale_end_date(countdown_text):
     '''
-    Gets the information from a game or package on steam
+    Reads the end date out of the text of a sale countdown
 
     Args:
-        soup (Object): A BeautifulSoup object containing the html for the game
-        game (int): integer representing a game or packages id
-        specials (array): array of game objects that contains info for each game
+        countdown_text (String): The text of the countdown, e.g. "Offer ends March 5"
 
     Returns:
-        None
+        end_date (String): String for the end date of a sale in the format YYYY-MM-DD
     '''
-    id = game
+    match = re.search(r"Offer ends (\S+) (\d+)", countdown_text.strip())
+    if match:
+        return f"{datetime.datetime.now().year}-{str(datetime.datetime.strptime(match.group(1), '%B').month).zfill(2)}-{str(match.group(2).zfill(2))}"
+
+    return None
+
+
+
+class GamePageStrainer(SoupStrainer):
+    '''
+    Limits parsing of a game page to the elements the extractor reads. Everything else on the page is skipped
+    by the parser instead of being built into the tree. Elements that match keep all of their children.
+    '''
+    DIV_CLASSES = {'glance_tags', 'popular_tags', 'game_area_purchase_game_wrapper', 'game_purchase_price', 'dev_row'}
+    IDS = {'userReviews', 'developers_list'}
+
+    def __init__(self):
+        super().__init__()
+
+    def allow_tag_creation(self, nsprefix, name, attrs):
+        attrs = attrs or {}
+        classes = attrs.get('class', '').split()
+
+        if attrs.get('id') in self.IDS:
+            return True
+        if name == 'meta':
+            return attrs.get('property') in ('og:url', 'og:description')
+        if name == 'link':
+            return 'image_src' in attrs.get('rel', '').split()
+        if name == 'span':
+            return attrs.get('itemprop') == 'name'
+        if name == 'h2':
+            return 'pageheader' in classes
+        if name == 'p':
+            return 'game_purchase_discount_countdown' in classes
+        if name == 'div':
+            return not self.DIV_CLASSES.isdisjoint(classes)
+        return False
+
+    def allow_string_creation(self, string):
+        # Strings inside matched elements are always kept, this only drops the ones between them
+        return False
+
+GAME_PAGE_STRAINER = GamePageStrainer()
+
+
+
+def extract_game_fields(soup, is_game):
+    '''
+    Collects every field of a game page in one walk over the tree, giving the same results as the get_game_* functions
+
+    Args:
+        soup (Object): A BeautifulSoup object containing the html for the game, ideally parsed with GAME_PAGE_STRAINER
+        is_game (Boolean): A boolean indicating if it is a game or package
+
+    Returns:
+        fields (dict): The page's og url, title, description, tags, ratings, prices, sale end date, image, developer and publisher
+    '''
+    found = {}
+    dev_rows = []
+
+    # Remember the first element of each kind, matching what soup.find would return
+    for tag in soup.find_all(True):
+        name = tag.name
+        classes = tag.get('class', [])
+        tag_id = tag.get('id')
+
+        if tag_id == 'userReviews':
+            found.setdefault('reviews', tag)
+        elif tag_id == 'developers_list':
+            found.setdefault('developers', tag)
+
+        if name == 'meta':
+            found.setdefault(tag.get('property'), tag)
+        elif name == 'link' and 'image_src' in tag.get('rel', []):
+            found.setdefault('image', tag)
+        elif name == 'span' and tag.get('itemprop') == 'name':
+            found.setdefault('game_title', tag)
+        elif name == 'h2' and 'pageheader' in classes:
+            found.setdefault('package_title', tag)
+        elif name == 'p' and 'game_purchase_discount_countdown' in classes:
+            found.setdefault('countdown', tag)
+        elif name == 'div':
+            if 'glance_tags' in classes or 'popular_tags' in classes:
+                found.setdefault('tags', tag)
+            if 'game_area_purchase_game_wrapper' in classes:
+                found.setdefault('purchase', tag)
+            if ' '.join(classes) == 'game_purchase_price price':
+                found.setdefault('purchase_price', tag)
+            if 'dev_row' in classes:
+                dev_rows.append(tag)
+
+    fields = dict.fromkeys(('url', 'title', 'description', 'tags', 'monthly_ratings', 'all_ratings', 'discount_percent', 'original_price', 'discount_price', 'end_date', 'game_image', 'game_developer', 'game_publisher'))
+
+    if 'og:url' in found:
+        fields['url'] = found['og:url']['content']
+    if 'og:description' in found:
+        fields['description'] = found['og:description']['content']
+
+    title_container = found.get('game_title' if is_game else 'package_title')
+    if title_container:
+        fields['title'] = title_container.get_text()
+
+    fields['tags'] = []
+    if 'tags' in found:
+        tags = [tag.get_text().strip() for tag in found['tags'].find_all('a', class_='app_tag')]
+        fields['tags'] = [tag for tag in tags if tag.strip()]
+
+    if is_game and 'reviews' in found:
+        review_links = found['reviews'].find_all('a', class_='user_reviews_summary_row')
+        if len(review_links) >= 2:
+            fields['monthly_ratings'] = review_links[0]['data-tooltip-html'].strip()
+            fields['all_ratings'] = review_links[1]['data-tooltip-html'].strip()
+        elif review_links:
+            fields['all_ratings'] = review_links[0]['data-tooltip-html'].strip()
+
+    purchase = found.get('purchase')
+    if purchase:
+        for field, div_class in (('discount_percent', 'discount_pct'), ('original_price', 'discount_original_price'), ('discount_price', 'discount_final_price')):
+            container = purchase.find('div', class_=div_class)
+            if container:
+                fields[field] = container.text.strip()[1:]
+
+        if fields['discount_percent'] == None:
+            fields['original_price'] = None
+            if 'purchase_price' in found:
+                fields['original_price'] = found['purchase_price'].text.strip()[1:]
+
+    if fields['discount_price'] != None and 'countdown' in found:
+        fields['end_date'] = parse_sale_end_date(found['countdown'].text)
+
+    if 'image' in found:
+        fields['game_image'] = found['image']['href']
+
+    if 'developers' in found:
+        fields['game_developer'] = found['developers'].find('a').text.strip()
+
+    for dev in dev_rows:
+        subtitle = dev.find('div', class_='subtitle column')
+        if subtitle and "Publisher:" in subtitle.text.strip():
+            fields['game_publisher'] = dev.find('a').text.strip()
+
+    return fields
+
+
+
+@metrics.timed('steam.parse')
+def parse_game_page(html, id, game_link, is_game, game_url=None):
+    '''
+    Parses a downloaded game page into a game object. This is CPU bound so the async callers run it in a worker thread
+
+    Args:
+        html (String): The html of the game or package page
+        id (int): integer representing a game or packages id
+        game_link (String): The link that was used to download the page
+        is_game (Boolean): A boolean indicating if it is a game or package
+        game_url (String): The url to store for the game, found from the page when not given
+
+    Returns:
+        game (object): returns a game object containing information on the game
+    '''
+    soup = BeautifulSoup(html, 'html.parser', parse_only=GAME_PAGE_STRAINER)
+    fields = extract_game_fields(soup, is_game)
+
+    if game_url == None:
+        game_url = fields['url'] if is_game else game_link.split('?')[0]
+
+    is_on_sale = fields['discount_price'] != None
+    scrape_date = datetime.date.today().strftime("%Y-%m-%d")
+
+    return GameInfo(id, fields['title'], fields['description'], fields['tags'], fields['monthly_ratings'], fields['all_ratings'], fields['original_price'], is_on_sale, fields['end_date'], fields['discount_percent'], fields['discount_price'], game_url, fields['game_image'], fields['game_developer'], fields['game_publisher'], scrape_date)
+
+
+
+def format_price(cents):
+    '''
+    Formats a price in cents the same way the store page shows it without the currency symbol
+
+    Args:
+        cents (int): The price in cents
+
+    Returns:
+        price (String): The price in the form 19.99
+    '''
+    return f"{cents / 100:.2f}"
+
+
+
+def format_review_summary(query_summary):
+    '''
+    Formats a steam review summary the same way as the tooltip on the store page
+
+    Args:
+        query_summary (dict): The query_summary object returned by the appreviews endpoint
+
+    Returns:
+        all_ratings (String): The overall ratings for the game, None if the game has no reviews
+    '''
+    if not query_summary or not query_summary.get('total_reviews'):
+        return None
+
+    total_reviews = query_summary['total_reviews']
+    percent = round(query_summary['total_positive'] * 100 / total_reviews)
+
+    return f"{percent}% of the {total_reviews:,} user reviews for this game are positive."
+
+
+
+@metrics.timed('steam.parse_json')
+def build_game_info_from_json(request, details, price_overview, query_summary):
+    '''
+    Builds a game object from the json the store returns for an app. Fields the json does not provide are left as None
+
+    Args:
+        request (object): The GameRequest for the app
+        details (dict): The data object returned by the appdetails endpoint
+        price_overview (dict): The price_overview object returned by the appdetails endpoint
+        query_summary (dict): The query_summary object returned by the appreviews endpoint
+
+    Returns:
+        game (object): returns a game object containing information on the game
+    '''
+    title = details.get('name')
+    description = details.get('short_description')
+    if description:
+        description = html_lib.unescape(description)
+    # appdetails only has steam's genres, which are not the user tags the store page shows, so tags come from the page
+    tags = []
+    developers = details.get('developers') or [None]
+    publishers = details.get('publishers') or [None]
+
     is_on_sale = False
-    game_link, is_game = get_game_link(soup, game)
-    game_url, soup = get_game_url(game_link, is_game)
-    title = get_game_title(soup, is_game)
-    '''with open(title, "w", encoding="utf-8") as f:
-        f.write(soup.prettify())'''
-    description = get_game_description(soup)
-    tags = get_game_tags(soup)
-    tags = [tag for tag in tags if tag.strip()]
-    monthly_ratings, all_ratings = get_game_ratings(soup, is_game)
-    discount_percent, original_price, discount_price = get_game_price(soup)
-    if (discount_price != None):
-        is_on_sale = True
-    if (is_on_sale):
-        end_date = get_sale_end_date(soup)
-    game_image = get_game_image(soup)
-    game_developer = get_game_developer(soup)
-    game_publisher = get_game_publisher(soup)
+    discount_percent = None
+    discount_price = None
+    original_price = None
+    if price_overview:
+        if price_overview.get('discount_percent'):
+            is_on_sale = True
+            discount_percent = f"{price_overview['discount_percent']}%"
+            original_price = format_price(price_overview['initial'])
+            discount_price = format_price(price_overview['final'])
+        else:
+            original_price = format_price(price_overview['final'])
+    elif details.get('is_free'):
+        original_price = format_price(0)
+
+    if request.game_url:
+        game_url = request.game_url
+    else:
+        game_url = f"{STEAM_STORE_URL}/app/{request.id}/"
+
+    all_ratings = format_review_summary(query_summary)
     scrape_date = datetime.date.today().strftime("%Y-%m-%d")
-    game = GameInfo(id, title, description, tags, monthly_ratings, all_ratings, original_price, is_on_sale, end_date, discount_percent, discount_price, game_url, game_image, game_developer, game_publisher, scrape_date)
-    specials.append(game)
 
-def game_search(game_url):
+    # Steam's json has no monthly review summary or sale end date so those are left empty
+    return GameInfo(request.id, title, description, tags, None, all_ratings, original_price, is_on_sale, None, discount_percent, discount_price, game_url, details.get('header_image'), developers[0], publishers[0], scrape_date)
+
+
+
+class CachedGame:
+    '''A game object along with what is needed to tell whether it is still current'''
+    game = None
+    etag = None
+    last_modified = None
+    fetched_at = None
+
+    def __init__(self, game, etag=None, last_modified=None):
+        self.game = game
+        self.etag = etag
+        self.last_modified = last_modified
+        self.fetched_at = time.monotonic()
+
+    def is_fresh(self, ttl):
+        '''Returns True if the game was fetched less than ttl seconds ago'''
+        return time.monotonic() - self.fetched_at < ttl
+
+    def can_revalidate(self):
+        '''Returns True if the store sent a validator that a conditional request can use'''
+        return self.etag != None or self.last_modified != None
+
+
+
+class GameCache:
     '''
-    Gets game information given a link to a steam game page
+    Keeps recently built game objects in memory keyed by app or package id. Entries older than the ttl are stale and
+    get revalidated with a conditional request when possible, and the least recently used entry is evicted once the
+    cache is full.
+    '''
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.revalidated = 0
+        self.evictions = 0
+
+    def get(self, key):
+        '''
+        Looks up a game and counts the hit or miss
+
+        Args:
+            key (tuple): The cache key from cache_key
+
+        Returns:
+            entry (object): The CachedGame if it is fresh, otherwise None
+        '''
+        entry = self.entries.get(key)
+        if entry == None:
+            self.misses += 1
+            return None
+
+        self.entries.move_to_end(key)
+        if entry.is_fresh(self.ttl):
+            self.hits += 1
+            return entry
+
+        self.stale += 1
+        return None
+
+    def get_stale(self, key):
+        '''Returns the entry for a key whether or not it is fresh, without counting it'''
+        return self.entries.get(key)
+
+    def put(self, key, entry):
+        '''
+        Stores a game, evicting the least recently used games if the cache is full
+
+        Args:
+            key (tuple): The cache key from cache_key
+            entry (object): The CachedGame to store
+
+        Returns:
+            None
+        '''
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        '''Removes every game from the cache'''
+        self.entries.clear()
+
+    def stats(self):
+        '''Returns the cache's counters as a dictionary'''
+        return {
+            'size': len(self.entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'stale': self.stale,
+            'revalidated': self.revalidated,
+            'evictions': self.evictions,
+        }
+
+game_cache = GameCache(CACHE_SIZE, CACHE_TTL)
+
+
+
+class SingleFlight:
+    '''
+    Lets concurrent callers that want the same thing share one in-flight call. The first caller for a key leads and
+    starts the call, later callers join and wait on the same result. The call runs in its own task so a leader
+    being cancelled does not cancel it for everyone else.
+    '''
+    def __init__(self):
+        self.flights = {}
+        self.tasks = set()
+        self.started = 0
+        self.shared = 0
+
+    def join(self, key):
+        '''
+        Finds the in-flight call for a key
+
+        Args:
+            key (tuple): The key of the call
+
+        Returns:
+            future (object): The future for the call's result, None if nothing is in flight for the key
+        '''
+        future = self.flights.get(key)
+        if future != None:
+            self.shared += 1
+        return future
+
+    def lead(self, keys, coroutine):
+        '''
+        Starts a call that covers several keys at once
+
+        Args:
+            keys (array): The keys the call covers, none of which may be in flight
+            coroutine (object): A coroutine returning a result or exception for each key, in the same order
+
+        Returns:
+            futures (array): The future for each key's result
+        '''
+        loop = asyncio.get_running_loop()
+        futures = []
+        for key in keys:
+            future = loop.create_future()
+            self.flights[key] = future
+            futures.append(future)
+        self.started += len(keys)
+
+        task = asyncio.ensure_future(self._land(keys, futures, coroutine))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+        return futures
+
+    async def _land(self, keys, futures, coroutine):
+        '''Runs a led call and hands each key's result to everyone waiting on it'''
+        try:
+            results = await coroutine
+        except asyncio.CancelledError:
+            results = None
+        except Exception as e:
+            results = [e] * len(keys)
+
+        for i, (key, future) in enumerate(zip(keys, futures)):
+            if self.flights.get(key) is future:
+                del self.flights[key]
+            if results == None:
+                future.cancel()
+            elif isinstance(results[i], Exception):
+                future.set_exception(results[i])
+                # Mark the exception as seen so callers that all went away do not trigger a warning
+                future.exception()
+            else:
+                future.set_result(results[i])
+
+    async def do(self, key, function, *args):
+        '''
+        Calls function(*args) unless the same key is already in flight, in which case its result is shared
+
+        Args:
+            key (tuple): The key of the call
+            function (function): An async function returning the result
+
+        Returns:
+            result (object): The result of the shared call
+        '''
+        future = self.join(key)
+        if future == None:
+            future = self.lead([key], self._as_list(function(*args)))[0]
+
+        return await asyncio.shield(future)
+
+    async def _as_list(self, coroutine):
+        return [await coroutine]
+
+    def stats(self):
+        '''Returns how many calls were started and how many duplicate calls were avoided'''
+        return {
+            'in_flight': len(self.flights),
+            'started': self.started,
+            'shared': self.shared,
+        }
+
+game_flights = SingleFlight()
+specials_flights = SingleFlight()
+
+metrics.register_gauges('steam_game_cache', game_cache.stats)
+metrics.register_gauges('steam_game_flights', game_flights.stats)
+metrics.register_gauges('steam_specials_flights', specials_flights.stats)
+
+
+
+def cache_key(request):
+    '''
+    Builds the cache key for a game or package. Apps and packages have separate id spaces so both are part of the key
 
     Args:
-        game_url (string): string containing the link to a steam game page
+        request (object): The GameRequest for the game or package
+
+    Returns:
+        key (tuple): The cache key
+    '''
+    return ('app' if request.is_game else 'sub', int(request.id))
+
+
+
+class HtmlBackend:
+    '''Builds game objects by downloading and parsing each game's store page'''
+
+    async def get_game(self, request, cached=None):
+        '''
+        Gets the information from a game or package on steam
+
+        Args:
+            request (object): The GameRequest for the game or package
+            cached (object): A stale CachedGame for the request, revalidated instead of downloaded again when possible
+
+        Returns:
+            entry (object): returns a CachedGame containing information on the game
+        '''
+        if cached != None and cached.can_revalidate():
+            response = await fetch_page(request.game_link, cached.etag, cached.last_modified)
+            if response.not_modified:
+                game_cache.revalidated += 1
+                return CachedGame(cached.game, cached.etag, cached.last_modified)
+        else:
+            response = await fetch_page(request.game_link)
+
+        game = await asyncio.to_thread(parse_game_page, response.text, request.id, request.game_link, request.is_game, request.game_url)
+
+        return CachedGame(game, response.etag, response.last_modified)
+
+    async def get_games(self, requests, cached=None):
+        '''
+        Gets the information for several games or packages at once
+
+        Args:
+            requests (array): array of GameRequest objects
+            cached (array): a stale CachedGame or None for each request
+
+        Returns:
+            results (array): a CachedGame or the exception raised for each request, in the same order
+        '''
+        cached = cached or [None] * len(requests)
+        return await asyncio.gather(*(self.get_game(request, entry) for request, entry in zip(requests, cached)), return_exceptions=True)
+
+
+
+class JsonBackend(HtmlBackend):
+    '''
+    Builds game objects from the store's json endpoints and only downloads the store page for fields the json is missing.
+    Packages are always scraped since packagedetails lacks most of the fields we store.
+    '''
+    # Fields that are filled in from the store page when the json does not have them. Tags, monthly ratings and the
+    # sale end date are not in the json and are left empty rather than depending on whether the page was downloaded
+    REQUIRED_FIELDS = ('title', 'description', 'game_image', 'game_developer', 'game_publisher', 'original_price', 'all_ratings')
+    PRICE_FIELDS = ('original_price', 'is_on_sale', 'discount_percent', 'discount_price')
+
+    async def get_prices(self, appids):
+        '''
+        Gets the price_overview for many apps. Steam only accepts several appids in one appdetails call when filtering to prices
+
+        Args:
+            appids (array): array of app ids
+
+        Returns:
+            prices (dict): price_overview objects keyed by app id as a string
+        '''
+        batches = [appids[i:i + APPDETAILS_BATCH_SIZE] for i in range(0, len(appids), APPDETAILS_BATCH_SIZE)]
+        urls = [f"{STEAM_STORE_URL}/api/appdetails?appids={','.join(str(appid) for appid in batch)}&filters=price_overview&cc=us&l=en" for batch in batches]
+        responses = await asyncio.gather(*(fetch_json(url) for url in urls), return_exceptions=True)
+
+        prices = {}
+        for response in responses:
+            if isinstance(response, Exception):
+                logging.warning(f"Could not get steam prices: {response}")
+                continue
+            for appid, entry in response.items():
+                # Apps without a price return an empty list instead of an object
+                if entry and entry.get('success') and isinstance(entry.get('data'), dict):
+                    prices[appid] = entry['data'].get('price_overview')
+
+        return prices
+
+    async def get_details(self, appid):
+        '''
+        Gets the appdetails data object for an app
+
+        Args:
+            appid (String): The app id
+
+        Returns:
+            details (dict): The data object, empty if steam has no details for the app
+        '''
+        url = f"{STEAM_STORE_URL}/api/appdetails?appids={appid}&filters=basic,developers,publishers&cc=us&l=en"
+        response = await fetch_json(url)
+        entry = response.get(str(appid)) or {}
+
+        if entry.get('success') and isinstance(entry.get('data'), dict):
+            return entry['data']
+        return {}
+
+    async def get_review_summary(self, appid):
+        '''
+        Gets the overall review summary for an app
+
+        Args:
+            appid (String): The app id
+
+        Returns:
+            query_summary (dict): The query_summary object, None if steam has no reviews for the app
+        '''
+        url = f"{STEAM_STORE_URL}/appreviews/{appid}?json=1&language=all&purchase_type=all&num_per_page=0"
+        response = await fetch_json(url)
+
+        return response.get('query_summary')
+
+    async def get_game_from_json(self, request, price_overview):
+        '''
+        Builds a game object for an app from json, falling back to the store page for missing fields
+
+        Args:
+            request (object): The GameRequest for the app
+            price_overview (dict): The price_overview for the app from the batched price request
+
+        Returns:
+            entry (object): returns a CachedGame containing information on the game
+        '''
+        details, query_summary = await asyncio.gather(self.get_details(request.id), self.get_review_summary(request.id), return_exceptions=True)
+        if isinstance(details, Exception):
+            logging.warning(f"Could not get steam appdetails for {request.id}: {details}")
+            details = {}
+        if isinstance(query_summary, Exception):
+            logging.warning(f"Could not get steam reviews for {request.id}: {query_summary}")
+            query_summary = None
+
+        game = build_game_info_from_json(request, details, price_overview, query_summary)
+
+        if any(getattr(game, field) is None for field in self.REQUIRED_FIELDS):
+            # Only the missing required fields are taken from the page, prices as one group so they stay consistent
+            html_game = (await super().get_game(request)).game
+            if game.original_price is None:
+                for field in self.PRICE_FIELDS:
+                    setattr(game, field, getattr(html_game, field))
+            for field in self.REQUIRED_FIELDS:
+                if getattr(game, field) is None:
+                    setattr(game, field, getattr(html_game, field))
+
+        # The json endpoints send no validators so these entries are always fetched again once stale
+        return CachedGame(game)
+
+    async def get_game(self, request, cached=None):
+        '''Gets the information from a game or package on steam, see HtmlBackend.get_game'''
+        if not request.is_game:
+            return await super().get_game(request, cached)
+
+        prices = await self.get_prices([request.id])
+
+        return await self.get_game_from_json(request, prices.get(str(request.id)))
+
+    async def get_games(self, requests, cached=None):
+        '''Gets the information for several games or packages at once with one batched price request, see HtmlBackend.get_games'''
+        cached = cached or [None] * len(requests)
+        appids = [request.id for request in requests if request.is_game]
+        prices = await self.get_prices(appids) if appids else {}
+
+        tasks = []
+        for request, entry in zip(requests, cached):
+            if request.is_game:
+                tasks.append(self.get_game_from_json(request, prices.get(str(request.id))))
+            else:
+                tasks.append(super().get_game(request, entry))
+
+        return await asyncio.gather(*tasks, return_exceptions=True)
+
+
+
+BACKENDS = {
+    'html': HtmlBackend(),
+    'json': JsonBackend(),
+}
+
+
+
+def get_backend():
+    '''
+    Returns the backend chosen by the STEAM_BACKEND setting
+
+    Args:
+        None
+
+    Returns:
+        backend (object): The backend used to build game objects
+    '''
+    return BACKENDS[STEAM_BACKEND]
+
+
+
+async def fetch_games_into_cache(requests):
+    '''
+    Fetches games through the backend and stores them in the game cache
+
+    Args:
+        requests (array): array of GameRequest objects
+
+    Returns:
+        results (array): a game object or the exception raised for each request, in the same order
+    '''
+    stale = [game_cache.get_stale(cache_key(request)) for request in requests]
+    fetched = await get_backend().get_games(requests, stale)
+
+    results = []
+    for request, entry in zip(requests, fetched):
+        if isinstance(entry, Exception):
+            results.append(entry)
+        else:
+            game_cache.put(cache_key(request), entry)
+            results.append(entry.game)
+
+    return results
+
+
+
+async def get_games_cached(requests):
+    '''
+    Gets the information for several games or packages, answering from the game cache where possible.
+    Games that another caller is already fetching are waited on instead of being fetched again.
+
+    Args:
+        requests (array): array of GameRequest objects
+
+    Returns:
+        results (array): a game object or the exception raised for each request, in the same order
+    '''
+    results = [None] * len(requests)
+    waiting = {}
+    to_fetch = {}
+
+    for i, request in enumerate(requests):
+        key = cache_key(request)
+        entry = game_cache.get(key)
+        if entry != None:
+            results[i] = entry.game
+            continue
+
+        future = game_flights.join(key)
+        if future != None:
+            waiting[i] = future
+        else:
+            to_fetch.setdefault(key, []).append(i)
+
+    # Games nobody is fetching yet are fetched together so backends can still batch them
+    if to_fetch:
+        keys = list(to_fetch)
+        futures = game_flights.lead(keys, fetch_games_into_cache([requests[to_fetch[key][0]] for key in keys]))
+        for key, future in zip(keys, futures):
+            for i in to_fetch[key]:
+                waiting[i] = future
+
+    for i, future in waiting.items():
+        try:
+            results[i] = await asyncio.shield(future)
+        except asyncio.CancelledError:
+            if not future.cancelled():
+                raise
+            results[i] = RuntimeError("The fetch for this game was cancelled")
+        except Exception as e:
+            results[i] = e
+
+    return results
+
+
+
+async def get_game_cached(request):
+    '''
+    Gets the information for a game or package, answering from the game cache where possible
+
+    Args:
+        request (object): The GameRequest for the game or package
 
     Returns:
         game (object): returns a game object containing information on the game
     '''
-    url = game_url
-    response = requests.get(url)
+    result = (await get_games_cached([request]))[0]
+    if isinstance(result, Exception):
+        raise result
+
+    return result
+
+
+
+async def get_game_info_async(special):
+    '''
+    Gets the information from a game or package on steam
 
-    html = response.text
-    soup = BeautifulSoup(html, 'html.parser')
+    Args:
+        special (object): The SpecialItem for the game or package
+
+    Returns:
+        game (object): returns a game object containing information on the game
+    '''
+    return await get_game_cached(GameRequest(special.id, special.link, special.is_game))
+
+
+
+def parse_game_link(game_url):
+    '''
+    Builds the request for a link to a steam game or package page
+
+    Args:
+        game_url (string): string containing the link to a steam game page
+
+    Returns:
+        request (object): The GameRequest for the game or package
+    '''
     is_game = True
 
-    match = re.search(r"https://store.steampowered.com/app/(\d+)/", url)
+    match = re.search(r"https://store.steampowered.com/app/(\d+)/", game_url)
     if match == None:
-        match = re.search(r"https://store.steampowered.com/sub/(\d+)/", url)
+        match = re.search(r"https://store.steampowered.com/sub/(\d+)/", game_url)
         is_game = False
 
     id = int(match.group(1))
-    is_on_sale = False
-    title = get_game_title(soup, is_game)
-    description = get_game_description(soup)
-    tags = get_game_tags(soup)
-    tags = [tag for tag in tags if tag.strip()]
-    monthly_ratings, all_ratings = get_game_ratings(soup, is_game)
-    discount_percent, original_price, discount_price = get_game_price(soup)
-    if (discount_price != None):
-        is_on_sale = True
-    if (is_on_sale):
-        end_date = get_sale_end_date(soup)
-    else:
-        end_date = None
-    game_image = get_game_image(soup)
-    game_developer = get_game_developer(soup)
-    game_publisher = get_game_publisher(soup)
-    scrape_date = datetime.date.today().strftime("%Y-%m-%d")
-    game = GameInfo(id, title, description, tags, monthly_ratings, all_ratings, original_price, is_on_sale, end_date, discount_percent, discount_price, game_url, game_image, game_developer, game_publisher, scrape_date)
-    
-    return game
 
+    return GameRequest(id, game_url, is_game, game_url)
 
-def steam_specials():
-    '''Scrapes data from the top 5 sellers in the specials category on the steam store page'''
-    url = "https://store.steampowered.com/?snr=1_4_4__global-responsive-menu" # get the url
-    response = requests.get(url) # open the url and get the HTTPResponse
 
-    html = response.text # Turn the HTTPResponse into html text
-    soup = BeautifulSoup(html, 'html.parser') # Parse the html
 
-    '''base_file = "html_steam" # Set the file path to the same directory as program but the file html_steam
+async def game_search_async(game_url):
+    '''
+    Gets game information given a link to a steam game page
 
-    # write the html into a file
-    with open(base_file, "w", encoding="utf-8") as f:
-        f.write(soup.prettify())'''
+    Args:
+        game_url (string): string containing the link to a steam game page
 
-    script_tags = soup.find_all('script')
+    Returns:
+        game (object): returns a game object containing information on the game
+    '''
+    return await get_game_cached(parse_game_link(game_url))
 
-    specials_javascript = script_tags[len(script_tags)-1]
-    specials_string = specials_javascript.string
 
-    top5_games = retrieve_top_5(specials_string)
 
-    top5_games = flatten_list(top5_games)
-    specials = []
-    threads = []
+async def steam_specials_async():
+    '''
+    Scrapes data from the top 5 sellers in the specials category on the steam store page
 
-    for game in top5_games:
-        t = threading.Thread(target=get_game_info, args=(soup, game, specials))
-        threads.append(t)
+    Args:
+        None
 
-    for t in threads:
-        t.start()
+    Returns:
+        specials (array): array of game objects that contains info for each game
+    '''
+    top5_games = await specials_flights.do(('specials',), fetch_specials, STEAM_HOMEPAGE_URL)
+    requests = [GameRequest(special.id, special.link, special.is_game) for special in top5_games]
 
-    for t in threads:
-        t.join()
+    results = await get_games_cached(requests)
+
+    specials = []
+    for special, result in zip(top5_games, results):
+        if isinstance(result, Exception):
+            logging.warning(f"Could not scrape steam special {special.id}: {result}")
+        else:
+            specials.append(result)
 
     return specials
 
+
+
+def game_search(game_url):
+    '''Blocking version of game_search_async for use outside of the bot's event loop'''
+    return asyncio.run(http_client.run_and_close(game_search_async(game_url)))
+
+
+
+def steam_specials():
+    '''Blocking version of steam_specials_async for use outside of the bot's event loop'''
+    return asyncio.run(http_client.run_and_close(steam_specials_async()))
+
 if __name__ == "__main__":
     specials = steam_specials()
     for special in specials:
@@ -0,0 +1,69 @@
+import datetime
+import os
+import sys
+import unittest
+
+tests_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(tests_dir, '..', 'src'))
+
+import embeds
+import epicgamesfree
+
+NO_EXPIRY_FIXTURE = os.path.join(tests_dir, 'fixtures', 'epic', 'free_games_no_expiry.json')
+
+def read_fixture(path):
+    with open(path, encoding='utf-8') as f:
+        return f.read()
+
+class FreeGamesWithoutExpiryTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.text = read_fixture(NO_EXPIRY_FIXTURE)
+        self.original_cache = epicgamesfree.free_games_cache
+        self.original_fetch = epicgamesfree.fetch_promotions
+        epicgamesfree.free_games_cache = epicgamesfree.FreeGamesCache()
+        self.fetches = 0
+
+        async def fetch_promotions(url, etag=None, last_modified=None):
+            self.fetches += 1
+            return self.text, None, None
+        epicgamesfree.fetch_promotions = fetch_promotions
+
+    def tearDown(self):
+        epicgamesfree.free_games_cache = self.original_cache
+        epicgamesfree.fetch_promotions = self.original_fetch
+
+    def test_null_expiry_date_is_parsed_as_none(self):
+        games = epicgamesfree.parse_elements(epicgamesfree.decode_elements(self.text))
+
+        forever = games[0]
+        self.assertEqual((forever.title, forever.start_date, forever.end_date, forever.expires_at), ("Forever Free", "2026-10-01", None, None))
+        self.assertEqual(forever.game_url, "https://store.epicgames.com/en-US/p/forever-free")
+        # Images are not carried over from the element before
+        self.assertEqual(games[1].game_image, None)
+
+    async def test_game_without_expiry_is_cached_for_the_ttl(self):
+        now = datetime.datetime.now(datetime.timezone.utc)
+        games = await epicgamesfree.get_free_epic_games_async()
+
+        self.assertEqual([game.title for game in games], ["Forever Free"])
+        expires_in = (epicgamesfree.free_games_cache.expires_at - now).total_seconds()
+        self.assertAlmostEqual(expires_in, epicgamesfree.CACHE_TTL, delta=5)
+
+        await epicgamesfree.get_free_epic_games_async()
+        self.assertEqual(self.fetches, 1)
+
+    def test_only_expired_games_poll_again_soon(self):
+        games = epicgamesfree.parse_elements(epicgamesfree.decode_elements(self.text))
+        now = datetime.datetime(2026, 10, 18, tzinfo=datetime.timezone.utc)
+
+        self.assertEqual(epicgamesfree.earliest_expiry(games[1:], now), now + datetime.timedelta(seconds=epicgamesfree.POLL_SECONDS))
+        self.assertEqual(epicgamesfree.earliest_expiry(games, now), now + datetime.timedelta(seconds=epicgamesfree.CACHE_TTL))
+
+    def test_embed_leaves_out_a_missing_end_date(self):
+        game = epicgamesfree.parse_elements(epicgamesfree.decode_elements(self.text))[0]
+        embed = embeds.build_free_game_embed(game)
+
+        self.assertEqual([field.name for field in embed.fields], ["Original Price", "Start Date"])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+import datetime
+import os
+import sys
+import tempfile
+import unittest
+
+tests_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(tests_dir, '..', 'src'))
+# mysticbot reads these when it is imported
+os.environ.setdefault('CHANNEL_ID', '1')
+os.environ.setdefault('BOT_TOKEN', 'test')
+
+import async_db
+import db_manager
+import epicgamesfree
+import migrate
+import mysticbot
+import scheduler
+
+PROMOTIONS_FIXTURE = os.path.join(tests_dir, '..', 'benchmarks', 'fixtures', 'free_games_promotions.json')
+NOW = datetime.datetime(2026, 10, 18, 12, 0, tzinfo=datetime.timezone.utc)
+# When the fixture's free games expire and the next ones start
+EXPIRY = datetime.datetime(2026, 10, 22, 15, 0, tzinfo=datetime.timezone.utc)
+DELAY = datetime.timedelta(seconds=mysticbot.FREE_GAMES_POST_DELAY_SECONDS)
+
+def read_fixture(path):
+    with open(path, encoding='utf-8') as f:
+        return f.read()
+
+class FreeGamesPostTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.original_db_path = db_manager.db_path
+        db_manager.db_path = os.path.join(self.temp_dir.name, 'games_and_interests.db')
+        migrate.migrate_database()
+
+        self.elements = epicgamesfree.decode_elements(read_fixture(PROMOTIONS_FIXTURE))
+        self.upcoming_starts = epicgamesfree.parse_upcoming_starts(self.elements)
+        self.sent = []
+        self.original_cache = epicgamesfree.free_games_cache
+        self.original_get_free_games = epicgamesfree.get_free_epic_games_async
+        self.original_utc_now = scheduler.utc_now
+        self.original_send = mysticbot.send
+        self.original_get_channel = mysticbot.bot.get_channel
+        epicgamesfree.free_games_cache = epicgamesfree.FreeGamesCache()
+
+        # Parses the fixture as if Epic had just sent it, at NOW instead of the real time
+        async def get_free_epic_games_async():
+            games = epicgamesfree.parse_elements(self.elements)
+            epicgamesfree.free_games_cache.update(games, self.upcoming_starts, None, None, NOW)
+            return [game for game in games if game.expires_at == None or game.expires_at > NOW]
+
+        async def send(destination, *args, **kwargs):
+            self.sent.append((destination, [embed.title for embed in kwargs['embeds']]))
+
+        epicgamesfree.get_free_epic_games_async = get_free_epic_games_async
+        scheduler.utc_now = lambda: NOW
+        mysticbot.send = send
+        mysticbot.bot.get_channel = lambda channel_id: channel_id
+
+    def tearDown(self):
+        epicgamesfree.free_games_cache = self.original_cache
+        epicgamesfree.get_free_epic_games_async = self.original_get_free_games
+        scheduler.utc_now = self.original_utc_now
+        mysticbot.send = self.original_send
+        mysticbot.bot.get_channel = self.original_get_channel
+        async_db.stop()
+        db_manager.close_connections()
+        db_manager.db_path = self.original_db_path
+        self.temp_dir.cleanup()
+
+    async def test_unposted_games_are_posted_right_away(self):
+        self.assertEqual(await mysticbot.next_free_games_post(NOW), NOW)
+
+        await mysticbot.post_free_games()
+
+        self.assertEqual(len(self.sent), 1)
+        self.assertEqual(len(self.sent[0][1]), 2)
+        self.assertEqual(await mysticbot.next_free_games_post(NOW), EXPIRY + DELAY)
+
+    async def test_next_post_is_the_earliest_expiry_or_upcoming_start(self):
+        await mysticbot.post_free_games()
+
+        self.upcoming_starts = []
+        self.assertEqual(await mysticbot.next_free_games_post(NOW), EXPIRY + DELAY)
+
+        next_start = datetime.datetime(2026, 10, 20, 15, 0, tzinfo=datetime.timezone.utc)
+        self.upcoming_starts = [next_start, EXPIRY]
+        self.assertEqual(await mysticbot.next_free_games_post(NOW), next_start + DELAY)
+
+    async def test_retries_when_nothing_is_scheduled(self):
+        # Epic is listing nothing and has not announced the next promotion
+        self.elements = []
+        self.upcoming_starts = []
+
+        self.assertEqual(await mysticbot.next_free_games_post(NOW), NOW + datetime.timedelta(seconds=scheduler.RETRY_SECONDS))
+
+    async def test_posted_promotions_are_not_posted_again_after_a_restart(self):
+        await mysticbot.post_free_games()
+
+        # A restarted bot has no connections or cached games, only the database
+        async_db.stop()
+        db_manager.close_connections()
+        epicgamesfree.free_games_cache = epicgamesfree.FreeGamesCache()
+
+        self.assertEqual(await mysticbot.next_free_games_post(NOW), EXPIRY + DELAY)
+        await mysticbot.post_free_games()
+        self.assertEqual(len(self.sent), 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+import os
+import sys
+import unittest
+from aiohttp import web
+
+tests_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(tests_dir, '..', 'src'))
+
+import http_client
+import steamsales
+
+FIXTURES_DIR = os.path.join(tests_dir, 'fixtures', 'steam_json')
+PAGE_FIXTURE = os.path.join(tests_dir, '..', 'benchmarks', 'fixtures', 'pages', 'app_1245620.html')
+
+def read_fixture(path):
+    with open(path, encoding='utf-8') as f:
+        return f.read()
+
+class StoreStandIn:
+    '''Serves the recorded store json in place of the steam store, counting the requests it gets'''
+    def __init__(self, details=None, prices='appdetails_prices.json'):
+        # Maps an appid to the appdetails fixture served for it
+        self.details = details or {}
+        self.prices = prices
+        self.requests = []
+
+    async def appdetails(self, request):
+        self.requests.append(request.path_qs)
+        if request.query['filters'] == 'price_overview':
+            return web.Response(text=read_fixture(os.path.join(FIXTURES_DIR, self.prices)), content_type='application/json')
+        appid = request.query['appids']
+        name = self.details.get(appid, f'appdetails_{appid}.json')
+        return web.Response(text=read_fixture(os.path.join(FIXTURES_DIR, name)), content_type='application/json')
+
+    async def appreviews(self, request):
+        self.requests.append(request.path_qs)
+        name = f"appreviews_{request.match_info['appid']}.json"
+        return web.Response(text=read_fixture(os.path.join(FIXTURES_DIR, name)), content_type='application/json')
+
+    async def app_page(self, request):
+        self.requests.append(request.path_qs)
+        return web.Response(text=read_fixture(PAGE_FIXTURE), content_type='text/html')
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get('/api/appdetails', self.appdetails)
+        app.router.add_get('/appreviews/{appid}', self.appreviews)
+        app.router.add_get('/app/{appid}/', self.app_page)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        await site.start()
+        host, port = self.runner.addresses[0][:2]
+        return f"http://{host}:{port}"
+
+    async def stop(self):
+        await self.runner.cleanup()
+
+class JsonBackendTest(unittest.IsolatedAsyncioTestCase):
+    async def start_store(self, details=None, prices='appdetails_prices.json'):
+        self.store = StoreStandIn(details, prices)
+        self.store_url = await self.store.start()
+        self.original_store_url = steamsales.STEAM_STORE_URL
+        steamsales.STEAM_STORE_URL = self.store_url
+
+    async def asyncTearDown(self):
+        steamsales.STEAM_STORE_URL = self.original_store_url
+        await http_client.close_session()
+        await self.store.stop()
+
+    def request(self, appid):
+        return steamsales.GameRequest(appid, f"{self.store_url}/app/{appid}/", True)
+
+    async def test_builds_game_from_json_without_the_store_page(self):
+        await self.start_store()
+        game = (await steamsales.JsonBackend().get_game(self.request('1245620'))).game
+
+        self.assertEqual(game.title, 'Elden Realm')
+        self.assertEqual(game.game_developer, 'Mystic Studio')
+        self.assertEqual(game.game_publisher, 'Grubb Publishing')
+        self.assertEqual((game.original_price, game.discount_price, game.discount_percent, game.is_on_sale), ('59.99', '14.99', '75%', True))
+        self.assertEqual(game.all_ratings, '91% of the 45,892 user reviews for this game are positive.')
+        # appdetails genres are not store tags
+        self.assertEqual(game.tags, [])
+        self.assertFalse(any(path.startswith('/app/') for path in self.store.requests))
+
+    async def test_prices_for_several_games_come_from_one_request(self):
+        await self.start_store()
+        results = await steamsales.JsonBackend().get_games([self.request('1245620'), self.request('292140')])
+
+        self.assertEqual([entry.game.title for entry in results], ['Elden Realm', 'Finality Tale'])
+        self.assertEqual((results[1].game.original_price, results[1].game.is_on_sale), ('19.99', False))
+        price_requests = [path for path in self.store.requests if 'filters=price_overview' in path]
+        self.assertEqual(len(price_requests), 1)
+        self.assertIn('appids=1245620,292140', price_requests[0])
+
+    async def test_missing_details_fall_back_to_the_store_page(self):
+        await self.start_store({'1245620': 'appdetails_missing.json'})
+        game = (await steamsales.JsonBackend().get_game(self.request('1245620'))).game
+
+        self.assertEqual(game.title, 'Elden Realm')
+        self.assertEqual(game.game_developer, 'Mystic Studio')
+        # The batched price still wins over the page's
+        self.assertEqual((game.original_price, game.discount_price), ('59.99', '14.99'))
+        self.assertIn('/app/1245620/', self.store.requests)
+        # Only the required fields come from the page, so these stay empty as they would without the fallback
+        self.assertEqual((game.tags, game.monthly_ratings, game.end_date), ([], None, None))
+
+    async def test_missing_price_comes_from_the_store_page_without_its_end_date(self):
+        await self.start_store(prices='appdetails_no_price.json')
+        game = (await steamsales.JsonBackend().get_game(self.request('1245620'))).game
+
+        self.assertEqual((game.original_price, game.discount_price, game.discount_percent, game.is_on_sale), ('59.99', '14.99', '75%', True))
+        self.assertEqual(game.title, 'Elden Realm')
+        self.assertEqual((game.tags, game.monthly_ratings, game.end_date), ([], None, None))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+import os
+import sqlite3
+import sys
+import tempfile
+import unittest
+
+tests_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(tests_dir, '..', 'src'))
+
+import db_manager
+import migrate
+
+class MigrationTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.original_db_path = db_manager.db_path
+        db_manager.db_path = os.path.join(self.temp_dir.name, 'games_and_interests.db')
+
+    def tearDown(self):
+        db_manager.close_connections()
+        db_manager.db_path = self.original_db_path
+        self.temp_dir.cleanup()
+
+    def create_baseline_database(self):
+        '''Creates the schema the bot shipped with, before any migration was recorded'''
+        baseline = migrate.list_migrations()[0]
+        conn = sqlite3.connect(db_manager.db_path)
+        for statement in migrate.split_statements(baseline.read()):
+            conn.execute(statement)
+        return conn
+
+    def test_hot_queries_use_an_index(self):
+        migrate.migrate_database()
+
+        for name, (ok, plan) in migrate.check_query_plans().items():
+            with self.subTest(query=name):
+                self.assertTrue(ok, f"{name} scans a table: {'; '.join(plan)}")
+
+    def test_migrating_twice_applies_nothing(self):
+        applied = migrate.migrate_database()
+
+        self.assertEqual([migration.version for migration in applied], [migration.version for migration in migrate.list_migrations()])
+        self.assertEqual(migrate.migrate_database(), [])
+
+    def test_baseline_database_is_migrated(self):
+        conn = self.create_baseline_database()
+        conn.execute("INSERT INTO game VALUES (1, 'Cheap', '', 'Dev', 'Pub'), (2, 'Expensive', '', 'Dev', 'Pub'), (3, 'Unknown', '', 'Dev', 'Pub')")
+        conn.executemany("INSERT INTO game_price (game_id, price, currency, is_on_sale, end_date) VALUES (?,?,?,?,?)", [
+            (1, "19.99", "USD", 1, "2026-11-02"),
+            (2, "1,299.99", "USD", 0, "NULL"),
+            (3, "Free To Play", "USD", 0, "NULL"),
+        ])
+        conn.execute("INSERT INTO game_rating (game_id, monthly_rating, all_rating, scrape_date) VALUES (1, 0.9, 0.9, '2026-01-05')")
+        conn.executemany("INSERT INTO tag (tag_id, tag_name) VALUES (?,?)", [(1, "Action"), (2, "RPG"), (3, "Action")])
+        conn.executemany("INSERT INTO game_tag (game_id, tag_id) VALUES (?,?)", [(1, 1), (1, 3), (2, 3), (2, 2)])
+        conn.commit()
+        conn.close()
+
+        migrate.migrate_database()
+
+        with db_manager.reader() as conn:
+            prices = conn.execute("SELECT game_id, price_cents, is_on_sale, end_date, scraped_at FROM price_history ORDER BY game_id").fetchall()
+            tags = conn.execute("SELECT tag_id, tag_name FROM tag ORDER BY tag_id").fetchall()
+            links = conn.execute("SELECT game_id, tag_id FROM game_tag ORDER BY game_id, tag_id").fetchall()
+            old_tables = conn.execute("SELECT name FROM sqlite_master WHERE name = 'game_price'").fetchall()
+
+        self.assertEqual(prices[0], (1, 1999, 1, "2026-11-02", "2026-01-05 00:00:00"))
+        self.assertEqual(prices[1][:4], (2, 129999, 0, None))
+        self.assertEqual(prices[2][:4], (3, None, 0, None))
+        # The duplicate Action tag is merged into the first one and its links follow it
+        self.assertEqual(tags, [(1, "Action"), (2, "RPG")])
+        self.assertEqual(links, [(1, 1), (2, 1), (2, 2)])
+        self.assertEqual(old_tables, [])
+
+if __name__ == '__main__':
+    unittest.main()
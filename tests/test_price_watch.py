@@ -0,0 +1,115 @@
+import os
+import sys
+import tempfile
+import unittest
+
+tests_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(tests_dir, '..', 'src'))
+# mysticbot reads these when it is imported
+os.environ.setdefault('CHANNEL_ID', '1')
+os.environ.setdefault('BOT_TOKEN', 'test')
+
+import async_db
+import db_manager
+import migrate
+import mysticbot
+import price_watch
+import steamsales
+
+GAME_LINK = "https://store.steampowered.com/app/10/Watched_Game/"
+
+def make_game(game_id, price):
+    return steamsales.GameInfo(game_id, f"Game {game_id}", "", [], None, None, price, False, None, None, None,
+        f"https://store.steampowered.com/app/{game_id}/", None, "Dev", "Pub", "2026-10-18")
+
+class FindPriceDropsTest(unittest.TestCase):
+    def find(self, price, target_cents=None, last_notified_cents=None, previous_cents=1999):
+        watches = [(1, 10, target_cents, last_notified_cents, previous_cents)]
+        return price_watch.find_price_drops(watches, {10: make_game(10, price)})
+
+    def test_first_drop_notifies(self):
+        drops, resets = self.find("14.99")
+
+        self.assertEqual([(drop.discord_id, drop.previous_cents, drop.price_cents) for drop in drops], [(1, 1999, 1499)])
+        self.assertEqual(resets, [])
+
+    def test_same_price_again_does_not_notify(self):
+        # The last refresh saw 14.99 and the user was told about it
+        drops, resets = self.find("14.99", last_notified_cents=1499, previous_cents=1499)
+
+        self.assertEqual((drops, resets), ([], []))
+
+    def test_price_that_rises_and_drops_again_notifies_again(self):
+        drops, resets = self.find("19.99", last_notified_cents=1499, previous_cents=1499)
+        self.assertEqual((drops, resets), ([], [(None, 1, 10)]))
+
+        drops, resets = self.find("14.99", last_notified_cents=None, previous_cents=1999)
+        self.assertEqual([drop.price_cents for drop in drops], [1499])
+
+    def test_hitting_the_target_notifies(self):
+        drops, resets = self.find("16.99", target_cents=1500, previous_cents=1999)
+        self.assertEqual(drops, [])
+
+        drops, resets = self.find("14.99", target_cents=1500, previous_cents=1699)
+        self.assertEqual([(drop.price_cents, drop.target_cents) for drop in drops], [(1499, 1500)])
+
+class RefreshWatchesTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.original_db_path = db_manager.db_path
+        db_manager.db_path = os.path.join(self.temp_dir.name, 'games_and_interests.db')
+        migrate.migrate_database()
+
+        self.prices = {10: "19.99"}
+        self.sent = []
+        self.failing = False
+        self.original_get_games_cached = steamsales.get_games_cached
+        self.original_send = mysticbot.send
+        self.original_get_user = mysticbot.bot.get_user
+
+        async def get_games_cached(requests):
+            return [make_game(request.id, self.prices[request.id]) for request in requests]
+
+        async def send(destination, *args, **kwargs):
+            if self.failing:
+                raise RuntimeError("Cannot send messages to this user")
+            self.sent.append((destination, [field.name for embed in kwargs['embeds'] for field in embed.fields]))
+
+        steamsales.get_games_cached = get_games_cached
+        mysticbot.send = send
+        mysticbot.bot.get_user = lambda discord_id: discord_id
+
+    def tearDown(self):
+        steamsales.get_games_cached = self.original_get_games_cached
+        mysticbot.send = self.original_send
+        mysticbot.bot.get_user = self.original_get_user
+        async_db.stop()
+        db_manager.close_connections()
+        db_manager.db_path = self.original_db_path
+        self.temp_dir.cleanup()
+
+    def watched_prices(self):
+        with db_manager.reader() as conn:
+            return conn.execute("SELECT last_notified_cents, last_price_cents FROM watch").fetchone()
+
+    async def test_failed_message_keeps_the_previous_price(self):
+        db_manager.create_user(1, "2026-10-18", "2026-10-18", "casual")
+        await async_db.watch_game(1, make_game(10, "19.99"), GAME_LINK, None, 1999)
+
+        self.prices[10] = "14.99"
+        self.failing = True
+        self.assertEqual(await mysticbot.refresh_watches(), [])
+        self.assertEqual(self.watched_prices(), (None, 1999))
+
+        # The next refresh still finds the drop and sends it
+        self.failing = False
+        drops = await mysticbot.refresh_watches()
+        self.assertEqual([drop.price_cents for drop in drops], [1499])
+        self.assertEqual([destination for destination, fields in self.sent], [1])
+        self.assertEqual(self.watched_prices(), (1499, 1499))
+
+        self.assertEqual(await mysticbot.refresh_watches(), [])
+        self.assertEqual(len(self.sent), 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+import asyncio
+import os
+import sys
+import time
+import unittest
+from aiohttp import web
+
+tests_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(tests_dir, '..', 'src'))
+
+import errors
+import http_client
+import request_scheduler
+import steamsales
+
+RETRY_AFTER = 0.3
+
+class ThrottlingStandIn:
+    '''A store that answers the first throttled_requests requests with a 429 and a Retry-After, then with a page'''
+    def __init__(self, throttled_requests):
+        self.throttled_requests = throttled_requests
+        self.request_times = []
+
+    async def page(self, request):
+        self.request_times.append(time.monotonic())
+        if len(self.request_times) <= self.throttled_requests:
+            return web.Response(status=429, headers={'Retry-After': str(RETRY_AFTER)})
+        return web.Response(text="<html>store page</html>", content_type='text/html')
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get('/page', self.page)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        await site.start()
+        host, port = self.runner.addresses[0][:2]
+        return f"http://{host}:{port}/page"
+
+    async def stop(self):
+        await self.runner.cleanup()
+
+class RequestSchedulerTest(unittest.IsolatedAsyncioTestCase):
+    async def start_store(self, throttled_requests):
+        self.store = ThrottlingStandIn(throttled_requests)
+        self.url = await self.store.start()
+
+    async def asyncTearDown(self):
+        await http_client.close_session()
+        await self.store.stop()
+
+    async def test_retry_waits_for_retry_after(self):
+        await self.start_store(1)
+        scheduler = request_scheduler.scheduler
+        throttled, retried = scheduler.throttled, scheduler.retried
+
+        response = await steamsales.fetch_page(self.url)
+
+        self.assertEqual(response.text, "<html>store page</html>")
+        self.assertEqual(len(self.store.request_times), 2)
+        self.assertGreaterEqual(self.store.request_times[1] - self.store.request_times[0], RETRY_AFTER)
+        self.assertEqual((scheduler.throttled - throttled, scheduler.retried - retried), (1, 1))
+
+    async def test_gives_up_after_max_retries(self):
+        await self.start_store(10)
+        scheduler = request_scheduler.RequestScheduler(max_retries=1)
+        session = http_client.get_session()
+
+        async def attempt():
+            async with session.get(self.url) as response:
+                request_scheduler.check_response(self.url, response.status, response.headers)
+                return await response.text()
+
+        with self.assertRaises(errors.RetryableRequestError) as raised:
+            await scheduler.run(self.url, attempt)
+
+        self.assertEqual((raised.exception.status, raised.exception.retry_after), (429, RETRY_AFTER))
+        self.assertEqual(len(self.store.request_times), 2)
+        self.assertEqual(scheduler.stats()['failed'], 1)
+        # Each 429 halves the host's rate
+        bucket = next(iter(scheduler.buckets.values()))
+        self.assertEqual(bucket.rate, scheduler.rate / 4)
+
+class InFlightLimitTest(unittest.IsolatedAsyncioTestCase):
+    async def test_slots_go_to_waiters_in_order_and_skip_cancelled_ones(self):
+        limit = request_scheduler.InFlightLimit(1)
+        await limit.acquire()
+        order = []
+
+        async def wait(name):
+            await limit.acquire()
+            order.append(name)
+
+        first = asyncio.create_task(wait('first'))
+        cancelled = asyncio.create_task(wait('cancelled'))
+        last = asyncio.create_task(wait('last'))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+
+        limit.release()
+        await first
+        limit.release()
+        await last
+        limit.release()
+
+        self.assertEqual(order, ['first', 'last'])
+        self.assertTrue(cancelled.cancelled())
+        self.assertEqual((limit.in_flight, len(limit.waiters)), (0, 0))
+
+if __name__ == '__main__':
+    unittest.main()